@@ -1,15 +1,18 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import os
 import sys
-import struct
 import threading
-import time
-import zlib
 import tempfile
 from pathlib import Path
-from collections import defaultdict
-import math
+import bisect
+
+from kc_engine import (
+    format_file_size, OptimizedCompression,
+    read_archive_table, write_archive, save_archive_changes, new_member_metadata,
+    plan_folder_sync, create_incremental_archive, extract_member, verify_archive, DirectoryIndex,
+    ProgressTracker, format_duration, scan_directory, walk_files, compress_files, MEMORY_BUDGET, PROFILER,
+    peek_member, looks_like_text, hex_dump, SpooledPayload, adopt_saved_locations, member_sizes
+)
 
 # Try to import tkinterdnd2, but make it optional
 try:
@@ -18,127 +21,525 @@ try:
 except ImportError:
     DND_AVAILABLE = False
 
-COMPRESSED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.mp3', '.mp4', '.avi', '.mkv', '.zip', '.rar', '.7z', '.gz', '.exe', '.dll', '.pdf', '.apk', '.webp'}
+def file_icon(file_type):
+    """Emoji shown in front of an archive member of the given type"""
+    if file_type in ['.txt', '.md', '.py', '.js', '.html', '.css']:
+        return "📝"
+    elif file_type in ['.jpg', '.png', '.gif', '.bmp', '.jpeg']:
+        return "🖼️"
+    elif file_type in ['.mp3', '.wav', '.flac', '.ogg']:
+        return "🎵"
+    elif file_type in ['.mp4', '.avi', '.mkv', '.mov']:
+        return "🎬"
+    elif file_type in ['.zip', '.rar', '.7z', '.tar']:
+        return "📦"
+    elif file_type in ['.exe', '.app', '.deb', '.dmg']:
+        return "⚙️"
+    return "📄"
 
-def should_compress(filename):
-    return Path(filename).suffix.lower() not in COMPRESSED_EXTENSIONS
 
-class OptimizedCompression:
-    """Optimized compression that uses less RAM and handles large files better"""
-    
-    # Reduced chunk sizes for better memory management
-    SMALL_CHUNK = 64 * 1024      # 64KB for compression chunks
-    LARGE_CHUNK = 1024 * 1024    # 1MB for file processing
-    STREAM_THRESHOLD = 10 * 1024 * 1024  # 10MB threshold for streaming
-    
-    @staticmethod
-    def compress_smart(data, progress_callback=None):
-        """Smart compression that adapts to data size and type"""
-        if len(data) < 100:
-            return b'\x00' + data
-        
-        # For very large data, use streaming compression
-        if len(data) > OptimizedCompression.STREAM_THRESHOLD:
-            return OptimizedCompression._compress_streaming(data, progress_callback)
-        
-        # For medium data, use chunked compression with limited techniques
-        if len(data) > OptimizedCompression.LARGE_CHUNK:
-            return OptimizedCompression._compress_chunked_smart(data, progress_callback)
-        
-        # For small data, use fast single-pass compression
-        return OptimizedCompression._compress_fast(data, progress_callback)
-    
-    @staticmethod
-    def _compress_streaming(data, progress_callback=None):
-        """Stream large files through compression to avoid RAM overload"""
-        # Use zlib with streaming for large files
-        compressor = zlib.compressobj(level=6, wbits=15)
-        compressed_chunks = []
-        total_size = len(data)
-        processed = 0
-        
-        # Process in small chunks to keep memory usage low
-        chunk_size = OptimizedCompression.SMALL_CHUNK
-        
-        for i in range(0, len(data), chunk_size):
-            chunk = data[i:i+chunk_size]
-            compressed_chunk = compressor.compress(chunk)
-            if compressed_chunk:
-                compressed_chunks.append(compressed_chunk)
-            
-            processed += len(chunk)
-            
-            if progress_callback and i % (chunk_size * 10) == 0:  # Update every 10 chunks
-                progress = (processed / total_size) * 100
-                progress_callback(progress)
-        
-        # Finalize compression
-        final_chunk = compressor.flush()
-        if final_chunk:
-            compressed_chunks.append(final_chunk)
-        
-        if progress_callback:
-            progress_callback(100)
-        
-        return b'\x01' + b''.join(compressed_chunks)
-    
-    @staticmethod
-    def _compress_chunked_smart(data, progress_callback=None):
-        """Efficient chunked compression for medium-sized files"""
-        # Use zlib with good compression but not maximum to save time
-        try:
-            if progress_callback:
-                progress_callback(25)
-            
-            compressed = zlib.compress(data, level=7)  # Reduced from 9 for speed
-            
-            if progress_callback:
-                progress_callback(100)
-            
-            return b'\x02' + compressed
-        except:
-            # Fallback to no compression if zlib fails
-            return b'\x00' + data
-    
-    @staticmethod
-    def _compress_fast(data, progress_callback=None):
-        """Fast compression for small files"""
-        try:
-            if progress_callback:
-                progress_callback(50)
-            
-            # Use fast zlib compression
-            compressed = zlib.compress(data, level=3)
-            
-            if progress_callback:
-                progress_callback(100)
-            
-            return b'\x03' + compressed
-        except:
-            return b'\x00' + data
-    
-    @staticmethod
-    def decompress_smart(data):
-        """Smart decompression that handles all compression types"""
-        if len(data) == 0:
-            return b''
-        
-        compression_type = data[0]
-        compressed_data = data[1:]
-        
-        if compression_type == 0:  # No compression
-            return compressed_data
-        elif compression_type in [1, 2, 3]:  # zlib variants
-            try:
-                return zlib.decompress(compressed_data)
-            except:
-                # Fallback to raw data if decompression fails
-                return compressed_data
+class VirtualArchiveView:
+    """Archive member list that only creates Treeview rows for what is on screen.
+
+    The tree holds just enough items to fill its visible height; scrolling rewrites
+    their text instead of inserting more. Members are tracked by name, so selection
+    survives scrolling, and callers feed in add/remove diffs rather than rebuilding.
+    Sort keys and lowercased names for the filter are computed once per member.
+
+    In folder mode the rows come from a DirectoryIndex instead: only expanded folders
+    contribute their children, folder rows ('a/b/') show totals for their subtree, and
+    selecting one selects every member below it. A non-empty filter always shows the
+    flat list of matches.
+    """
+
+    SORT_COLUMNS = ("#0", "size", "compressed", "ratio", "type")
+    NAVIGATION_KEYS = ("Up", "Down", "Prior", "Next", "Home", "End", "Left", "Right", "Return")
+    INDENT = "    "
+
+    def __init__(self, tree, scrollbar, format_size):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.format_size = format_size
+
+        self.metadata = {}       # the archive_metadata dict the rows come from
+        self.known = {}          # name -> (size, compressed_size) as last counted in the totals
+        self.names = []          # every member in display order (insertion order or sorted)
+        self.order = []          # self.names narrowed down by the filter
+        self.sort_keys = {}      # name -> key for the current sort column
+        self.lower_names = None  # name -> lowercased name, built the first time a filter is used
+        self.sort_column = None
+        self.sort_reverse = False
+        self.filter_text = ""
+
+        self.folder_mode = False
+        self.index = None        # DirectoryIndex, built the first time folder mode is used
+        self.expanded = set()    # folder paths whose children are shown
+        self.folder_rows = []    # flattened rows of the expanded tree
+        self._rows_dirty = True
+
+        self.selected = set()
+        self.anchor = None
+        self.cursor = None
+        self.on_select = None    # called with no arguments when the user changes the selection
+        self.top = 0
+        self.slots = []          # Treeview item ids, one per visible row
+        self.row_height = 20
+        self.header_height = 25
+        self._render_pending = False
+
+        self.total_original = 0
+        self.total_compressed = 0
+
+        self.heading_text = {column: tree.heading(column, "text") for column in self.SORT_COLUMNS}
+        for column in self.SORT_COLUMNS:
+            tree.heading(column, command=lambda c=column: self.sort_by(c))
+
+        scrollbar.configure(command=self.yview)
+        tree.bind("<Configure>", lambda e: self.schedule_render())
+        tree.bind("<Button-1>", self._on_click)
+        tree.bind("<Double-Button-1>", self._on_double_click)
+        tree.bind("<MouseWheel>", self._on_mousewheel)
+        tree.bind("<Button-4>", lambda e: self._scroll(-3))
+        tree.bind("<Button-5>", lambda e: self._scroll(3))
+        tree.bind("<KeyPress>", self._on_key)
+        tree.bind("<Control-a>", self._select_all)
+
+    # --- diffs -----------------------------------------------------------
+
+    def sync(self, archive_metadata):
+        """Bring the view in line with archive_metadata, touching only what changed"""
+        if archive_metadata is not self.metadata:
+            # A different archive was opened or created - start from scratch
+            self.reset()
+            self.metadata = archive_metadata
+            self._count(member_sizes(archive_metadata))
+            return
+        removed = [name for name in self.known if name not in archive_metadata]
+        changed = [(name, size, compressed_size) for name, size, compressed_size in member_sizes(archive_metadata)
+                   if self.known.get(name) != (size, compressed_size)]
+        if removed:
+            self.remove(removed)
+        if changed:
+            self._count(changed)
+
+    def reset(self):
+        """Forget every member"""
+        self.metadata = {}
+        self.known = {}
+        self.names = self.order = []
+        self.sort_keys = {}
+        if self.lower_names is not None:
+            self.lower_names = {}
+        if self.index is not None:
+            self.index = DirectoryIndex()
+        self.expanded = set()
+        self._rows_dirty = True
+        self.selected = set()
+        self.anchor = self.cursor = None
+        self.top = 0
+        self.total_original = 0
+        self.total_compressed = 0
+        self.schedule_render()
+
+    def update(self, archive_metadata, names):
+        """Add new members or refresh changed ones"""
+        self.metadata = archive_metadata
+        self._count((name, metadata['size'], metadata['compressed_size'])
+                    for name, metadata in zip(names, map(archive_metadata.get, names)) if metadata is not None)
+
+    def _count(self, sizes):
+        """Add or refresh members given as (name, size, compressed size)"""
+        added = []
+        for name, size, compressed_size in sizes:
+            counted = (size, compressed_size)
+            previous = self.known.get(name)
+            if previous is not None:
+                if previous == counted:
+                    continue
+                self.total_original -= previous[0]
+                self.total_compressed -= previous[1]
+                if self.sort_column in ("size", "compressed", "ratio"):
+                    self._unplace(name)
+                    self._place(name)
+            else:
+                if self.lower_names is not None:
+                    self.lower_names[name] = name.lower()
+                added.append(name)
+            self.known[name] = counted
+            self.total_original += counted[0]
+            self.total_compressed += counted[1]
+            if self.index is not None:
+                self.index.add(name, counted[0], counted[1])
+                self._rows_dirty = True
+
+        if len(added) > 64 and self.sort_column is not None:
+            # Re-sorting once beats thousands of list inserts
+            for name in added:
+                self.sort_keys[name] = self._sort_key(name)
+            self.names.extend(added)
+            self.names.sort(key=self.sort_keys.__getitem__)
+            self._apply_filter()
+        else:
+            for name in added:
+                self._place(name)
+        self.schedule_render()
+
+    def remove(self, names):
+        """Drop members from the view"""
+        gone = set()
+        for name in names:
+            counted = self.known.pop(name, None)
+            if counted is None:
+                continue
+            self.total_original -= counted[0]
+            self.total_compressed -= counted[1]
+            self.sort_keys.pop(name, None)
+            if self.lower_names is not None:
+                self.lower_names.pop(name, None)
+            if self.index is not None:
+                self.index.remove(name)
+                self._rows_dirty = True
+            gone.add(name)
+        if not gone:
+            return
+        filtered = self.order is not self.names
+        self.names = [name for name in self.names if name not in gone]
+        self.order = [name for name in self.order if name not in gone] if filtered else self.names
+        self.selected -= gone
+        self.schedule_render()
+
+    def _sort_key(self, name):
+        metadata = self.metadata[name]
+        if self.sort_column == "size":
+            key = metadata['size']
+        elif self.sort_column == "compressed":
+            key = metadata['compressed_size']
+        elif self.sort_column == "ratio":
+            key = metadata['compressed_size'] / metadata['size'] if metadata['size'] else 0.0
+        elif self.sort_column == "type":
+            key = (metadata['type'] or "").lower()
+        else:
+            key = name.lower()
+        return (key, name)
+
+    def _matches(self, name):
+        return not self.filter_text or self.filter_text in self.lower_names[name]
+
+    def _place(self, name):
+        """Insert a name into names/order at its sorted position (or at the end when unsorted)"""
+        lists = [self.names] if self.order is self.names else [self.names, self.order]
+        if self.sort_column is None:
+            for i, names in enumerate(lists):
+                if i == 0 or self._matches(name):
+                    names.append(name)
+            return
+        key = self.sort_keys[name] = self._sort_key(name)
+        for i, names in enumerate(lists):
+            if i == 0 or self._matches(name):
+                names.insert(bisect.bisect_left(names, key, key=self.sort_keys.__getitem__), name)
+
+    def _unplace(self, name):
+        """Take a name out of names/order using its current sort key"""
+        key = self.sort_keys[name]
+        lists = [self.names] if self.order is self.names else [self.names, self.order]
+        for names in lists:
+            index = bisect.bisect_left(names, key, key=self.sort_keys.__getitem__)
+            if index < len(names) and names[index] == name:
+                del names[index]
+
+    # --- sorting and filtering -------------------------------------------
+
+    def sort_by(self, column):
+        """Sort by a column; clicking the same heading again reverses the order"""
+        if self.sort_column == column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column = column
+            self.sort_reverse = False
+            self.sort_keys = {name: self._sort_key(name) for name in self.known}
+            self.names.sort(key=self.sort_keys.__getitem__)
+            self._apply_filter()
+        for heading, text in self.heading_text.items():
+            arrow = (" ▼" if self.sort_reverse else " ▲") if heading == column else ""
+            self.tree.heading(heading, text=text + arrow)
+        self._rows_dirty = True
+        self.top = 0
+        self.schedule_render()
+
+    def set_filter(self, text):
+        """Only show members whose name contains text (case-insensitive)"""
+        self.filter_text = text.strip().lower()
+        if self.filter_text and self.lower_names is None:
+            self.lower_names = {name: name.lower() for name in self.known}
+        self._apply_filter()
+        self.top = 0
+        self.schedule_render()
+
+    def _apply_filter(self):
+        if self.filter_text:
+            self.order = [name for name in self.names if self.filter_text in self.lower_names[name]]
+        else:
+            self.order = self.names
+
+    # --- folder mode -----------------------------------------------------
+
+    def set_folder_mode(self, enabled):
+        """Switch between the flat member list and the collapsible folder tree"""
+        self.folder_mode = enabled
+        if enabled and self.index is None:
+            self.index = DirectoryIndex()
+            for name, (size, compressed_size) in self.known.items():
+                self.index.add(name, size, compressed_size)
+        self._rows_dirty = True
+        self.selected = set()
+        self.anchor = self.cursor = None
+        self.top = 0
+        self.schedule_render()
+
+    def toggle_folder(self, folder_path, expand=None):
+        """Expand or collapse a folder row"""
+        if expand is None:
+            expand = folder_path not in self.expanded
+        if expand:
+            self.expanded.add(folder_path)
+        else:
+            self.expanded.discard(folder_path)
+        self._rows_dirty = True
+        self.render()
+
+    def _showing_folders(self):
+        return self.folder_mode and not self.filter_text
+
+    def _rows(self):
+        """The list the visible rows are taken from"""
+        if not self._showing_folders():
+            return self.order
+        if self._rows_dirty:
+            self.folder_rows = []
+            self._flatten(self.index.root)
+            self._rows_dirty = False
+        return self.folder_rows
+
+    def _flatten(self, node):
+        """Append the rows under node: sorted subfolders (recursing into expanded ones), then files"""
+        folders = list(node.folders.values())
+        if self.sort_column in ("size", "compressed", "ratio"):
+            folder_key = {
+                "size": lambda f: f.size,
+                "compressed": lambda f: f.compressed_size,
+                "ratio": lambda f: f.compressed_size / f.size if f.size else 0.0,
+            }[self.sort_column]
+            folders.sort(key=lambda f: (folder_key(f), f.path), reverse=self.sort_reverse)
+        else:
+            folders.sort(key=lambda f: f.path.lower(), reverse=self.sort_reverse and self.sort_column is not None)
+        for folder in folders:
+            self.folder_rows.append(folder.path)
+            if folder.path in self.expanded:
+                self._flatten(folder)
+
+        files = list(node.files)
+        if self.sort_column is not None:
+            files.sort(key=self._sort_key, reverse=self.sort_reverse)
+        self.folder_rows.extend(files)
+
+    def _folder_of_row(self, row):
+        """Folder path for a folder row, None for a member row"""
+        return row if self._showing_folders() and row not in self.known else None
+
+    # --- selection -------------------------------------------------------
+
+    def selected_names(self):
+        """Names of the selected members that are still in the archive, with folders expanded"""
+        names = {name for name in self.selected if name in self.known}
+        if self.index is not None:
+            for row in self.selected:
+                if row not in self.known and row in self.index.folders:
+                    names.update(self.index.members_under(row))
+        return list(names)
+
+    def _name_at(self, index):
+        if self._showing_folders():
+            return self._rows()[index]
+        return self.order[-1 - index] if self.sort_reverse else self.order[index]
+
+    def _select_index(self, index, extend=False, toggle=False):
+        name = self._name_at(index)
+        if toggle:
+            self.selected ^= {name}
+            self.anchor = index
+        elif extend and self.anchor is not None:
+            low, high = sorted((min(self.anchor, len(self._rows()) - 1), index))
+            self.selected = {self._name_at(i) for i in range(low, high + 1)}
+        else:
+            self.selected = {name}
+            self.anchor = index
+        self.cursor = index
+        self._scroll_into_view(index)
+        self.render()
+        if self.on_select is not None:
+            self.on_select()
+
+    def _select_all(self, event=None):
+        self.selected = set(self._rows())
+        self.render()
+        if self.on_select is not None:
+            self.on_select()
+        return "break"
+
+    def _on_click(self, event):
+        # Headings and column separators keep their normal behaviour
+        if self.tree.identify_region(event.x, event.y) not in ("tree", "cell"):
+            return None
+        self.tree.focus_set()
+        slot = self.tree.identify_row(event.y)
+        if slot in self.slots:
+            self._select_index(self.top + self.slots.index(slot),
+                               extend=bool(event.state & 0x0001), toggle=bool(event.state & 0x0004))
+        return "break"
+
+    def _on_double_click(self, event):
+        slot = self.tree.identify_row(event.y)
+        if slot in self.slots:
+            folder_path = self._folder_of_row(self._name_at(self.top + self.slots.index(slot)))
+            if folder_path is not None:
+                self.toggle_folder(folder_path)
+        return "break"
+
+    def _on_key(self, event):
+        if event.keysym not in self.NAVIGATION_KEYS:
+            return None
+        rows = self._rows()
+        if not rows:
+            return "break"
+        page = max(1, len(self.slots) - 1)
+        current = self.cursor if self.cursor is not None and self.cursor < len(rows) else self.top
+
+        if event.keysym in ("Left", "Right", "Return"):
+            row = self._name_at(current)
+            folder_path = self._folder_of_row(row)
+            if folder_path is not None and (event.keysym == "Return" or
+                                            (event.keysym == "Right") != (folder_path in self.expanded)):
+                self.toggle_folder(folder_path)
+            elif event.keysym == "Left" and self._showing_folders():
+                # Jump to the parent folder row
+                parent, _ = DirectoryIndex.split(row.rstrip('/'))
+                if parent:
+                    self._select_index(self.folder_rows.index(parent))
+            return "break"
+
+        index = {
+            "Up": current - 1, "Down": current + 1,
+            "Prior": current - page, "Next": current + page,
+            "Home": 0, "End": len(rows) - 1,
+        }[event.keysym]
+        self._select_index(max(0, min(index, len(rows) - 1)), extend=bool(event.state & 0x0001))
+        return "break"
+
+    # --- scrolling and drawing -------------------------------------------
+
+    def yview(self, *args):
+        """Scrollbar command: 'moveto fraction' or 'scroll n units|pages'"""
+        if args and args[0] == "moveto":
+            self.top = int(float(args[1]) * len(self._rows()))
+            self.render()
+        elif args and args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= max(1, len(self.slots) - 1)
+            self._scroll(step)
+
+    def _on_mousewheel(self, event):
+        # Windows reports multiples of 120 per notch, macOS small deltas
+        notches = event.delta // 120 if abs(event.delta) >= 120 else (1 if event.delta > 0 else -1)
+        self._scroll(-3 * notches)
+        return "break"
+
+    def _scroll(self, rows):
+        self.top += rows
+        self.render()
+        return "break"
+
+    def _scroll_into_view(self, index):
+        visible = self._visible_rows()
+        if index < self.top:
+            self.top = index
+        elif index >= self.top + visible:
+            self.top = index - visible + 1
+
+    def _visible_rows(self):
+        if self.slots:
+            bbox = self.tree.bbox(self.slots[0])
+            if bbox:
+                self.header_height = bbox[1]
+                self.row_height = max(1, bbox[3])
+        return max(1, (self.tree.winfo_height() - self.header_height) // self.row_height)
+
+    def schedule_render(self):
+        """Redraw once the current batch of changes has been applied"""
+        if not self._render_pending:
+            self._render_pending = True
+            self.tree.after_idle(self.render)
+
+    def render(self):
+        """Write the members at top..top+visible into the recycled Treeview items"""
+        self._render_pending = False
+        tree = self.tree
+        showing_folders = self._showing_folders()
+        total = len(self._rows())
+        visible = self._visible_rows()
+        self.top = max(0, min(self.top, total - visible))
+        count = min(visible, total - self.top)
+
+        while len(self.slots) < count:
+            self.slots.append(tree.insert("", "end", text=""))
+        while len(self.slots) > count:
+            tree.delete(self.slots.pop())
+
+        selected_slots = []
+        for i, slot in enumerate(self.slots):
+            name = self._name_at(self.top + i)
+            folder = self.index.folders[name] if showing_folders and name not in self.known else None
+            if folder is not None:
+                original_size = folder.size
+                compressed_size = folder.compressed_size
+                depth = name.count('/') - 1
+                arrow = "▾" if name in self.expanded else "▸"
+                text = f"{self.INDENT * depth}{arrow} 📁 {name[:-1].rpartition('/')[2]}"
+                kind = f"{folder.count} files"
+            else:
+                metadata = self.metadata[name]
+                original_size = metadata['size']
+                compressed_size = metadata['compressed_size']
+                kind = metadata['type'] or "file"
+                if showing_folders:
+                    folder_path, base = DirectoryIndex.split(name)
+                    text = f"{self.INDENT * folder_path.count('/')}  {file_icon(metadata['type'])} {base}"
+                else:
+                    text = f"{file_icon(metadata['type'])} {name}"
+            ratio = f"{(compressed_size / original_size * 100):.1f}%" if original_size > 0 else "0%"
+            tree.item(slot, text=text,
+                      values=(self.format_size(original_size), self.format_size(compressed_size),
+                              ratio, kind))
+            if name in self.selected:
+                selected_slots.append(slot)
+        tree.selection_set(selected_slots)
+        if self.cursor is not None and self.top <= self.cursor < self.top + count:
+            tree.focus(self.slots[self.cursor - self.top])
+
+        if total:
+            self.scrollbar.set(self.top / total, (self.top + count) / total)
         else:
-            # Unknown compression type, return raw data
-            return compressed_data
+            self.scrollbar.set(0, 1)
+
 
 class KlondikeArchiver:
+    PROGRESS_FRAME_MS = 100     # how often the progress bar polls the worker's tracker
+    RESULTS_PER_FRAME = 5000    # added members applied to the archive view per progress poll
+    LISTING_CHUNK = 2000        # file browser rows inserted per event-loop turn
+    LISTING_CACHE_SIZE = 64     # directories whose listings are kept, keyed by mtime
+    PREVIEW_BYTES = 16 * 1024   # how much of the selected member the preview pane decompresses
+    PREVIEW_DELAY_MS = 150      # wait for the selection to settle before previewing
+
     def __init__(self, root):
         self.root = root
         self.root.title("Klondike Archiver")
@@ -159,6 +560,18 @@ class KlondikeArchiver:
             self.current_directory = Path.home()
         
         self.unsaved_changes = False
+        self.progress_tracker = None
+        self.progress_message = ""
+
+        # File browser state: rows shown in file_listbox and cached directory listings
+        self.browser_entries = []   # (name, is_dir, size) per listbox row
+        self.listing_cache = {}     # directory -> (mtime_ns, entries)
+        self.listing_generation = 0
+
+        # Preview pane state: the member shown and a counter that drops stale results
+        self.preview = None         # (name, size, data) of the member in the preview pane
+        self.preview_generation = 0
+        self._preview_pending = None
         
         # Configure style
         self.setup_styles()
@@ -241,17 +654,7 @@ class KlondikeArchiver:
                 # Get current selection for dragging
                 selected_indices = self.file_listbox.curselection()
                 if selected_indices:
-                    files_to_drag = []
-                    for sel_index in selected_indices:
-                        try:
-                            item_text = self.file_listbox.get(sel_index)
-                            if item_text.startswith("📄"):
-                                filename = item_text[2:].split(" (")[0].strip()
-                                file_path = self.current_directory / filename
-                                if file_path.exists() and file_path.is_file():
-                                    files_to_drag.append((filename, file_path))
-                        except:
-                            continue
+                    files_to_drag = self._selected_browser_files(selected_indices)
                     
                     if files_to_drag:
                         self.is_dragging = True
@@ -301,59 +704,21 @@ class KlondikeArchiver:
         """Add files from internal drag operation"""
         if not self.drag_data:
             return
+        drag_data = list(self.drag_data)
         
         def worker():
             try:
-                self.root.after(0, lambda: self.show_progress("Adding dragged files..."))
-                added_count = 0
+                progress = ProgressTracker(len(drag_data), self._total_size(path for _, path in drag_data))
+                self.root.after(0, lambda: self.show_progress("Adding dragged files...", progress))
                 
-                for i, (filename, file_path) in enumerate(self.drag_data):
-                    try:
-                        progress = (i / len(self.drag_data)) * 100
-                        self.root.after(0, lambda p=progress, name=filename:
-                                        self.update_progress(p, f"Processing {name}..."))
-                        
-                        # Check if file still exists
-                        if not file_path.exists():
-                            continue
-                            
-                        file_size = file_path.stat().st_size
-                        
-                        with open(file_path, 'rb') as f:
-                            file_data = f.read()
-                        
-                        if should_compress(filename):
-                            compressed_data = OptimizedCompression.compress_smart(file_data)
-                        else:
-                            compressed_data = b'\x00' + file_data
-                        
-                        original_size = len(file_data)
-                        compressed_size = len(compressed_data)
-                        
-                        def add_metadata():
-                            self._add_file_metadata(filename, file_path, original_size, compressed_size)
-                        
-                        self.root.after(0, add_metadata)
-                        
-                        if file_size > OptimizedCompression.LARGE_CHUNK:
-                            temp_file = self.temp_dir / f"{filename}.tmp"
-                            with open(temp_file, 'wb') as f:
-                                f.write(compressed_data)
-                        
-                        added_count += 1
-                        
-                        del file_data
-                        del compressed_data
-                        
-                    except Exception as e:
-                        self.root.after(0, lambda err=str(e), name=filename:
-                                      messagebox.showerror("Error", f"Failed to add {name}: {err}"))
+                added_count, _ = self._add_compressed_files(
+                    compress_files(self._stat_files(drag_data), spool_dir=self.temp_dir), progress)
                 
                 def on_complete():
                     self.hide_progress()
                     if added_count > 0:
                         self.mark_unsaved_changes()
-                        self.refresh_archive_tree()
+                        self.update_archive_banner()
                         self.update_archive_info()
                         self.status_var.set(f"✅ Added {added_count} file(s) via drag and drop!")
                     else:
@@ -362,9 +727,11 @@ class KlondikeArchiver:
                 self.root.after(0, on_complete)
                 
             except Exception as e:
+                err = str(e)
+
                 def on_error():
                     self.hide_progress()
-                    messagebox.showerror("Drag Error", f"Failed to add dragged files: {e}")
+                    messagebox.showerror("Drag Error", f"Failed to add dragged files: {err}")
                 
                 self.root.after(0, on_error)
         
@@ -414,109 +781,23 @@ class KlondikeArchiver:
         """Process files and folders dropped from Windows Explorer"""
         def worker():
             try:
-                total_items = len(files) + len(folders)
                 processed_files = 0
                 
-                self.root.after(0, lambda: self.show_progress("Processing dropped items..."))
+                # Folder contents are added to the totals as each folder is scanned
+                progress = ProgressTracker(len(files), self._total_size(files))
+                self.root.after(0, lambda: self.show_progress("Processing dropped items...", progress))
                 
                 # Process individual files first
-                for i, file_path in enumerate(files):
-                    try:
-                        progress = (i / total_items) * 50 if total_items > 0 else 0  # FIX: Division by zero
-                        self.root.after(0, lambda p=progress, name=file_path.name:
-                                        self.update_progress(p, f"Adding {name}..."))
-                        
-                        file_size = file_path.stat().st_size
-                        
-                        with open(file_path, 'rb') as f:
-                            file_data = f.read()
-                        
-                        # Compress based on file type
-                        if should_compress(file_path.name):
-                            compressed_data = OptimizedCompression.compress_smart(file_data)
-                        else:
-                            compressed_data = b'\x00' + file_data
-                        
-                        # Store metadata
-                        original_size = len(file_data)
-                        compressed_size = len(compressed_data)
-                        
-                        def add_file_metadata():
-                            self._add_file_metadata(file_path.name, file_path, original_size, compressed_size)
-                        
-                        self.root.after(0, add_file_metadata)
-                        
-                        # Save large files to temp directory
-                        if file_size > OptimizedCompression.LARGE_CHUNK:
-                            temp_file = self.temp_dir / f"{file_path.name}.tmp"
-                            with open(temp_file, 'wb') as f:
-                                f.write(compressed_data)
-                        
-                        processed_files += 1
-                        
-                        # Clean up memory
-                        del file_data
-                        del compressed_data
-                        
-                    except Exception as e:
-                        self.root.after(0, lambda err=str(e), name=file_path.name:
-                                      messagebox.showerror("Error", f"Failed to add {name}: {err}"))
+                added_count, _ = self._add_compressed_files(
+                    compress_files(self._stat_files((path.name, path) for path in files), spool_dir=self.temp_dir), progress)
+                processed_files += added_count
                 
                 # Process folders
-                for i, folder_path in enumerate(folders):
+                for folder_path in folders:
                     try:
-                        base_progress = 50 + (i / len(folders)) * 50 if len(folders) > 0 else 50  # FIX: Division by zero
-                        self.root.after(0, lambda p=base_progress, name=folder_path.name:
-                                        self.update_progress(p, f"Processing folder {name}..."))
-                        
-                        # Collect all files in the folder
-                        folder_files = []
-                        for file_path in folder_path.rglob('*'):
-                            if file_path.is_file():
-                                relative_path = file_path.relative_to(folder_path.parent)
-                                folder_files.append((str(relative_path), file_path))
-                        
-                        # Process each file in the folder
-                        for j, (relative_name, file_path) in enumerate(folder_files):
-                            try:
-                                file_progress = base_progress + (j / len(folder_files)) * (50 / len(folders)) if len(folder_files) > 0 and len(folders) > 0 else base_progress
-                                self.root.after(0, lambda p=file_progress, name=file_path.name:
-                                              self.update_progress(p, f"Adding {name}..."))
-                                
-                                file_size = file_path.stat().st_size
-                                
-                                with open(file_path, 'rb') as f:
-                                    file_data = f.read()
-                                
-                                if should_compress(relative_name):
-                                    compressed_data = OptimizedCompression.compress_smart(file_data)
-                                else:
-                                    compressed_data = b'\x00' + file_data
-                                
-                                original_size = len(file_data)
-                                compressed_size = len(compressed_data)
-                                
-                                def add_folder_file_metadata():
-                                    self._add_file_metadata(relative_name, file_path, original_size, compressed_size)
-                                
-                                self.root.after(0, add_folder_file_metadata)
-                                
-                                # Save large files to temp directory
-                                if file_size > OptimizedCompression.LARGE_CHUNK:
-                                    temp_file = self.temp_dir / f"{relative_name.replace('/', '_').replace('\\', '_')}.tmp"
-                                    temp_file.parent.mkdir(parents=True, exist_ok=True)
-                                    with open(temp_file, 'wb') as f:
-                                        f.write(compressed_data)
-                                
-                                processed_files += 1
-                                
-                                # Clean up memory
-                                del file_data
-                                del compressed_data
-                                
-                            except Exception as e:
-                                self.root.after(0, lambda err=str(e), name=relative_name:
-                                              messagebox.showerror("Error", f"Failed to add {name}: {err}"))
+                        added_count, _ = self._add_compressed_files(
+                            compress_files(walk_files(folder_path, tracker=progress), spool_dir=self.temp_dir), progress)
+                        processed_files += added_count
                         
                     except Exception as e:
                         self.root.after(0, lambda err=str(e), name=folder_path.name:
@@ -526,7 +807,7 @@ class KlondikeArchiver:
                     self.hide_progress()
                     if processed_files > 0:
                         self.mark_unsaved_changes()
-                        self.refresh_archive_tree()
+                        self.update_archive_banner()
                         self.update_archive_info()
                         
                         item_count = len(files) + len(folders)
@@ -537,9 +818,11 @@ class KlondikeArchiver:
                 self.root.after(0, on_complete)
                 
             except Exception as e:
+                err = str(e)
+
                 def on_error():
                     self.hide_progress()
-                    messagebox.showerror("Drop Error", f"Failed to process dropped items: {e}")
+                    messagebox.showerror("Drop Error", f"Failed to process dropped items: {err}")
                 
                 self.root.after(0, on_error)
         
@@ -553,7 +836,11 @@ class KlondikeArchiver:
         except:
             self.temp_dir = Path.cwd() / "temp_klondike"
             self.temp_dir.mkdir(exist_ok=True)
-    
+
+    def _temp_path(self, filename):
+        """Temp file used to spool the compressed data of an archive member"""
+        return self.temp_dir / (filename.replace('/', '_').replace('\\', '_') + ".tmp")
+
     def _cleanup_temp_dir(self):
         """Clean up temporary directory"""
         if self.temp_dir and self.temp_dir.exists():
@@ -666,6 +953,8 @@ class KlondikeArchiver:
                   style='Action.TButton').pack(side=tk.LEFT, padx=5)
         ttk.Button(file_ops_frame, text="💾 Save As", command=self.save_archive_as, 
                   style='Action.TButton').pack(side=tk.LEFT, padx=5)
+        ttk.Button(file_ops_frame, text="🧩 Incremental", command=self.create_incremental_backup,
+                  style='Action.TButton').pack(side=tk.LEFT, padx=5)
         
         # Quick stats (fixed width to prevent resizing)
         self.stats_frame = ttk.LabelFrame(toolbar_frame, text="📊 Statistics", padding="5")
@@ -682,6 +971,12 @@ class KlondikeArchiver:
                                font=("Segoe UI", 8, "bold"), justify=tk.CENTER,
                                wraplength=170, anchor=tk.CENTER)
         stats_label.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
+
+        # Peak of the shared memory budget (see kc_engine.MemoryBudget)
+        self.memory_var = tk.StringVar()
+        ttk.Label(self.stats_frame, textvariable=self.memory_var,
+                 font=("Segoe UI", 7)).pack()
+        self.update_memory_stats()
         
         # Main workspace
         workspace = ttk.Frame(main_frame)
@@ -752,7 +1047,11 @@ class KlondikeArchiver:
         ttk.Button(add_frame, text="📁 Add Entire Folder", 
                   command=self.add_folder_to_archive, 
                   style='Action.TButton').grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
-        
+
+        ttk.Button(add_frame, text="🔄 Sync Folder",
+                  command=self.sync_folder_to_archive,
+                  style='Action.TButton').grid(row=2, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
+
         # Right panel - Archive contents
         right_panel_text = "📦 Archive Contents (Drop files from Windows Explorer here!)" if DND_AVAILABLE else "📦 Archive Contents"
         right_panel = ttk.LabelFrame(workspace, text=right_panel_text, padding="15")
@@ -782,12 +1081,24 @@ class KlondikeArchiver:
         tree_frame = ttk.Frame(right_panel)
         tree_frame.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         tree_frame.columnconfigure(0, weight=1)
-        tree_frame.rowconfigure(0, weight=1)
+        tree_frame.rowconfigure(1, weight=1)
+
+        filter_row = ttk.Frame(tree_frame)
+        filter_row.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 5))
+        filter_row.columnconfigure(1, weight=1)
+        ttk.Label(filter_row, text="🔎 Filter:", font=("Segoe UI", 9)).grid(row=0, column=0, padx=(0, 5))
+        self.archive_filter_var = tk.StringVar()
+        self.archive_filter_var.trace_add("write", lambda *args: self.archive_view.set_filter(self.archive_filter_var.get()))
+        ttk.Entry(filter_row, textvariable=self.archive_filter_var).grid(row=0, column=1, sticky=(tk.W, tk.E))
+        self.folder_view_var = tk.BooleanVar()
+        ttk.Checkbutton(filter_row, text="📁 Folders", variable=self.folder_view_var,
+                       command=lambda: self.archive_view.set_folder_mode(self.folder_view_var.get())
+                       ).grid(row=0, column=2, padx=(10, 0))
         
         self.archive_tree = ttk.Treeview(tree_frame, 
                                        columns=("size", "compressed", "ratio", "type"), 
                                        show="tree headings", height=15)
-        self.archive_tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        self.archive_tree.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
         
         # Column configuration
         self.archive_tree.heading("#0", text="📄 File Name")
@@ -802,14 +1113,37 @@ class KlondikeArchiver:
         self.archive_tree.column("ratio", width=70, minwidth=60)
         self.archive_tree.column("type", width=80, minwidth=60)
         
-        archive_scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL, 
-                                        command=self.archive_tree.yview)
-        archive_scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
-        self.archive_tree.configure(yscrollcommand=archive_scrollbar.set)
+        # Only the visible rows exist in the tree; the view drives the scrollbar itself
+        archive_scrollbar = ttk.Scrollbar(tree_frame, orient=tk.VERTICAL)
+        archive_scrollbar.grid(row=1, column=1, sticky=(tk.N, tk.S))
+        self.archive_view = VirtualArchiveView(self.archive_tree, archive_scrollbar, self.format_file_size)
+        self.archive_view.on_select = self.schedule_preview
+
+        # Preview of the selected member
+        preview_frame = ttk.LabelFrame(right_panel, text="👁 Preview", padding="10")
+        preview_frame.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=(15, 0))
+        preview_frame.columnconfigure(0, weight=1)
+
+        preview_header = ttk.Frame(preview_frame)
+        preview_header.grid(row=0, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(0, 5))
+        preview_header.columnconfigure(0, weight=1)
+        self.preview_caption_var = tk.StringVar(value="Select a file to preview it")
+        ttk.Label(preview_header, textvariable=self.preview_caption_var,
+                  font=("Segoe UI", 9)).grid(row=0, column=0, sticky=tk.W)
+        self.preview_mode_var = tk.StringVar(value="auto")
+        for column, (label, mode) in enumerate((("Auto", "auto"), ("Text", "text"), ("Hex", "hex")), start=1):
+            ttk.Radiobutton(preview_header, text=label, value=mode, variable=self.preview_mode_var,
+                           command=self._show_preview).grid(row=0, column=column, padx=(10, 0))
+
+        self.preview_text = tk.Text(preview_frame, height=7, wrap=tk.NONE, font=("Consolas", 9), state=tk.DISABLED)
+        self.preview_text.grid(row=1, column=0, sticky=(tk.W, tk.E))
+        preview_scrollbar = ttk.Scrollbar(preview_frame, orient=tk.VERTICAL, command=self.preview_text.yview)
+        preview_scrollbar.grid(row=1, column=1, sticky=(tk.N, tk.S))
+        self.preview_text.configure(yscrollcommand=preview_scrollbar.set)
         
         # Archive actions
         actions_frame = ttk.LabelFrame(right_panel, text="🔧 Actions", padding="10")
-        actions_frame.grid(row=2, column=0, sticky=(tk.W, tk.E), pady=(15, 0))
+        actions_frame.grid(row=3, column=0, sticky=(tk.W, tk.E), pady=(15, 0))
         actions_frame.columnconfigure(0, weight=1)
         actions_frame.columnconfigure(1, weight=1)
         
@@ -823,7 +1157,15 @@ class KlondikeArchiver:
         
         ttk.Button(actions_frame, text="🗑️ Remove Selected", 
                   command=self.remove_selected_files, 
-                  style='Action.TButton').grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(10, 0))
+                  style='Action.TButton').grid(row=1, column=0, sticky=(tk.W, tk.E), padx=(0, 5), pady=(10, 0))
+
+        ttk.Button(actions_frame, text="🔍 Verify",
+                  command=self.verify_archive_contents,
+                  style='Action.TButton').grid(row=1, column=1, sticky=(tk.W, tk.E), padx=(5, 0), pady=(10, 0))
+
+        self.skip_current_var = tk.BooleanVar()
+        ttk.Checkbutton(actions_frame, text="Skip files already up to date",
+                       variable=self.skip_current_var).grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=(10, 0))
         
         # Status bar
         status_frame = ttk.Frame(main_frame)
@@ -845,12 +1187,45 @@ class KlondikeArchiver:
         self.progress_bar = ttk.Progressbar(status_frame, variable=self.progress_var, 
                                           maximum=100, mode='determinate')
     
-    def show_progress(self, message):
-        """Show progress bar with message"""
+    def show_progress(self, message, tracker=None):
+        """Show progress bar with message, polling tracker (a ProgressTracker) until hide_progress"""
         self.status_var.set(message)
         self.progress_bar.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(5, 0))
         self.progress_var.set(0)
+        self.progress_message = message
+        self.progress_tracker = tracker
+        if tracker is not None:
+            self.root.after(self.PROGRESS_FRAME_MS, self._poll_progress, tracker)
         self.root.update_idletasks()
+
+    def _poll_progress(self, tracker):
+        """Redraw the progress bar from the worker's tracker at a fixed frame rate"""
+        if tracker is not self.progress_tracker:
+            return
+        self._apply_added_files(tracker.take_results(self.RESULTS_PER_FRAME))
+        snapshot = tracker.snapshot()
+        self.progress_var.set(snapshot['fraction'] * 100)
+
+        parts = [self.progress_message]
+        if snapshot['current']:
+            parts.append(str(snapshot['current']))
+        if snapshot['total_bytes']:
+            parts.append(f"{self.format_file_size(snapshot['bytes_done'])} / {self.format_file_size(snapshot['total_bytes'])}")
+        elif snapshot['total_items']:
+            parts.append(f"{snapshot['fraction']:.0%}")
+        if snapshot['rate'] > 0:
+            parts.append(f"{self.format_file_size(snapshot['rate'])}/s")
+        if snapshot['eta'] is not None:
+            parts.append(f"ETA {format_duration(snapshot['eta'])}")
+        self.status_var.set(" • ".join(parts))
+        self.update_memory_stats()
+
+        self.root.after(self.PROGRESS_FRAME_MS, self._poll_progress, tracker)
+
+    def update_memory_stats(self):
+        """Show the peak memory reserved by background work against the budget"""
+        self.memory_var.set(f"🧠 Peak {self.format_file_size(MEMORY_BUDGET.peak)} of "
+                            f"{self.format_file_size(MEMORY_BUDGET.limit)}")
     
     def update_progress(self, value, message=None):
         """Update progress bar value and optionally message"""
@@ -860,48 +1235,102 @@ class KlondikeArchiver:
         self.root.update_idletasks()
     
     def hide_progress(self):
-        """Hide progress bar"""
+        """Hide progress bar, first applying any results the worker posted since the last poll"""
+        if self.progress_tracker is not None:
+            self._apply_added_files(self.progress_tracker.take_results())
+        self.progress_tracker = None
         self.progress_bar.grid_remove()
+        self.update_memory_stats()
         self.root.update_idletasks()
     
     def refresh_file_list(self):
-        """Refresh the file browser list"""
+        """Refresh the file browser list, scanning the directory in the background"""
+        self.listing_generation += 1
+        generation = self.listing_generation
+        directory = self.current_directory
         self.file_listbox.delete(0, tk.END)
-        self.current_path_var.set(str(self.current_directory))
+        self.browser_entries = []
+        self.current_path_var.set(str(directory))
 
         try:
-            if self.current_directory.parent != self.current_directory:
-                self.file_listbox.insert(tk.END, "📁 ..")
+            mtime = directory.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        cached = self.listing_cache.get(directory)
+        if cached is not None and mtime is not None and cached[0] == mtime:
+            self._show_listing(generation, directory, cached[1])
+            return
 
-            for item in sorted(self.current_directory.iterdir()):
-                try:
-                    if item.is_dir():
-                        if self.show_hidden_var.get() or not item.name.startswith('.'):
-                            self.file_listbox.insert(tk.END, f"📁 {item.name}")
-                except (PermissionError, OSError):
-                    continue  # FIX: Added OSError handling
+        self.status_var.set(f"📂 Reading {directory.name or directory}...")
 
-            for item in sorted(self.current_directory.iterdir()):
-                try:
-                    if item.is_file():
-                        if self.show_hidden_var.get() or not item.name.startswith('.'):
-                            size = item.stat().st_size
-                            size_str = self.format_file_size(size)
-                            self.file_listbox.insert(tk.END, f"📄 {item.name} ({size_str})")
-                except (PermissionError, OSError):
-                    continue  # FIX: Added OSError handling
-
-        except (PermissionError, OSError):
+        def worker():
+            try:
+                entries = scan_directory(directory)
+            except OSError:
+                self.root.after(0, lambda: self._show_listing(generation, directory, None))
+                return
+
+            def on_complete():
+                if mtime is not None:
+                    self.listing_cache.pop(directory, None)
+                    if len(self.listing_cache) >= self.LISTING_CACHE_SIZE:
+                        del self.listing_cache[next(iter(self.listing_cache))]
+                    self.listing_cache[directory] = (mtime, entries)
+                self._show_listing(generation, directory, entries)
+
+            self.root.after(0, on_complete)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
+    def _show_listing(self, generation, directory, entries):
+        """Fill the file browser from a scan_directory listing a chunk at a time"""
+        if generation != self.listing_generation:
+            return  # the user has already moved on to another directory
+
+        if entries is None:
             self.file_listbox.insert(tk.END, "❌ Permission denied")
+            self.browser_entries = [None]
             self.status_var.set("Cannot access this directory")
+            return
+
+        rows = []
+        if directory.parent != directory:
+            rows.append(("..", True, None))
+        show_hidden = self.show_hidden_var.get()
+        rows.extend(entry for entry in entries if show_hidden or not entry[0].startswith('.'))
+
+        def fill(start=0):
+            if generation != self.listing_generation:
+                return
+            chunk = rows[start:start + self.LISTING_CHUNK]
+            self.browser_entries.extend(chunk)
+            self.file_listbox.insert(tk.END, *[
+                f"📁 {name}" if is_dir else f"📄 {name} ({self.format_file_size(size)})"
+                for name, is_dir, size in chunk
+            ])
+            if start + self.LISTING_CHUNK < len(rows):
+                self.root.after(1, fill, start + self.LISTING_CHUNK)
+            elif len(rows) > self.LISTING_CHUNK:
+                self.status_var.set(f"📂 {len(rows)} items in {directory.name or directory}")
+
+        if rows:
+            fill()
+
+    def _selected_browser_files(self, indices):
+        """(name, path) for the files (not folders) at the given file browser rows"""
+        selected = []
+        for index in indices:
+            entry = self.browser_entries[index] if index < len(self.browser_entries) else None
+            if entry is not None and not entry[1]:
+                file_path = self.current_directory / entry[0]
+                if file_path.is_file():
+                    selected.append((entry[0], file_path))
+        return selected
     
     def format_file_size(self, size):
         """Format file size in human readable format"""
-        for unit in ['B', 'KB', 'MB', 'GB']:
-            if size < 1024.0:
-                return f"{size:.1f} {unit}"
-            size /= 1024.0
-        return f"{size:.1f} TB"
+        return format_file_size(size)
     
     def on_file_double_click(self, event):
         """Handle double-click on file list"""
@@ -909,10 +1338,10 @@ class KlondikeArchiver:
         if not selection:
             return
         
-        item_text = self.file_listbox.get(selection[0])
+        entry = self.browser_entries[selection[0]] if selection[0] < len(self.browser_entries) else None
         
-        if item_text.startswith("📁"):
-            dir_name = item_text[2:].strip()
+        if entry is not None and entry[1]:
+            dir_name = entry[0]
             if dir_name == "..":
                 self.go_up_directory()
             else:
@@ -943,14 +1372,7 @@ class KlondikeArchiver:
             messagebox.showwarning("No Selection", "Please select files to add to the archive.")
             return
 
-        files_to_add = []
-        for selection in selections:
-            item_text = self.file_listbox.get(selection)
-            if item_text.startswith("📄"):
-                filename = item_text[2:].split(" (")[0].strip()
-                file_path = self.current_directory / filename
-                if file_path.exists() and file_path.is_file():
-                    files_to_add.append((filename, file_path))
+        files_to_add = self._selected_browser_files(selections)
 
         if not files_to_add:
             messagebox.showinfo("No Files", "No valid files selected.")
@@ -958,58 +1380,17 @@ class KlondikeArchiver:
 
         def worker():
             added_count = 0
-            total_files = len(files_to_add)
-            self.root.after(0, lambda: self.show_progress("Adding files to archive..."))
-
-            for i, (filename, file_path) in enumerate(files_to_add):
-                try:
-                    progress = (i / total_files) * 100
-                    self.root.after(0, lambda p=progress, name=filename:
-                                    self.update_progress(p, f"Processing {name}..."))
-
-                    file_size = file_path.stat().st_size
-                    
-                    # Read file data based on size
-                    with open(file_path, 'rb') as f:
-                        file_data = f.read()
-                    
-                    # Compress based on file type and size
-                    if should_compress(filename):
-                        compressed_data = OptimizedCompression.compress_smart(file_data)
-                    else:
-                        compressed_data = b'\x00' + file_data
-
-                    # Store the sizes before cleaning up data
-                    original_size = len(file_data)
-                    compressed_size = len(compressed_data)
-                    
-                    # Store metadata instead of keeping full data in memory
-                    def add_metadata():
-                        self._add_file_metadata(filename, file_path, original_size, compressed_size)
-                    
-                    self.root.after(0, add_metadata)
-                    
-                    # Save compressed data to temp file for large files
-                    if file_size > OptimizedCompression.LARGE_CHUNK:
-                        temp_file = self.temp_dir / f"{filename}.tmp"
-                        with open(temp_file, 'wb') as f:
-                            f.write(compressed_data)
-                    
-                    added_count += 1
-                    
-                    # Clean up memory immediately
-                    del file_data
-                    del compressed_data
+            progress = ProgressTracker(len(files_to_add), self._total_size(path for _, path in files_to_add))
+            self.root.after(0, lambda: self.show_progress("Adding files to archive...", progress))
 
-                except Exception as e:
-                    self.root.after(0, lambda err=str(e), name=filename:
-                                  messagebox.showerror("Error", f"Failed to add {name}: {err}"))
+            added_count, _ = self._add_compressed_files(
+                compress_files(self._stat_files(files_to_add), spool_dir=self.temp_dir), progress)
 
             def on_complete():
                 self.hide_progress()
                 if added_count > 0:
                     self.mark_unsaved_changes()
-                    self.refresh_archive_tree()
+                    self.update_archive_banner()
                     self.update_archive_info()
                     self.status_var.set(f"✅ Added {added_count} file(s) to archive!")
 
@@ -1018,16 +1399,86 @@ class KlondikeArchiver:
         thread = threading.Thread(target=worker, daemon=True)
         thread.start()
     
-    def _add_file_metadata(self, filename, file_path, original_size, compressed_size):
-        """Add file metadata to archive without storing full data in memory"""
-        self.archive_metadata[filename] = {
-            'original_path': str(file_path),
-            'size': original_size,
-            'compressed_size': compressed_size,
-            'type': file_path.suffix or 'file',
-            'is_large': original_size > OptimizedCompression.LARGE_CHUNK,
-            'temp_file': str(self.temp_dir / f"{filename}.tmp") if original_size > OptimizedCompression.LARGE_CHUNK else None
-        }
+    def _add_compressed_files(self, compressed, progress):
+        """Add the results of kc_engine.compress_files to the archive; returns (added, failed) counts.
+
+        Each finished file is posted to progress (the tracker show_progress polls), which
+        applies them to the archive in batches on the UI thread.
+        """
+        added_count = 0
+        failed_count = 0
+        for relative_name, file_path, file_stat, job in compressed:
+            try:
+                progress.next_item(relative_name, file_stat.st_size)
+                original_size, compressed_data, crc = job.result()
+
+                # Save large files to temp directory
+                large = original_size > OptimizedCompression.LARGE_CHUNK
+                self._save_payload(relative_name, compressed_data, self._temp_path(relative_name) if large else None)
+
+                progress.post((relative_name, file_path, original_size, len(compressed_data),
+                               file_stat.st_mtime_ns, crc))
+                added_count += 1
+                del compressed_data
+
+            except Exception as e:
+                failed_count += 1
+                self.root.after(0, lambda err=str(e), name=relative_name:
+                                messagebox.showerror("Error", f"Failed to add {name}: {err}"))
+        progress.finish()
+        return added_count, failed_count
+
+    def _save_payload(self, filename, payload, temp_file):
+        """Keep a payload from compress_files as temp_file, or drop it when temp_file is None"""
+        if isinstance(payload, SpooledPayload):
+            # Already on disk, compressed from the file without loading it
+            if temp_file:
+                payload.save_as(temp_file)
+            else:
+                payload.discard()
+        elif temp_file:
+            with PROFILER.phase('spool', filename):
+                with open(temp_file, 'wb') as f:
+                    f.write(payload)
+
+    def _stat_files(self, files):
+        """Turn (name, path) pairs into the (name, path, stat) items compress_files takes"""
+        for filename, file_path in files:
+            try:
+                yield filename, file_path, file_path.stat()
+            except OSError as e:
+                self.root.after(0, lambda err=str(e), name=filename:
+                                messagebox.showerror("Error", f"Failed to add {name}: {err}"))
+
+    def _total_size(self, paths):
+        """Sum of file sizes, skipping files that can no longer be stat'ed"""
+        total = 0
+        for path in paths:
+            try:
+                total += path.stat().st_size
+            except OSError:
+                pass
+        return total
+
+    def _apply_added_files(self, added):
+        """Add a batch of (name, path, size, compressed size, mtime, crc32) results to the archive"""
+        if not added:
+            return
+        with PROFILER.phase('ui commit'):
+            for filename, file_path, original_size, compressed_size, mtime, crc32 in added:
+                self.archive_metadata[filename] = self._make_file_metadata(
+                    filename, file_path, original_size, compressed_size, mtime, crc32)
+            self.archive_view.update(self.archive_metadata, [filename for filename, *_ in added])
+
+    def _make_file_metadata(self, filename, file_path, original_size, compressed_size, mtime=None, crc32=None):
+        """Build the metadata entry for a file added from disk, spooling large files to the temp directory"""
+        if mtime is None:
+            try:
+                mtime = file_path.stat().st_mtime_ns
+            except OSError:
+                pass
+        temp_file = self._temp_path(filename) if original_size > OptimizedCompression.LARGE_CHUNK else None
+        return new_member_metadata(file_path, original_size, compressed_size, temp_file, mtime, crc32)
     
     def add_folder_to_archive(self):
         """Add an entire folder to the archive with memory optimization"""
@@ -1040,85 +1491,185 @@ class KlondikeArchiver:
         
         def worker():
             try:
-                folder = Path(folder_path)
-                files_to_add = []
+                # Totals grow as the walker finds files; compression starts with the first one
+                progress = ProgressTracker()
+                self.root.after(0, lambda: self.show_progress("Adding folder to archive...", progress))
                 
-                # First, collect all files
-                for file_path in folder.rglob('*'):
-                    if file_path.is_file():
-                        relative_path = file_path.relative_to(folder.parent)
-                        files_to_add.append((str(relative_path), file_path))
+                added_count, failed_count = self._add_compressed_files(
+                    compress_files(walk_files(folder_path, tracker=progress), spool_dir=self.temp_dir), progress)
                 
-                if not files_to_add:
-                    self.root.after(0, lambda: messagebox.showinfo("Empty Folder", "No files found in the selected folder."))
-                    return
-                
-                self.root.after(0, lambda: self.show_progress("Adding folder to archive..."))
+                def on_complete():
+                    self.hide_progress()
+                    if added_count > 0:
+                        self.mark_unsaved_changes()
+                        self.update_archive_banner()
+                        self.update_archive_info()
+                        self.status_var.set(f"✅ Added {added_count} file(s) from folder!")
+                    elif not failed_count:
+                        messagebox.showinfo("Empty Folder", "No files found in the selected folder.")
                 
-                added_count = 0
-                total_files = len(files_to_add)
+                self.root.after(0, on_complete)
                 
-                for i, (relative_name, file_path) in enumerate(files_to_add):
-                    try:
-                        progress = (i / total_files) * 100  # FIX: Removed problematic progress calculation
-                        self.root.after(0, lambda p=progress, name=file_path.name: 
-                                        self.update_progress(p, f"Processing {name}..."))
+            except Exception as e:
+                self.root.after(0, lambda: self.hide_progress())
+                self.root.after(0, lambda err=str(e): messagebox.showerror("Error", f"Failed to add folder: {err}"))
 
-                        file_size = file_path.stat().st_size
-                        
-                        # Process file based on size
-                        with open(file_path, 'rb') as f:
-                            file_data = f.read()
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
 
-                        if should_compress(relative_name):
-                            compressed_data = OptimizedCompression.compress_smart(file_data)
-                        else:
-                            compressed_data = b'\x00' + file_data
+    def sync_folder_to_archive(self):
+        """Bring the archive up to date with a folder, compressing only new or changed files"""
+        folder_path = filedialog.askdirectory(
+            title="Select folder to sync into archive",
+            initialdir=self.current_directory
+        )
+        if not folder_path:
+            return
 
-                        # Store sizes before cleanup
-                        original_size = len(file_data)
-                        compressed_size = len(compressed_data)
+        remove_deleted = messagebox.askyesnocancel(
+            "Sync Folder",
+            "Also remove archive entries for files that were deleted from the folder?"
+        )
+        if remove_deleted is None:
+            return
+        compare_hash = messagebox.askyesno(
+            "Sync Folder",
+            "Compare file contents as well?\n\n"
+            "This is slower, but catches changes that kept the same size and modification time."
+        )
+
+        archive_metadata = self.archive_metadata.copy()
+        archive_file = self.current_archive_file
+
+        def worker():
+            try:
+                self.root.after(0, lambda: self.show_progress("Scanning folder for changes..."))
+                plan = plan_folder_sync(archive_metadata, folder_path, compare_hash, remove_deleted)
+                changed = plan['updated'] + plan['added']
+
+                progress = ProgressTracker(len(changed), sum(file_stat.st_size for _, _, file_stat in changed))
+                self.root.after(0, lambda: self.show_progress("Compressing changed files...", progress))
+                for relative_name, file_path, file_stat, job in compress_files(changed, spool_dir=self.temp_dir):
+                    try:
+                        progress.next_item(relative_name, file_stat.st_size)
+                        original_size, compressed_data, crc = job.result()
+
+                        metadata = self._make_file_metadata(relative_name, file_path, original_size,
+                                                            len(compressed_data), file_stat.st_mtime_ns, crc)
+                        self._save_payload(relative_name, compressed_data, metadata['temp_file'])
+                        archive_metadata[relative_name] = metadata
 
-                        # Add to archive metadata
-                        def add_metadata():
-                            self._add_file_metadata(relative_name, file_path, original_size, compressed_size)
-                        
-                        self.root.after(0, add_metadata)
-                        
-                        # Save large files to temp directory
-                        if file_size > OptimizedCompression.LARGE_CHUNK:
-                            temp_file = self.temp_dir / f"{relative_name.replace('/', '_').replace('\\', '_')}.tmp"
-                            temp_file.parent.mkdir(parents=True, exist_ok=True)
-                            with open(temp_file, 'wb') as f:
-                                f.write(compressed_data)
-                        
-                        added_count += 1
-                        
-                        # Clean up memory
-                        del file_data
                         del compressed_data
-                        
+
                     except Exception as e:
-                        self.root.after(0, lambda err=str(e), name=relative_name: 
-                                      messagebox.showerror("Error", f"Failed to add {name}: {err}"))
-                
+                        self.root.after(0, lambda err=str(e), name=relative_name:
+                                      messagebox.showerror("Error", f"Failed to sync {name}: {err}"))
+
+                for filename in plan['removed']:
+                    temp_file = archive_metadata.pop(filename).get('temp_file')
+                    if temp_file:
+                        try:
+                            Path(temp_file).unlink()
+                        except OSError:
+                            pass
+
+                # Write only the difference into the archive on disk
+                locations = None
+                if archive_file and (changed or plan['removed']):
+                    write_progress = ProgressTracker(len(changed), progress.total_bytes)
+                    self.root.after(0, lambda: self.show_progress("Writing changes to archive...", write_progress))
+
+                    def on_write(percent, filename):
+                        write_progress.next_item(filename, archive_metadata[filename]['size'])
+
+                    locations = save_archive_changes(archive_file, archive_metadata, on_write)
+
                 def on_complete():
                     self.hide_progress()
-                    if added_count > 0:
+                    self.archive_metadata = archive_metadata
+                    if locations is not None:
+                        self._adopt_saved_locations(archive_file, locations, archive_metadata)
+                        self.clear_unsaved_changes()
+                    elif changed or plan['removed']:
                         self.mark_unsaved_changes()
-                        self.refresh_archive_tree()
-                        self.update_archive_info()
-                        self.status_var.set(f"✅ Added {added_count} file(s) from folder!")
-                
+                    self.refresh_archive_tree()
+                    self.update_archive_info()
+                    self.status_var.set(
+                        f"🔄 Synced '{Path(folder_path).name}': {len(plan['added'])} added, "
+                        f"{len(plan['updated'])} updated, {len(plan['removed'])} removed, "
+                        f"{len(plan['unchanged'])} unchanged"
+                    )
+
                 self.root.after(0, on_complete)
-                
+
             except Exception as e:
                 self.root.after(0, lambda: self.hide_progress())
-                self.root.after(0, lambda: messagebox.showerror("Error", f"Failed to add folder: {e}"))
-        
+                self.root.after(0, lambda err=str(e): messagebox.showerror("Sync Error", f"Failed to sync folder: {err}"))
+
         thread = threading.Thread(target=worker, daemon=True)
         thread.start()
-    
+
+    def create_incremental_backup(self):
+        """Write a child archive that stores only what changed in a folder since a base archive"""
+        base_path = filedialog.askopenfilename(
+            title="Choose the base archive",
+            filetypes=[("Klondike Crinkle", "*.kc"), ("All files", "*.*")],
+            initialdir=self.current_directory
+        )
+        if not base_path:
+            return
+
+        folder_path = filedialog.askdirectory(
+            title="Select folder to back up",
+            initialdir=self.current_directory
+        )
+        if not folder_path:
+            return
+
+        child_path = filedialog.asksaveasfilename(
+            title="Save Incremental Archive As...",
+            defaultextension=".kc",
+            filetypes=[("Klondike Crinkle", "*.kc"), ("All files", "*.*")],
+            initialdir=Path(base_path).parent
+        )
+        if not child_path:
+            return
+
+        def worker():
+            try:
+                # create_incremental_archive reports percentages, so count in hundredths
+                progress = ProgressTracker(total_items=100)
+                self.root.after(0, lambda: self.show_progress("Creating incremental backup...", progress))
+
+                def on_progress(percent, filename):
+                    progress.update(items=int(percent), current=filename)
+
+                plan = create_incremental_archive(child_path, base_path, folder_path,
+                                                  progress_callback=on_progress)
+
+                def on_complete():
+                    self.hide_progress()
+                    self.status_var.set(
+                        f"🧩 Wrote '{Path(child_path).name}': {len(plan['added'])} added, "
+                        f"{len(plan['updated'])} updated, {len(plan['removed'])} removed, "
+                        f"{len(plan['unchanged'])} kept in '{Path(base_path).name}'"
+                    )
+
+                self.root.after(0, on_complete)
+
+            except Exception as e:
+                self.root.after(0, lambda: self.hide_progress())
+                self.root.after(0, lambda err=str(e): messagebox.showerror("Backup Error", f"Failed to create incremental backup: {err}"))
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
+    def _adopt_saved_locations(self, archive_file, locations, saved_metadata):
+        """Point saved members at their data in the archive file and drop their temp files"""
+        adopt_saved_locations(self.archive_metadata, saved_metadata, archive_file, locations)
+        self.archive_view.update(self.archive_metadata, list(locations))
+        self.update_archive_banner()
+
     def mark_unsaved_changes(self):
         """Mark that there are unsaved changes"""
         self.unsaved_changes = True
@@ -1135,7 +1686,7 @@ class KlondikeArchiver:
     
     def extract_selected_files(self):
         """Extract selected files from archive"""
-        selections = self.archive_tree.selection()
+        selections = self.archive_view.selected_names()
         if not selections:
             messagebox.showwarning("No Selection", "Please select files to extract from the archive.")
             return
@@ -1147,33 +1698,32 @@ class KlondikeArchiver:
         if not extract_dir:
             return
         
+        skip_current = self.skip_current_var.get()
+
         def worker():
             try:
                 extract_path = Path(extract_dir)
                 extracted_count = 0
+                skipped_count = 0
+                bytes_written = 0
                 
-                self.root.after(0, lambda: self.show_progress("Extracting files..."))
+                progress = ProgressTracker(len(selections), sum(self.archive_metadata[name]['size']
+                                                                for name in selections if name in self.archive_metadata))
+                self.root.after(0, lambda: self.show_progress("Extracting files...", progress))
                 
-                for i, selection in enumerate(selections):
-                    filename = self.archive_tree.item(selection, "text")
-                    if filename.startswith(("📝", "🖼️", "🎵", "🎬", "📦", "⚙️", "📄")):
-                        filename = filename[2:].strip()
-                    
+                for filename in selections:
                     if filename in self.archive_metadata:
                         try:
-                            progress = (i / len(selections)) * 100
-                            self.root.after(0, lambda p=progress, name=filename: 
-                                          self.update_progress(p, f"Extracting {name}..."))
+                            progress.next_item(filename, self.archive_metadata[filename]['size'])
                             
-                            # Get file data
-                            file_data = self._get_file_data(filename)
-                            
-                            if file_data is not None:
-                                output_file = extract_path / filename
-                                output_file.parent.mkdir(parents=True, exist_ok=True)
-                                with open(output_file, 'wb') as f:
-                                    f.write(file_data)
+                            # Streams to disk, so memory use doesn't grow with the file size
+                            written = extract_member(filename, self.archive_metadata[filename],
+                                                     extract_path, skip_current)
+                            if written is None:
+                                skipped_count += 1
+                            else:
                                 extracted_count += 1
+                                bytes_written += written
                                 
                         except Exception as e:
                             self.root.after(0, lambda err=str(e), name=filename: 
@@ -1181,14 +1731,19 @@ class KlondikeArchiver:
                 
                 def on_complete():
                     self.hide_progress()
-                    if extracted_count > 0:
+                    if skip_current:
+                        self.status_var.set(
+                            f"✅ Extracted {extracted_count} file(s) ({self.format_file_size(bytes_written)} written), "
+                            f"skipped {skipped_count} already up to date in {extract_dir}"
+                        )
+                    elif extracted_count > 0:
                         self.status_var.set(f"✅ Extracted {extracted_count} file(s) to {extract_dir}")
                 
                 self.root.after(0, on_complete)
                 
             except Exception as e:
                 self.root.after(0, lambda: self.hide_progress())
-                self.root.after(0, lambda: messagebox.showerror("Error", f"Extraction failed: {e}"))
+                self.root.after(0, lambda err=str(e): messagebox.showerror("Error", f"Extraction failed: {err}"))
         
         thread = threading.Thread(target=worker, daemon=True)
         thread.start()
@@ -1206,30 +1761,30 @@ class KlondikeArchiver:
         if not extract_dir:
             return
         
+        skip_current = self.skip_current_var.get()
+
         def worker():
             try:
                 extract_path = Path(extract_dir)
                 extracted_count = 0
+                skipped_count = 0
+                bytes_written = 0
                 
-                self.root.after(0, lambda: self.show_progress("Extracting all files..."))
-                total_files = len(self.archive_metadata)
+                progress = ProgressTracker(len(self.archive_metadata),
+                                           sum(metadata['size'] for metadata in self.archive_metadata.values()))
+                self.root.after(0, lambda: self.show_progress("Extracting all files...", progress))
                 
-                for i, filename in enumerate(self.archive_metadata.keys()):
+                for filename in self.archive_metadata.keys():
                     try:
-                        progress = (i / total_files) * 100
-                        self.root.after(0, lambda p=progress, name=filename: 
-                                      self.update_progress(p, f"Extracting {name}..."))
+                        progress.next_item(filename, self.archive_metadata[filename]['size'])
                         
-                        file_data = self._get_file_data(filename)
-                        
-                        if file_data is not None:
-                            output_file = extract_path / filename
-                            output_file.parent.mkdir(parents=True, exist_ok=True)
-                            
-                            with open(output_file, 'wb') as f:
-                                f.write(file_data)
-                                
+                        written = extract_member(filename, self.archive_metadata[filename],
+                                                 extract_path, skip_current)
+                        if written is None:
+                            skipped_count += 1
+                        else:
                             extracted_count += 1
+                            bytes_written += written
                             
                     except Exception as e:
                         self.root.after(0, lambda err=str(e), name=filename: 
@@ -1237,67 +1792,78 @@ class KlondikeArchiver:
                 
                 def on_complete():
                     self.hide_progress()
-                    if extracted_count > 0:
+                    if skip_current:
+                        self.status_var.set(
+                            f"✅ Extracted {extracted_count} file(s) ({self.format_file_size(bytes_written)} written), "
+                            f"skipped {skipped_count} already up to date in {extract_dir}"
+                        )
+                    elif extracted_count > 0:
                         self.status_var.set(f"✅ Extracted all {extracted_count} file(s) to {extract_dir}")
                 
                 self.root.after(0, on_complete)
                 
             except Exception as e:
                 self.root.after(0, lambda: self.hide_progress())
-                self.root.after(0, lambda: messagebox.showerror("Error", f"Extraction failed: {e}"))
+                self.root.after(0, lambda err=str(e): messagebox.showerror("Error", f"Extraction failed: {err}"))
         
         thread = threading.Thread(target=worker, daemon=True)
         thread.start()
     
-    def _get_file_data(self, filename):
-        """Get decompressed file data from archive or temp storage"""
-        if filename not in self.archive_metadata:
-            return None
-        
-        metadata = self.archive_metadata[filename]
-        
-        try:
-            if metadata['is_large'] and metadata.get('temp_file'):
-                # Large file stored in temp directory
-                temp_file = Path(metadata['temp_file'])
-                if temp_file.exists():
-                    with open(temp_file, 'rb') as f:
-                        compressed_data = f.read()
-                    return OptimizedCompression.decompress_smart(compressed_data)
-            elif metadata.get('data_offset') is not None and metadata.get('archive_file'):
-                # Small file from opened archive
-                with open(metadata['archive_file'], 'rb') as f:
-                    f.seek(metadata['data_offset'])
-                    compressed_data = f.read(metadata['compressed_size'])
-                    return OptimizedCompression.decompress_smart(compressed_data)
-            else:
-                # Small file - re-read and compress from original
-                original_path = Path(metadata['original_path'])
-                if original_path.exists():
-                    with open(original_path, 'rb') as f:
-                        return f.read()
-        except Exception as e:
-            print(f"Error getting file data for {filename}: {e}")
-        
-        return None
-    
+    def verify_archive_contents(self):
+        """Decompress every member on a worker pool and check it against its stored checksum"""
+        if not self.archive_metadata:
+            messagebox.showwarning("Empty Archive", "No files to verify.")
+            return
+
+        archive_metadata = self.archive_metadata.copy()
+
+        def worker():
+            try:
+                progress = ProgressTracker(len(archive_metadata),
+                                           sum(metadata['size'] for metadata in archive_metadata.values()))
+                self.root.after(0, lambda: self.show_progress("Verifying archive...", progress))
+
+                def on_progress(done, total, bytes_done):
+                    progress.update(items=done, nbytes=bytes_done)
+
+                result = verify_archive(archive_metadata, progress_callback=on_progress)
+
+                def on_complete():
+                    self.hide_progress()
+                    speed = f"{self.format_file_size(result['throughput'])}/s"
+                    if result['failures']:
+                        details = "\n".join(f"{name}: {err}" for name, err in result['failures'][:20])
+                        if len(result['failures']) > 20:
+                            details += f"\n... and {len(result['failures']) - 20} more"
+                        messagebox.showerror("Verify Failed",
+                                             f"{len(result['failures'])} of {result['members']} file(s) are damaged:\n\n{details}")
+                        self.status_var.set(f"❌ Verify found {len(result['failures'])} damaged file(s) ({speed})")
+                    else:
+                        unchecked = f", {result['unchecked']} without checksum" if result['unchecked'] else ""
+                        self.status_var.set(
+                            f"✅ Verified {result['verified']} file(s), "
+                            f"{self.format_file_size(result['bytes'])} at {speed}{unchecked}"
+                        )
+
+                self.root.after(0, on_complete)
+
+            except Exception as e:
+                self.root.after(0, lambda: self.hide_progress())
+                self.root.after(0, lambda err=str(e): messagebox.showerror("Verify Error", f"Failed to verify archive: {err}"))
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
     def remove_selected_files(self):
         """Remove selected files from archive"""
-        selections = self.archive_tree.selection()
-        if not selections:
+        filenames_to_remove = self.archive_view.selected_names()
+        if not filenames_to_remove:
             messagebox.showwarning("No Selection", "Please select files to remove from the archive.")
             return
         
-        filenames_to_remove = []
-        for selection in selections:
-            filename = self.archive_tree.item(selection, "text")
-            if filename.startswith(("📝", "🖼️", "🎵", "🎬", "📦", "⚙️", "📄")):
-                filename = filename[2:].strip()
-            filenames_to_remove.append(filename)
-        
         if messagebox.askyesno("Confirm Removal", 
                               f"Remove {len(filenames_to_remove)} file(s) from archive?"):
-            removed_count = 0
+            removed = []
             for filename in filenames_to_remove:
                 if filename in self.archive_metadata:
                     # Clean up temp file if it exists
@@ -1311,63 +1877,88 @@ class KlondikeArchiver:
                                 pass  # FIX: File might be in use or already deleted
                     
                     del self.archive_metadata[filename]
-                    removed_count += 1
+                    removed.append(filename)
             
-            if removed_count > 0:
+            if removed:
                 self.mark_unsaved_changes()
-                self.refresh_archive_tree()
+                self.archive_view.remove(removed)
+                self.update_archive_banner()
                 self.update_archive_info()
-                self.status_var.set(f"🗑️ Removed {removed_count} file(s) from archive")
+                self.status_var.set(f"🗑️ Removed {len(removed)} file(s) from archive")
     
     def refresh_archive_tree(self):
-        """Refresh the archive contents tree with enhanced display"""
-        self.archive_tree.delete(*self.archive_tree.get_children())
-        
+        """Bring the archive contents view up to date with archive_metadata"""
+        with PROFILER.phase('ui commit'):
+            self.archive_view.sync(self.archive_metadata)
+            self.update_archive_banner()
+        self.schedule_preview()
+
+    def schedule_preview(self):
+        """Preview the selection once it stops changing, so holding an arrow key stays smooth"""
+        if self._preview_pending is not None:
+            self.root.after_cancel(self._preview_pending)
+        self._preview_pending = self.root.after(self.PREVIEW_DELAY_MS, self.update_preview)
+
+    def update_preview(self):
+        """Show the start of the selected member, decompressing just that much in the background"""
+        self._preview_pending = None
+        self.preview_generation += 1
+        generation = self.preview_generation
+        names = self.archive_view.selected_names()
+        if len(names) != 1:
+            self.preview = None
+            self._show_preview("Select a single file to preview it" if names else "Select a file to preview it")
+            return
+
+        name = names[0]
+        metadata = self.archive_metadata[name].copy()
+        self.preview_caption_var.set(f"Reading {name}...")
+
+        def worker():
+            try:
+                data = peek_member(name, metadata, self.PREVIEW_BYTES)
+            except Exception as e:
+                self.root.after(0, lambda err=str(e): on_complete(None, f"❌ Cannot preview {name}: {err}"))
+                return
+            self.root.after(0, lambda: on_complete((name, metadata['size'], data)))
+
+        def on_complete(preview, message=None):
+            if generation != self.preview_generation:
+                return  # the selection has moved on
+            self.preview = preview
+            self._show_preview(message)
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+
+    def _show_preview(self, message=None):
+        """Fill the preview pane from self.preview in the chosen mode, or show message instead"""
+        self.preview_text.configure(state=tk.NORMAL)
+        self.preview_text.delete("1.0", tk.END)
+        if self.preview is None:
+            if message is not None:
+                self.preview_caption_var.set(message)
+        else:
+            name, size, data = self.preview
+            mode = self.preview_mode_var.get()
+            if mode == "text" or (mode == "auto" and looks_like_text(data)):
+                self.preview_text.insert("1.0", data.decode('utf-8', errors='replace'))
+            else:
+                self.preview_text.insert("1.0", hex_dump(data))
+            shown = "all" if len(data) == size else f"first {self.format_file_size(len(data))} of"
+            self.preview_caption_var.set(f"{name} - {shown} {self.format_file_size(size)}")
+        self.preview_text.configure(state=tk.DISABLED)
+
+    def update_archive_banner(self):
+        """Show the file count and savings summary above the archive contents"""
         if not self.archive_metadata:
             banner_message = "📭 Archive is empty - use buttons or drop files from Windows Explorer!" if DND_AVAILABLE else "📭 Archive is empty - use buttons to add files!"
             self.banner_text.set(banner_message)
             return
         
-        total_original = 0
-        total_compressed = 0
-        
-        for filename, metadata in self.archive_metadata.items():
-            original_size = metadata['size']
-            compressed_size = metadata['compressed_size']
-            file_type = metadata['type']
-            
-            total_original += original_size
-            total_compressed += compressed_size
-            
-            if original_size > 0:
-                ratio = f"{(compressed_size / original_size * 100):.1f}%"
-            else:
-                ratio = "0%"
-            
-            # Add file icon based on type
-            if file_type in ['.txt', '.md', '.py', '.js', '.html', '.css']:
-                icon = "📝"
-            elif file_type in ['.jpg', '.png', '.gif', '.bmp', '.jpeg']:
-                icon = "🖼️"
-            elif file_type in ['.mp3', '.wav', '.flac', '.ogg']:
-                icon = "🎵"
-            elif file_type in ['.mp4', '.avi', '.mkv', '.mov']:
-                icon = "🎬"
-            elif file_type in ['.zip', '.rar', '.7z', '.tar']:
-                icon = "📦"
-            elif file_type in ['.exe', '.app', '.deb', '.dmg']:
-                icon = "⚙️"
-            else:
-                icon = "📄"
-            
-            self.archive_tree.insert("", "end", text=f"{icon} {filename}", 
-                                   values=(self.format_file_size(original_size),
-                                          self.format_file_size(compressed_size),
-                                          ratio,
-                                          file_type or "file"))
-        
-        # Update banner with summary
         file_count = len(self.archive_metadata)
+        total_original = self.archive_view.total_original
+        total_compressed = self.archive_view.total_compressed
         if total_original > 0:
             savings_ratio = (1 - total_compressed / total_original) * 100
             self.banner_text.set(
@@ -1385,8 +1976,8 @@ class KlondikeArchiver:
             return
         
         file_count = len(self.archive_metadata)
-        total_original = sum(f['size'] for f in self.archive_metadata.values())
-        total_compressed = sum(f['compressed_size'] for f in self.archive_metadata.values())
+        total_original = self.archive_view.total_original
+        total_compressed = self.archive_view.total_compressed
         
         if self.current_archive_file:
             filename = Path(self.current_archive_file).name
@@ -1464,110 +2055,23 @@ class KlondikeArchiver:
             self.save_archive_as()
             return
 
+        archive_metadata = self.archive_metadata.copy()
+        archive_file = self.current_archive_file
+
         def worker():
             try:
-                file_count = len(self.archive_metadata)
-                self.root.after(0, lambda: self.show_progress("Saving archive..."))
+                progress = ProgressTracker(len(archive_metadata),
+                                           sum(metadata['size'] for metadata in archive_metadata.values()))
+                self.root.after(0, lambda: self.show_progress("Saving archive...", progress))
 
-                # Build file table
-                file_table_data = b''
-                file_data_info = []
-                current_offset = 0
-
-                for filename, metadata in self.archive_metadata.items():
-                    # Get compressed data size
-                    if metadata['is_large'] and metadata.get('temp_file'):
-                        temp_file = Path(metadata['temp_file'])
-                        if temp_file.exists():
-                            compressed_size = temp_file.stat().st_size
-                        else:
-                            # Re-compress if temp file missing
-                            original_path = Path(metadata['original_path'])
-                            if original_path.exists():
-                                with open(original_path, 'rb') as f:
-                                    data = f.read()
-                                compressed_data = OptimizedCompression.compress_smart(data)
-                                compressed_size = len(compressed_data)
-                                # Save to temp file
-                                temp_file = self.temp_dir / f"{filename}.tmp"
-                                with open(temp_file, 'wb') as f:
-                                    f.write(compressed_data)
-                            else:
-                                compressed_size = metadata['compressed_size']
-                    else:
-                        compressed_size = metadata['compressed_size']
+                def on_progress(percent, filename):
+                    progress.next_item(filename, archive_metadata[filename]['size'])
 
-                    # Build table entry
-                    filename_bytes = filename.encode('utf-8')
-                    file_type_bytes = metadata['type'].encode('utf-8')
-                    
-                    file_table_data += struct.pack('<H', len(filename_bytes))
-                    file_table_data += filename_bytes
-                    file_table_data += struct.pack('<I', metadata['size'])
-                    file_table_data += struct.pack('<I', compressed_size)
-                    file_table_data += struct.pack('<I', current_offset)
-                    file_table_data += struct.pack('<H', len(file_type_bytes))
-                    file_table_data += file_type_bytes
-                    
-                    file_data_info.append((filename, current_offset, compressed_size))
-                    current_offset += compressed_size
-
-                # Write archive file
-                with open(self.current_archive_file, 'wb') as f:
-                    # Write header
-                    f.write(b'KLONDIKE')
-                    f.write(b'ULTIMATE')
-                    f.write(struct.pack('<I', len(self.archive_metadata)))
-                    f.write(struct.pack('<I', len(file_table_data)))
-                    f.write(file_table_data)
-
-                    # Write file data
-                    for i, (filename, offset, size) in enumerate(file_data_info):
-                        progress = (i / file_count) * 90
-                        self.root.after(0, lambda p=progress, name=filename:
-                                        self.update_progress(p, f"Writing {name}..."))
-                        
-                        metadata = self.archive_metadata[filename]
-                        
-                        if metadata['is_large'] and metadata.get('temp_file'):
-                            # Copy from temp file
-                            temp_file = Path(metadata['temp_file'])
-                            if temp_file.exists():
-                                with open(temp_file, 'rb') as temp_f:
-                                    # Copy in chunks to avoid loading large files into memory
-                                    while True:
-                                        chunk = temp_f.read(OptimizedCompression.SMALL_CHUNK)
-                                        if not chunk:
-                                            break
-                                        f.write(chunk)
-                        elif metadata.get('data_offset') is not None and metadata.get('archive_file'):
-                            # Copy from opened archive file
-                            with open(metadata['archive_file'], 'rb') as src_f:
-                                src_f.seek(metadata['data_offset'])
-                                remaining = size
-                                while remaining > 0:
-                                    chunk_size = min(OptimizedCompression.SMALL_CHUNK, remaining)
-                                    chunk = src_f.read(chunk_size)
-                                    if not chunk:
-                                        break
-                                    f.write(chunk)
-                                    remaining -= len(chunk)
-                        else:
-                            # Small file - re-compress from original
-                            original_path = Path(metadata['original_path'])
-                            if original_path.exists():
-                                with open(original_path, 'rb') as orig_f:
-                                    data = orig_f.read()
-                                
-                                if should_compress(filename):
-                                    compressed_data = OptimizedCompression.compress_smart(data)
-                                else:
-                                    compressed_data = b'\x00' + data
-                                
-                                f.write(compressed_data)
+                locations = write_archive(archive_file, archive_metadata, on_progress)
 
                 def on_complete():
                     self.hide_progress()
+                    self._adopt_saved_locations(archive_file, locations, archive_metadata)
                     self.clear_unsaved_changes()
                     self.update_archive_info()
                     self.status_var.set("💾 Archive saved successfully!")
@@ -1575,9 +2079,11 @@ class KlondikeArchiver:
                 self.root.after(0, on_complete)
 
             except Exception as e:
+                err = str(e)
+
                 def on_error():
                     self.hide_progress()
-                    messagebox.showerror("Save Error", f"Failed to save archive: {e}")
+                    messagebox.showerror("Save Error", f"Failed to save archive: {err}")
 
                 self.root.after(0, on_error)
 
@@ -1612,113 +2118,24 @@ class KlondikeArchiver:
         """Worker function to open archive with memory optimization"""
         def worker():
             try:
-                self.root.after(0, lambda: self.show_progress("Opening archive..."))
-                
-                with open(file_path, 'rb') as f:
-                    signature = f.read(8)
-                    if signature != b'KLONDIKE':
-                        raise ValueError("Not a valid Klondike archive")
-                    
-                    compression_marker = f.read(8)
-                    is_ultimate = compression_marker == b'ULTIMATE'
-                    
-                    if not is_ultimate:
-                        f.seek(8)
-                    
-                    num_files = struct.unpack('<I', f.read(4))[0]
-                    
-                    self.root.after(0, lambda: self.update_progress(20, f"Reading {num_files} files..."))
-                    
-                    table_size = struct.unpack('<I', f.read(4))[0]
-                    table_data = f.read(table_size)
-                    
-                    archive_metadata = {}
-                    table_offset = 0
-                    data_start = f.tell()
-                    
-                    # Clean up existing temp files
-                    for temp_file in self.temp_dir.glob("*.tmp"):
-                        try:
-                            temp_file.unlink()
-                        except OSError:
-                            pass
-                    
-                    for i in range(num_files):
-                        progress = 20 + (i / num_files) * 70 if num_files > 0 else 20  # FIX: Division by zero
-                        self.root.after(0, lambda p=progress, idx=i: 
-                                      self.update_progress(p, f"Loading file {idx+1}/{num_files}..."))
-                        
-                        # Parse table entry with bounds checking
-                        if table_offset + 2 > len(table_data):
-                            break
-                        filename_len = struct.unpack('<H', table_data[table_offset:table_offset+2])[0]
-                        table_offset += 2
-                        
-                        if table_offset + filename_len > len(table_data):
-                            break
-                        filename = table_data[table_offset:table_offset+filename_len].decode('utf-8')
-                        table_offset += filename_len
-                        
-                        if table_offset + 12 > len(table_data):
-                            break
-                        original_size = struct.unpack('<I', table_data[table_offset:table_offset+4])[0]
-                        table_offset += 4
-                        compressed_size = struct.unpack('<I', table_data[table_offset:table_offset+4])[0]
-                        table_offset += 4
-                        data_offset = struct.unpack('<I', table_data[table_offset:table_offset+4])[0]
-                        table_offset += 4
-                        
-                        file_type = 'file'
-                        if is_ultimate and table_offset + 2 <= len(table_data):
-                            type_len = struct.unpack('<H', table_data[table_offset:table_offset+2])[0]
-                            table_offset += 2
-                            if table_offset + type_len <= len(table_data):
-                                file_type = table_data[table_offset:table_offset+type_len].decode('utf-8')
-                                table_offset += type_len
-                            else:
-                                file_type = Path(filename).suffix or 'file'
-                        else:
-                            file_type = Path(filename).suffix or 'file'
-                        
-                        # For large files, extract compressed data to temp file
-                        if compressed_size > OptimizedCompression.LARGE_CHUNK:
-                            temp_file = self.temp_dir / f"{filename.replace('/', '_').replace('\\', '_')}.tmp"
-                            temp_file.parent.mkdir(parents=True, exist_ok=True)
-                            
-                            f.seek(data_start + data_offset)
-                            
-                            # Copy compressed data to temp file in chunks
-                            with open(temp_file, 'wb') as temp_f:
-                                remaining = compressed_size
-                                while remaining > 0:
-                                    chunk_size = min(OptimizedCompression.SMALL_CHUNK, remaining)
-                                    chunk = f.read(chunk_size)
-                                    if not chunk:
-                                        break
-                                    temp_f.write(chunk)
-                                    remaining -= len(chunk)
-                            
-                            archive_metadata[filename] = {
-                                'original_path': '',  # No original path for opened files
-                                'size': original_size,
-                                'compressed_size': compressed_size,
-                                'type': file_type,
-                                'is_large': True,
-                                'temp_file': str(temp_file)
-                            }
-                        else:
-                            # Small file - store metadata only
-                            archive_metadata[filename] = {
-                                'original_path': '',
-                                'size': original_size,
-                                'compressed_size': compressed_size,
-                                'type': file_type,
-                                'is_large': False,
-                                'temp_file': None,
-                                'data_offset': data_start + data_offset,
-                                'archive_file': file_path
-                            }
+                progress = ProgressTracker()
+                self.root.after(0, lambda: self.show_progress("Reading archive table...", progress))
                 
+                # Clean up existing temp files
+                for temp_file in self.temp_dir.glob("*.tmp"):
+                    try:
+                        temp_file.unlink()
+                    except OSError:
+                        pass
+
+                # Members stay in the archive file until they are needed
+                def on_entry(i, num_files):
+                    if not progress.total_items:
+                        progress.add_total(items=num_files)
+                    progress.update(items=i + 1)
+
+                archive_metadata, _ = read_archive_table(file_path, on_entry)
+
                 def on_complete():
                     self.hide_progress()
                     self.archive_metadata = archive_metadata
@@ -1734,7 +2151,7 @@ class KlondikeArchiver:
                 
             except Exception as e:
                 self.root.after(0, lambda: self.hide_progress())
-                self.root.after(0, lambda: messagebox.showerror("Open Error", f"Failed to open archive: {e}"))
+                self.root.after(0, lambda err=str(e): messagebox.showerror("Open Error", f"Failed to open archive: {err}"))
         
         thread = threading.Thread(target=worker, daemon=True)
         thread.start()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Time writing and reading the version 2 file table for a large synthetic archive.
+
+    python benchmarks/bench_table.py            # 1,000,000 members
+    python benchmarks/bench_table.py 200000
+
+Only the table is written (no member data), so the numbers isolate the cost of
+build_v2_table and read_archive_table from compression and disk throughput. Each
+is timed REPEAT times and the best run counts.
+
+The table is then read again under tracemalloc to measure what the loaded members
+hold once their name index is built. The run fails when a number misses its
+target in the table_targets section of baseline.json: write_seconds and
+read_seconds are for 1,000,000 members (scaled to the count given) and
+member_bytes is per member.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kc_engine
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+REPEAT = 3
+
+
+def synthetic_metadata(count):
+    """Members spread over 1000 folders with realistic sizes, mtimes and CRCs"""
+    archive_metadata = {}
+    locations = {}
+    offset = kc_engine.V2_HEADER.size
+    for i in range(count):
+        name = f"photos/{i % 1000:03d}/IMG_{i:07d}.jpg"
+        archive_metadata[name] = kc_engine.MemberRecord(
+            size=100_000 + i, compressed_size=90_000 + i, type='.jpg',
+            mtime=1_700_000_000_000_000_000 + i, crc32=i & 0xFFFFFFFF)
+        locations[name] = (offset, 90_000 + i)
+        offset += 90_000 + i
+    return archive_metadata, locations
+
+
+def table_targets():
+    """Limits the table benchmark must meet, from baseline.json"""
+    with open(BASELINE) as f:
+        return json.load(f)['table_targets']
+
+
+def loaded_bytes(path):
+    """Bytes still allocated for a table read from path, with its name index built"""
+    tracemalloc.start()
+    try:
+        loaded, _ = kc_engine.read_archive_table(path)
+        loaded.get(next(iter(loaded), ''))
+        return tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    count = int(argv[0]) if argv else 1_000_000
+    archive_metadata, locations = synthetic_metadata(count)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.kc")
+
+        build_seconds = float('inf')
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            table, flags = kc_engine.build_v2_table(path, archive_metadata, locations)
+            build_seconds = min(build_seconds, time.perf_counter() - start)
+
+        with open(path, 'wb') as f:
+            f.write(kc_engine.V2_HEADER.pack(kc_engine.ARCHIVE_SIGNATURE, kc_engine.CRINKLE2_MARKER,
+                                             count, flags, kc_engine.V2_HEADER.size, len(table)))
+            f.write(table)
+
+        read_seconds = float('inf')
+        for _ in range(REPEAT):
+            loaded = None
+            start = time.perf_counter()
+            loaded, version = kc_engine.read_archive_table(path)
+            read_seconds = min(read_seconds, time.perf_counter() - start)
+
+        if version != 2 or len(loaded) != count:
+            print(f"table round trip failed: version {version}, {len(loaded)} of {count} members", file=sys.stderr)
+            return 1
+        del loaded, archive_metadata, locations
+        member_bytes = loaded_bytes(path) / count
+
+    print(f"{count} members, {kc_engine.format_file_size(len(table))} table")
+    print(f"  write  {build_seconds:.3f}s ({count / build_seconds:,.0f} entries/s)")
+    print(f"  read   {read_seconds:.3f}s ({count / read_seconds:,.0f} entries/s)")
+    print(f"  memory {member_bytes:.0f} bytes/member once loaded")
+
+    targets = table_targets()
+    scale = count / 1_000_000
+    misses = []
+    if build_seconds > targets['write_seconds'] * scale:
+        misses.append(f"write took {build_seconds:.3f}s, target {targets['write_seconds'] * scale:.3f}s")
+    if read_seconds > targets['read_seconds'] * scale:
+        misses.append(f"read took {read_seconds:.3f}s, target {targets['read_seconds'] * scale:.3f}s")
+    if member_bytes > targets['member_bytes']:
+        misses.append(f"loaded members hold {member_bytes:.0f} bytes each, target {targets['member_bytes']}")
+    for miss in misses:
+        print(miss, file=sys.stderr)
+    return 1 if misses else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
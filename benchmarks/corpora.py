@@ -0,0 +1,166 @@
+"""
+Deterministic synthetic corpora for the benchmark suite.
+
+Every corpus is generated from a fixed seed, so two runs at the same scale see
+byte-identical input and their numbers can be compared. Sizes below are for
+scale 1.0; the suite multiplies them by --scale.
+"""
+
+import os
+import random
+
+SEED = 0x4B43
+
+WORDS = ("the of and to in is that for it as was with be by on not he this are or his from at which "
+         "but have an they you were her she there been one all we their has would when if so no will "
+         "archive folder member table stream compress extract verify backup photos notes report draft "
+         "budget meeting project summary quarter review schedule invoice customer delivery").split()
+LEVELS = ("DEBUG", "INFO", "INFO", "INFO", "WARNING", "ERROR")
+SERVICES = ("api", "worker", "scheduler", "auth", "billing", "search")
+
+# name: (file count, bytes per file, file extension)
+CORPORA = {
+    'text':   (64, 256 * 1024, '.txt'),
+    'logs':   (16, 1024 * 1024, '.log'),
+    'random': (8, 2 * 1024 * 1024, '.bin'),
+    'media':  (16, 2 * 1024 * 1024, '.jpg'),
+    'tiny':   (5000, 200, '.cfg'),
+    'huge':   (2, 48 * 1024 * 1024, '.dat'),
+}
+
+
+def _text(rng, size):
+    out = []
+    length = 0
+    while length < size:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + '.'
+        if rng.random() < 0.15:
+            sentence += '\n\n'
+        else:
+            sentence += ' '
+        out.append(sentence)
+        length += len(sentence)
+    return ''.join(out).encode('utf-8')[:size]
+
+
+def _logs(rng, size):
+    out = []
+    length = 0
+    clock = 1_700_000_000.0
+    while length < size:
+        clock += rng.expovariate(20)
+        seconds = int(clock)
+        line = (f"2023-11-{14 + seconds // 86400 % 14:02d}T{seconds // 3600 % 24:02d}:{seconds // 60 % 60:02d}:"
+                f"{seconds % 60:02d}.{int(clock * 1000) % 1000:03d}Z {rng.choice(LEVELS):<7} "
+                f"[{rng.choice(SERVICES)}] request={rng.getrandbits(32):08x} "
+                f"client=10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)} "
+                f"latency_ms={rng.randint(1, 900)} status={rng.choice((200, 200, 200, 201, 304, 404, 500))}\n")
+        out.append(line)
+        length += len(line)
+    return ''.join(out).encode('ascii')[:size]
+
+
+def _random(rng, size):
+    return rng.randbytes(size)
+
+
+def _media(rng, size):
+    """Mostly incompressible payload framed like a JPEG, with a few low-entropy runs"""
+    parts = [b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00']
+    length = len(parts[0])
+    while length < size:
+        if rng.random() < 0.05:
+            block = bytes([rng.randint(0, 255)]) * rng.randint(256, 4096)
+        else:
+            block = rng.randbytes(rng.randint(16 * 1024, 64 * 1024))
+        parts.append(block)
+        length += len(block)
+    return (b''.join(parts)[:size - 2]) + b'\xff\xd9'
+
+
+def _tiny(rng, size):
+    keys = ('name', 'enabled', 'path', 'timeout', 'retries', 'owner')
+    lines = [f"{rng.choice(keys)} = {rng.choice(WORDS)}{rng.randint(0, 99)}" for _ in range(max(1, size // 24))]
+    return ('\n'.join(lines) + '\n').encode('ascii')[:size]
+
+
+def _huge(rng, size):
+    """Large files mixing compressible records with random blocks, as disk images or databases do"""
+    record = _logs(rng, 1024 * 1024)
+    noise = rng.randbytes(1024 * 1024)
+    chunks = []
+    length = 0
+    while length < size:
+        chunk = record if rng.random() < 0.6 else noise
+        chunks.append(chunk)
+        length += len(chunk)
+    return b''.join(chunks)[:size]
+
+
+GENERATORS = {
+    'text': _text,
+    'logs': _logs,
+    'random': _random,
+    'media': _media,
+    'tiny': _tiny,
+    'huge': _huge,
+}
+
+
+def corpus_path(root, name, scale):
+    return os.path.join(root, f"{name}-x{scale:g}")
+
+
+def ensure_corpus(root, name, scale=1.0):
+    """Generate a corpus under root unless it is already there, returning its folder"""
+    folder = corpus_path(root, name, scale)
+    marker = os.path.join(folder, '.complete')
+    if os.path.exists(marker):
+        return folder
+
+    count, size, extension = CORPORA[name]
+    if name == 'tiny':
+        count = max(1, int(count * scale))
+    else:
+        size = max(1024, int(size * scale))
+
+    rng = random.Random(f"{SEED}:{name}")
+    generate = GENERATORS[name]
+    for i in range(count):
+        # Spread files over a few subfolders so the walker has a tree to scan
+        subfolder = os.path.join(folder, f"d{i % 8}")
+        os.makedirs(subfolder, exist_ok=True)
+        with open(os.path.join(subfolder, f"{name}{i:05d}{extension}"), 'wb') as f:
+            f.write(generate(rng, rng.randint(size // 2, size) if name == 'tiny' else size))
+
+    with open(marker, 'w') as f:
+        f.write('ok\n')
+    return folder
+
+
+def corpus_files(folder):
+    """(relative name, path) for every file in a generated corpus, in a stable order"""
+    files = []
+    for directory, folders, names in os.walk(folder):
+        folders.sort()
+        for name in sorted(names):
+            if name != '.complete':
+                path = os.path.join(directory, name)
+                files.append((os.path.relpath(path, os.path.dirname(folder)).replace(os.sep, '/'), path))
+    return files
+
+
+def corpus_sample(folder, size):
+    """The first size bytes of a corpus, repeating its files if it is smaller"""
+    parts = []
+    length = 0
+    files = corpus_files(folder)
+    while length < size:
+        for _, path in files:
+            with open(path, 'rb') as f:
+                data = f.read(size - length)
+            parts.append(data)
+            length += len(data)
+            if length >= size:
+                break
+    return b''.join(parts)
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the archive engine, with results compared against a stored baseline.
+
+    python benchmarks/run_benchmarks.py                          # run everything, compare to baseline.json
+    python benchmarks/run_benchmarks.py --only 'compress/*' --repeat 5
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --save-baseline           # accept the current numbers
+
+Cases cover every OptimizedCompression path on each kind of data, and the archive
+operations behind the GUI and CLI: create (write_archive, what Save does), open
+(read_archive_table), verify, extract, append (save_archive_changes) and the bare
+file table. Each case runs in a fresh process so its peak RSS is its own. The
+budget case fails outright if compressing files bigger than the memory budget makes
+memory grow past it.
+
+Corpora are generated deterministically (see corpora.py) and cached in --corpus-dir,
+so repeated runs skip generation. Baselines only mean something on the machine
+that recorded them; rerun with --save-baseline after changing hardware.
+"""
+
+import argparse
+import concurrent.futures
+import fnmatch
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import kc_engine
+from kc_engine import OptimizedCompression
+import corpora
+from bench_table import synthetic_metadata
+
+RESULTS_FORMAT = 1
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+RSS_SLACK_MB = 8         # peak RSS differences below this are noise, not regressions
+LATENCY_SLACK = 0.005    # likewise for timing differences, in seconds
+
+# OptimizedCompression path: (method, piece size it is called on)
+COMPRESSION_PATHS = {
+    'fast': (OptimizedCompression._compress_fast, 256 * 1024),
+    'chunked': (OptimizedCompression._compress_chunked_smart, 4 * 1024 * 1024),
+    'streaming': (OptimizedCompression._compress_streaming, 16 * 1024 * 1024),
+}
+COMPRESSION_CORPORA = ('text', 'logs', 'random', 'media')
+ARCHIVE_CORPORA = tuple(corpora.CORPORA)
+ARCHIVE_OPERATIONS = ('create', 'open', 'verify', 'extract', 'append')
+TABLE_MEMBERS = 200_000
+BUDGET_LIMIT_MB = 8      # memory budget for the budget case, smaller than every file in its corpus
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None where it cannot be read"""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+
+def case_names():
+    names = [f"compress/{path}/{corpus}" for path in COMPRESSION_PATHS for corpus in COMPRESSION_CORPORA]
+    names += [f"decompress/{corpus}" for corpus in COMPRESSION_CORPORA]
+    names += [f"{operation}/{corpus}" for corpus in ARCHIVE_CORPORA for operation in ARCHIVE_OPERATIONS]
+    names += ['table/write', 'table/read', 'budget/huge']
+    return names
+
+
+# --- Cases ---------------------------------------------------------------------
+# Each case takes (argument, context) and returns a function that does one timed
+# run and returns (bytes processed, extra fields), plus an optional reset run
+# before every repetition without being timed. Cases dominated by fixed costs
+# report 0 bytes and are compared on latency alone.
+
+def _pieces(corpus, piece_size, context):
+    folder = corpora.ensure_corpus(context['corpus_dir'], corpus, context['scale'])
+    sample = corpora.corpus_sample(folder, max(piece_size, int(16 * 1024 * 1024 * context['scale'])))
+    return [sample[i:i + piece_size] for i in range(0, len(sample), piece_size)]
+
+
+def case_compress(argument, context):
+    path, corpus = argument.split('/')
+    method, piece_size = COMPRESSION_PATHS[path]
+    pieces = _pieces(corpus, piece_size, context)
+
+    def run():
+        latencies = []
+        stored = 0
+        for piece in pieces:
+            start = time.perf_counter()
+            stored += len(method(piece))
+            latencies.append(time.perf_counter() - start)
+        total = sum(len(piece) for piece in pieces)
+        return total, {'calls': len(pieces), 'latency_ms': statistics.median(latencies) * 1000,
+                       'ratio': stored / total}
+    return run, None
+
+
+def case_decompress(corpus, context):
+    pieces = [OptimizedCompression.compress_smart(piece) for piece in _pieces(corpus, 1024 * 1024, context)]
+
+    def run():
+        latencies = []
+        total = 0
+        for piece in pieces:
+            start = time.perf_counter()
+            total += len(OptimizedCompression.decompress_smart(piece))
+            latencies.append(time.perf_counter() - start)
+        return total, {'calls': len(pieces), 'latency_ms': statistics.median(latencies) * 1000}
+    return run, None
+
+
+def _archive_path(corpus, context):
+    return os.path.join(context['work_dir'], f"{corpus}.kc")
+
+
+def _corpus_members(corpus, context):
+    folder = corpora.ensure_corpus(context['corpus_dir'], corpus, context['scale'])
+    archive_metadata = {}
+    for name, path in corpora.corpus_files(folder):
+        file_stat = os.stat(path)
+        archive_metadata[name] = kc_engine.new_member_metadata(path, file_stat.st_size, 0,
+                                                               mtime=file_stat.st_mtime_ns)
+    return archive_metadata
+
+
+def _stored_archive(corpus, context):
+    """Path of the archive written by the create case, writing it if that case did not run"""
+    path = _archive_path(corpus, context)
+    if not os.path.exists(path):
+        kc_engine.write_archive(path, _corpus_members(corpus, context))
+    return path
+
+
+def case_create(corpus, context):
+    path = _archive_path(corpus, context)
+    archive_metadata = _corpus_members(corpus, context)
+    total = sum(metadata.size for metadata in archive_metadata.values())
+
+    def run():
+        kc_engine.write_archive(path, dict(archive_metadata))
+        return total, {'members': len(archive_metadata), 'ratio': os.path.getsize(path) / max(1, total)}
+    return run, None
+
+
+def case_open(corpus, context):
+    path = _stored_archive(corpus, context)
+
+    def run():
+        archive_metadata, _ = kc_engine.read_archive_table(path)
+        return 0, {'members': len(archive_metadata)}
+    return run, None
+
+
+def case_verify(corpus, context):
+    archive_metadata, _ = kc_engine.read_archive_table(_stored_archive(corpus, context))
+
+    def run():
+        result = kc_engine.verify_archive(archive_metadata)
+        if result['failures']:
+            raise ValueError(f"verify failed: {result['failures'][:3]}")
+        return result['bytes'], {'members': result['members']}
+    return run, None
+
+
+def case_extract(corpus, context):
+    archive_metadata, _ = kc_engine.read_archive_table(_stored_archive(corpus, context))
+    target = os.path.join(context['work_dir'], f"{corpus}-extract")
+
+    def run():
+        written = 0
+        for filename, metadata in archive_metadata.items():
+            written += kc_engine.extract_member(filename, metadata, target)
+        return written, {'members': len(archive_metadata)}
+
+    def reset():
+        shutil.rmtree(target, ignore_errors=True)
+    return run, reset
+
+
+def case_append(corpus, context):
+    """Add one small member to a copy of the archive, the common incremental save"""
+    source = _stored_archive(corpus, context)
+    path = os.path.join(context['work_dir'], f"{corpus}-append.kc")
+    new_file = os.path.join(context['work_dir'], 'appended.txt')
+    with open(new_file, 'wb') as f:
+        f.write(b'appended member\n' * 64)
+
+    def reset():
+        shutil.copyfile(source, path)
+
+    def run():
+        archive_metadata, _ = kc_engine.read_archive_table(path)
+        archive_metadata['appended.txt'] = kc_engine.new_member_metadata(new_file, os.path.getsize(new_file), 0)
+        kc_engine.save_archive_changes(path, archive_metadata)
+        return 0, {'members': len(archive_metadata)}
+    return run, reset
+
+
+def case_table(argument, context):
+    count = max(1000, int(TABLE_MEMBERS * context['scale']))
+    archive_metadata, locations = synthetic_metadata(count)
+    path = os.path.join(context['work_dir'], 'table.kc')
+    table, flags = kc_engine.build_v2_table(path, archive_metadata, locations)
+
+    if argument == 'write':
+        def run():
+            return len(kc_engine.build_v2_table(path, archive_metadata, locations)[0]), {'members': count}
+        return run, None
+
+    with open(path, 'wb') as f:
+        f.write(kc_engine.V2_HEADER.pack(kc_engine.ARCHIVE_SIGNATURE, kc_engine.CRINKLE2_MARKER,
+                                         count, flags, kc_engine.V2_HEADER.size, len(table)))
+        f.write(table)
+    del archive_metadata, locations
+
+    def run():
+        kc_engine.read_archive_table(path)
+        return len(table), {'members': count}
+    return run, None
+
+
+def case_budget(corpus, context):
+    """Create a streamed archive of files bigger than the memory budget; fails unless memory stays within it"""
+    folder = corpora.ensure_corpus(context['corpus_dir'], corpus, context['scale'])
+    files = [(name, path, os.stat(path)) for name, path in corpora.corpus_files(folder)]
+    total = sum(file_stat.st_size for _, _, file_stat in files)
+    path = os.path.join(context['work_dir'], f"{corpus}-budget.kc")
+    kc_engine.MEMORY_BUDGET.limit = BUDGET_LIMIT_MB * 1024 * 1024
+    rss_before = peak_rss()
+
+    def run():
+        with open(path, 'wb') as out:
+            kc_engine.write_archive_stream(out, files)
+        extra = {'members': len(files), 'ratio': os.path.getsize(path) / max(1, total)}
+        if rss_before is not None:
+            growth = (peak_rss() - rss_before) / 1e6
+            if growth > BUDGET_LIMIT_MB + RSS_SLACK_MB:
+                raise ValueError(f"peak RSS grew {growth:.1f} MB with a {BUDGET_LIMIT_MB} MB memory budget")
+            extra['rss_growth_mb'] = growth
+        return total, extra
+    return run, None
+
+
+CASES = {
+    'compress': case_compress,
+    'decompress': case_decompress,
+    'create': case_create,
+    'open': case_open,
+    'verify': case_verify,
+    'extract': case_extract,
+    'append': case_append,
+    'table': case_table,
+    'budget': case_budget,
+}
+
+
+def prepare_case(name, context):
+    """Generate the corpus and archive a case reads, so their cost stays out of its RSS"""
+    kind, _, argument = name.partition('/')
+    corpus = argument.rpartition('/')[2]
+    if corpus in corpora.CORPORA:
+        corpora.ensure_corpus(context['corpus_dir'], corpus, context['scale'])
+    if kind in ARCHIVE_OPERATIONS and kind != 'create':
+        _stored_archive(corpus, context)
+
+
+def run_case(name, context):
+    """Set up and time one case; runs in its own process"""
+    kind, _, argument = name.partition('/')
+    run, reset = CASES[kind](argument, context)
+
+    timings = []
+    extra = {}
+    processed = 0
+    for _ in range(context['repeat']):
+        if reset:
+            reset()
+        start = time.perf_counter()
+        processed, extra = run()
+        timings.append(time.perf_counter() - start)
+
+    seconds = statistics.median(timings)
+    rss = peak_rss()
+    result = {
+        'seconds': round(seconds, 6),
+        'best_seconds': round(min(timings), 6),
+        'bytes': processed,
+        'mb_per_s': round(processed / seconds / 1e6, 3) if processed and seconds > 0 else None,
+        'peak_rss_mb': round(rss / 1e6, 1) if rss else None,
+    }
+    for key, value in extra.items():
+        result[key] = round(value, 4) if isinstance(value, float) else value
+    return result
+
+
+# --- Running, reporting and comparing -------------------------------------------
+
+def run_suite(names, context):
+    """Run each case in a fresh process after preparing its inputs in another, printing results as they come"""
+    spawn = multiprocessing.get_context('spawn')
+    results = {}
+    for name in names:
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                pool.submit(prepare_case, name, context).result()
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                result = pool.submit(run_case, name, context).result()
+        except Exception as e:
+            print(f"{name:<28} FAILED: {e}", file=sys.stderr)
+            results[name] = {'error': str(e)}
+            continue
+        results[name] = result
+        print(format_result(name, result), flush=True)
+    return results
+
+
+def format_result(name, result):
+    line = f"{name:<28} {result['seconds'] * 1000:>10.1f} ms"
+    if result.get('mb_per_s') is not None:
+        line += f" {result['mb_per_s']:>9.1f} MB/s"
+    else:
+        line += ' ' * 15
+    if result.get('peak_rss_mb') is not None:
+        line += f" {result['peak_rss_mb']:>8.1f} MB RSS"
+    if 'latency_ms' in result:
+        line += f"  {result['latency_ms']:.2f} ms/call"
+    if 'ratio' in result:
+        line += f"  ratio {result['ratio']:.3f}"
+    return line
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare_results(results, baseline, tolerance):
+    """Regressions of results against baseline, as printable lines"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if not base or 'error' in base:
+            continue
+        if 'error' in result:
+            regressions.append(f"{name}: failed ({result['error']})")
+            continue
+
+        if result.get('mb_per_s') and base.get('mb_per_s'):
+            if result['mb_per_s'] < base['mb_per_s'] * (1 - tolerance):
+                regressions.append(f"{name}: {result['mb_per_s']:.1f} MB/s, baseline {base['mb_per_s']:.1f} MB/s "
+                                   f"({result['mb_per_s'] / base['mb_per_s'] - 1:+.0%})")
+        elif result['seconds'] > base['seconds'] * (1 + tolerance) + LATENCY_SLACK:
+            regressions.append(f"{name}: {result['seconds'] * 1000:.1f} ms, baseline {base['seconds'] * 1000:.1f} ms")
+
+        if result.get('peak_rss_mb') and base.get('peak_rss_mb'):
+            limit = base['peak_rss_mb'] * (1 + tolerance) + RSS_SLACK_MB
+            if result['peak_rss_mb'] > limit:
+                regressions.append(f"{name}: peak RSS {result['peak_rss_mb']:.1f} MB, "
+                                   f"baseline {base['peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Klondike archive engine")
+    parser.add_argument("--scale", type=float, default=1.0, help="corpus size multiplier (default 1.0)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case; the median is reported")
+    parser.add_argument("--only", action="append", metavar="PATTERN",
+                        help="run only cases matching this glob, e.g. 'compress/*' (repeatable)")
+    parser.add_argument("--corpus-dir", help="where generated corpora are cached (default: a temp folder)")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown or RSS growth before a case counts as a regression (default 0.25)")
+    parser.add_argument("--list", action="store_true", help="list case names and exit")
+    args = parser.parse_args(argv)
+
+    names = case_names()
+    if args.only:
+        names = [name for name in names if any(fnmatch.fnmatchcase(name, pattern) for pattern in args.only)]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+    if not names:
+        print("no benchmark cases match", file=sys.stderr)
+        return 1
+
+    corpus_dir = args.corpus_dir or os.path.join(tempfile.gettempdir(), 'kc-bench-corpora')
+    os.makedirs(corpus_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix='kc-bench-') as work_dir:
+        context = {'scale': args.scale, 'repeat': args.repeat, 'corpus_dir': corpus_dir, 'work_dir': work_dir}
+        started = time.time()
+        results = run_suite(names, context)
+
+    report = {
+        'format': RESULTS_FORMAT,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'machine': machine_info(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    failed = any('error' in result for result in results.values())
+    if args.save_baseline:
+        if failed:
+            print("not saving a baseline with failed cases", file=sys.stderr)
+            return 1
+        if os.path.exists(args.baseline):
+            # Keep numbers for cases that were not rerun
+            with open(args.baseline) as f:
+                previous = json.load(f)
+            if previous.get('scale') == args.scale:
+                report['results'] = {**previous['results'], **results}
+            if 'table_targets' in previous:
+                report['table_targets'] = previous['table_targets']
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 1 if failed else 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('scale') != args.scale:
+        print(f"Baseline was recorded at scale {baseline.get('scale')}, not compared", file=sys.stderr)
+        return 1 if failed else 0
+
+    regressions = compare_results(results, baseline, args.tolerance)
+    if baseline.get('machine') != report['machine']:
+        print("Note: baseline was recorded on a different machine or Python", file=sys.stderr)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -59,6 +59,34 @@ def build_exe():
         print(f"[ERROR] Build failed: {e}")
         return False
 
+def build_cli_exe():
+    """Build the command line tool"""
+    print("\nBuilding kc.exe...")
+    
+    if not Path('kc_cli.py').exists():
+        print("[ERROR] kc_cli.py not found!")
+        return False
+    
+    # Console build, tkinter is excluded since the CLI never uses it
+    cmd = [
+        sys.executable, '-m', 'PyInstaller',
+        '--onefile',                    # Single executable
+        '--console',                    # Keep the console for output
+        '--name=kc',                   # Output name
+        '--exclude-module=tkinter',    # Not needed headless
+        '--distpath=dist',             # Output folder
+        'kc_cli.py'                    # Main file
+    ]
+    
+    try:
+        print("Running PyInstaller...")
+        subprocess.run(cmd, check=True)
+        print("[OK] Executable created: dist/kc.exe")
+        return True
+    except subprocess.CalledProcessError as e:
+        print(f"[ERROR] Build failed: {e}")
+        return False
+
 def create_inno_script():
     """Create Inno Setup script for professional installer"""
     print("\nCreating Inno Setup installer script...")
@@ -96,6 +124,7 @@ Name: "fileassoc"; Description: "Associate .kc files with Klondike Archiver"; Gr
 
 [Files]
 Source: "dist\KCrinkle.exe"; DestDir: "{app}"; Flags: ignoreversion
+Source: "dist\kc.exe"; DestDir: "{app}"; Flags: ignoreversion
 Source: "klondike_icon.ico"; DestDir: "{app}"; Flags: ignoreversion
 Source: "kc_file_icon.ico"; DestDir: "{app}"; Flags: ignoreversion
 Source: "LICENSE.txt"; DestDir: "{app}"; Flags: ignoreversion isreadme
@@ -212,9 +241,11 @@ def main():
     if not install_pyinstaller():
         return False
     
-    # Build executable
+    # Build executables
     if not build_exe():
         return False
+    if not build_cli_exe():
+        return False
     
     # Create installer scripts
     create_inno_script()
@@ -224,6 +255,7 @@ def main():
     print("[SUCCESS] BUILD COMPLETE!")
     print("\nFILES CREATED:")
     print("   dist/KCrinkle.exe - Your application")
+    print("   dist/kc.exe - Command line tool")
     print("   KlondikeSetup.iss - Inno Setup script")
     print("   build_inno_installer.bat - Build Inno installer")
     
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Klondike Archiver command line tool - works with .kc archives without the GUI.
+
+    python kc_cli.py create backup.kc photos/ notes.txt
+    python kc_cli.py list backup.kc
+    python kc_cli.py extract backup.kc -C restore/
+    python kc_cli.py add backup.kc more_photos/
+    python kc_cli.py sync backup.kc photos/ --delete
+    python kc_cli.py verify backup.kc
+    find photos -type f | python kc_cli.py create - | ssh backup 'cat > photos.kc'
+    python kc_cli.py import legacy.zip legacy.kc
+    python kc_cli.py export backup.kc backup.tar.gz
+    python kc_cli.py grep 'status=5..' logs.kc --name '*.log'
+    python kc_cli.py peek logs.kc app/server.log -n 4K
+
+Only kc_engine is imported, never tkinter, so it runs on headless machines and
+starts quickly enough to be called once per archive from scripts.
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import kc_engine
+from kc_engine import format_file_size
+
+
+def _member_name(path):
+    """Archive name for a listed path: relative and with forward slashes, the way tar stores it"""
+    name = os.path.normpath(os.path.splitdrive(path)[1]).replace(os.sep, '/')
+    return '/'.join(part for part in name.split('/') if part not in ('', '.', '..'))
+
+
+def _listed_files(lines, on_error):
+    """(member name, path, stat) for each file named on its own line, as find prints them.
+
+    Folders are skipped, since find lists their files separately. Paths that cannot
+    be stat'ed are passed to on_error(path, error).
+    """
+    for line in lines:
+        path = line.rstrip('\r\n')
+        if not path:
+            continue
+        try:
+            file_stat = os.stat(path)
+        except OSError as e:
+            on_error(path, e.strerror)
+            continue
+        if not os.path.isdir(path):
+            yield _member_name(path), Path(path), file_stat
+
+
+def _input_files(paths, on_error):
+    """Files named on the command line, or listed on stdin when there are none"""
+    if paths:
+        return kc_engine.collect_input_files(paths)
+    if sys.stdin.isatty():
+        return []
+    return _listed_files(sys.stdin, on_error)
+
+
+class _ErrorCount:
+    """on_error callback that reports each failure and counts them"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, name, error):
+        self.count += 1
+        print(f"kc: {name}: {error}", file=sys.stderr)
+
+
+def _add_files(archive_metadata, files, verbose):
+    """Add or replace members for (name, path, stat) items"""
+    count = 0
+    for relative_name, file_path, file_stat in files:
+        archive_metadata[relative_name] = kc_engine.new_member_metadata(
+            file_path, file_stat.st_size, 0, mtime=file_stat.st_mtime_ns)
+        count += 1
+        if verbose:
+            print(relative_name)
+    return count
+
+
+def _create_stream(args):
+    """Write a streamed archive to stdout in one pass"""
+    if sys.stdout.isatty():
+        print("kc: refusing to write archive data to a terminal", file=sys.stderr)
+        return 1
+    errors = _ErrorCount()
+
+    def on_member(filename, original_size):
+        if args.verbose:
+            print(filename, file=sys.stderr)
+
+    archive_metadata = kc_engine.write_archive_stream(sys.stdout.buffer, _input_files(args.paths, errors),
+                                                      on_member, errors)
+    print(f"Streamed {len(archive_metadata)} file(s)", file=sys.stderr)
+    return 1 if errors.count or not archive_metadata else 0
+
+
+def cmd_create(args):
+    if args.volume_dir and not args.volume_size:
+        raise ValueError("--volume-dir needs --volume-size")
+    if args.archive == '-':
+        if args.volume_size:
+            raise ValueError("a streamed archive can't be split into volumes")
+        return _create_stream(args)
+    errors = _ErrorCount()
+    archive_metadata = {}
+    count = _add_files(archive_metadata, _input_files(args.paths, errors), args.verbose)
+    if not count:
+        print("kc: no files to archive", file=sys.stderr)
+        return 1
+    if args.volume_size:
+        volumes = kc_engine.write_volumes(args.archive, archive_metadata, args.volume_size, args.volume_dir)
+        print(f"Created {args.archive} with {count} file(s) in {len(volumes)} volume(s)")
+        return 1 if errors.count else 0
+    kc_engine.write_archive(args.archive, archive_metadata)
+    print(f"Created {args.archive} with {count} file(s)")
+    return 1 if errors.count else 0
+
+
+def cmd_add(args):
+    if os.path.exists(args.archive):
+        archive_metadata, _ = kc_engine.read_archive_table(args.archive)
+    else:
+        archive_metadata = {}
+    count = _add_files(archive_metadata, kc_engine.collect_input_files(args.paths), args.verbose)
+    kc_engine.save_archive_changes(args.archive, archive_metadata)
+    print(f"Added {count} file(s) to {args.archive}")
+    return 0
+
+
+def cmd_sync(args):
+    archive_metadata, _ = kc_engine.read_archive_table(args.archive)
+    plan = kc_engine.plan_folder_sync(archive_metadata, args.folder, args.checksum, args.delete)
+
+    for relative_name, file_path, file_stat in plan['updated'] + plan['added']:
+        archive_metadata[relative_name] = kc_engine.new_member_metadata(
+            file_path, file_stat.st_size, 0, mtime=file_stat.st_mtime_ns)
+        if args.verbose:
+            print(relative_name)
+    for filename in plan['removed']:
+        del archive_metadata[filename]
+
+    if plan['updated'] or plan['added'] or plan['removed']:
+        kc_engine.save_archive_changes(args.archive, archive_metadata)
+    print(f"{len(plan['added'])} added, {len(plan['updated'])} updated, "
+          f"{len(plan['removed'])} removed, {len(plan['unchanged'])} unchanged")
+    return 0
+
+
+def cmd_list(args):
+    archive_metadata, _ = kc_engine.read_archive_table(args.archive)
+    if not args.long:
+        for filename in archive_metadata:
+            print(filename)
+        return 0
+
+    total_original = 0
+    total_compressed = 0
+    for filename, metadata in archive_metadata.items():
+        original_size = metadata['size']
+        compressed_size = metadata['compressed_size']
+        total_original += original_size
+        total_compressed += compressed_size
+        ratio = f"{(compressed_size / original_size * 100):.1f}%" if original_size > 0 else "0%"
+        print(f"{format_file_size(original_size):>10} {format_file_size(compressed_size):>10} {ratio:>7}  {filename}")
+    print(f"{len(archive_metadata)} files, {format_file_size(total_original)} -> {format_file_size(total_compressed)}")
+    return 0
+
+
+def _name_list(path):
+    """Member names or patterns from a list file, one per line (- for stdin)"""
+    if path == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    return [line for line in lines if line.strip()]
+
+
+def cmd_extract(args):
+    archive_metadata, _ = kc_engine.read_archive_table(args.archive)
+    include = list(args.members) + (args.include or [])
+    if args.list_file:
+        include += _name_list(args.list_file)
+    if args.list_file and not include:
+        print("kc: no names listed", file=sys.stderr)
+        return 1
+    names, missing = kc_engine.select_members(archive_metadata, include, args.exclude)
+    for pattern in missing:
+        print(f"kc: {pattern}: not in archive", file=sys.stderr)
+
+    counts = {'extracted': 0, 'skipped': 0, 'bytes': 0}
+
+    def on_member(filename, written, error):
+        if error is not None:
+            print(f"kc: {error}", file=sys.stderr)
+        elif written is None:
+            counts['skipped'] += 1
+        else:
+            counts['extracted'] += 1
+            counts['bytes'] += written
+            if args.verbose:
+                print(filename)
+
+    failures = kc_engine.extract_members(archive_metadata, names, args.directory, args.skip_current, args.jobs, on_member)
+
+    summary = f"Extracted {counts['extracted']} file(s), {format_file_size(counts['bytes'])} written"
+    if args.skip_current:
+        summary += f", skipped {counts['skipped']} already up to date"
+    print(summary)
+    return 1 if failures or missing else 0
+
+
+def cmd_import(args):
+    errors = _ErrorCount()
+    counts = {'members': 0, 'passthrough': 0}
+
+    def on_member(filename, original_size, passthrough):
+        counts['members'] += 1
+        counts['passthrough'] += passthrough
+        if args.verbose:
+            print(filename, file=sys.stderr if args.archive == '-' else sys.stdout)
+
+    if args.archive == '-':
+        if sys.stdout.isatty():
+            print("kc: refusing to write archive data to a terminal", file=sys.stderr)
+            return 1
+        kc_engine.import_zip(args.zip, sys.stdout.buffer, on_member, errors)
+        report = sys.stderr
+    else:
+        # Write beside the target so a failed import leaves nothing half written
+        partial_path = args.archive + '.partial'
+        try:
+            with open(partial_path, 'wb') as out:
+                kc_engine.import_zip(args.zip, out, on_member, errors)
+            os.replace(partial_path, args.archive)
+        except BaseException:
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+            raise
+        report = sys.stdout
+
+    print(f"Imported {counts['members']} file(s), {counts['passthrough']} without recompressing", file=report)
+    return 1 if errors.count else 0
+
+
+EXPORT_FORMATS = {'.zip': 'zip', '.tar': 'tar', '.tgz': 'tgz', '.tar.gz': 'tgz'}
+
+
+def _export_format(args):
+    if args.format:
+        return args.format
+    lower = args.output.lower()
+    for extension, export_format in EXPORT_FORMATS.items():
+        if lower.endswith(extension):
+            return export_format
+    raise ValueError("can't tell the export format from the output name; use --format")
+
+
+def cmd_export(args):
+    export_format = _export_format(args)
+    archive_metadata, _ = kc_engine.read_archive_table(args.archive)
+    names = [kc_engine.stored_member_name(archive_metadata, name) for name in args.members]
+    if None in names:
+        raise ValueError(f"{args.members[names.index(None)]}: not in archive")
+    names = names or None
+
+    def on_member(filename, original_size):
+        if args.verbose:
+            print(filename, file=sys.stderr if args.output == '-' else sys.stdout)
+
+    def export(out):
+        if export_format == 'zip':
+            kc_engine.export_zip(archive_metadata, out, names, on_member)
+        else:
+            kc_engine.export_tar(archive_metadata, out, 6 if export_format == 'tgz' else None, names, on_member)
+
+    if args.output == '-':
+        if sys.stdout.isatty():
+            print("kc: refusing to write archive data to a terminal", file=sys.stderr)
+            return 1
+        export(sys.stdout.buffer)
+        return 0
+
+    partial_path = args.output + '.partial'
+    try:
+        with open(partial_path, 'wb') as out:
+            export(out)
+        os.replace(partial_path, args.output)
+    except BaseException:
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+        raise
+    print(f"Exported {len(names or archive_metadata)} file(s) to {args.output}")
+    return 0
+
+
+def cmd_merge(args):
+    counts = kc_engine.merge_archives(args.sources, args.output, args.on_conflict)
+    print(f"Merged {len(args.sources)} archive(s) into {args.output}: {counts['members']} file(s)")
+    for key in ('skipped', 'replaced', 'renamed'):
+        if counts[key]:
+            print(f"  {counts[key]} name conflict(s) {key}")
+    return 0
+
+
+SIZE_SUFFIXES = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+
+def _parse_size(text):
+    """argparse type for sizes like 4096, 700M or 4.5G"""
+    number = text.strip().upper().removesuffix('B').removesuffix('I')
+    suffix = number[-1:] if number[-1:] in SIZE_SUFFIXES else ''
+    try:
+        size = int(float(number[:len(number) - len(suffix)]) * SIZE_SUFFIXES[suffix])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size {text!r}") from None
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"size must be positive, not {text!r}")
+    return size
+
+
+def cmd_split(args):
+    def on_part(number, total, path):
+        if args.verbose:
+            print(path)
+
+    paths = kc_engine.split_archive(args.archive, args.max_size, args.output, on_part)
+    print(f"Split {args.archive} into {len(paths)} part(s)")
+    return 0
+
+
+def cmd_grep(args):
+    archive_metadata, _ = kc_engine.read_archive_table(args.archive)
+    errors = _ErrorCount()
+    found = set()
+    for filename, offset, line in kc_engine.grep_archive(archive_metadata, args.pattern, args.name, args.fixed_strings,
+                                                         args.ignore_case, 1 if args.files_with_matches else None,
+                                                         args.jobs, errors):
+        if args.files_with_matches:
+            print(filename)
+        else:
+            print(f"{filename}:{offset}:{line}")
+        found.add(filename)
+    if errors.count:
+        return 2
+    return 0 if found else 1
+
+
+def cmd_peek(args):
+    archive_metadata, _ = kc_engine.read_archive_table(args.archive)
+    name = kc_engine.stored_member_name(archive_metadata, args.member)
+    if name is None:
+        print(f"kc: {args.member}: not in archive", file=sys.stderr)
+        return 1
+    data = kc_engine.peek_member(name, archive_metadata[name], args.bytes)
+    if args.hex or not kc_engine.looks_like_text(data):
+        if data:
+            print(kc_engine.hex_dump(data))
+    else:
+        sys.stdout.flush()
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+    return 0
+
+
+def cmd_verify(args):
+    archive_metadata, _ = kc_engine.read_archive_table(args.archive)
+    result = kc_engine.verify_archive(archive_metadata, max_workers=args.jobs)
+    for filename, err in result['failures']:
+        print(f"kc: {err}" if err.startswith(filename) else f"kc: {filename}: {err}", file=sys.stderr)
+    print(f"{result['verified']}/{result['members']} file(s) OK, "
+          f"{format_file_size(result['bytes'])} in {result['seconds']:.2f}s "
+          f"({format_file_size(result['throughput'])}/s)")
+    if result['unchecked']:
+        print(f"{result['unchecked']} file(s) have no stored checksum (size check only)")
+    return 1 if result['failures'] else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="kc", description="Work with Klondike Crinkle (.kc) archives")
+    parser.add_argument("--memory-limit", type=int, metavar="MB",
+                        help="cap on memory held by files being compressed (default: $KC_MEMORY_LIMIT_MB or 1024)")
+    parser.add_argument("--profile", action="store_true",
+                        help="print time spent in each phase (read, compress, copy, ...) when done (or set $KC_PROFILE=1)")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="write a Chrome trace_event JSON of every phase to FILE (or set $KC_TRACE)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    create = commands.add_parser("create", help="create a new archive from files and folders")
+    create.add_argument("archive", help="archive to write, or - to stream it to stdout")
+    create.add_argument("paths", nargs="*", help="files and folders to add (default: file names read from stdin)")
+    create.add_argument("--volume-size", type=_parse_size, metavar="SIZE",
+                        help="spread member data over ARCHIVE.001, ARCHIVE.002, ... of at most SIZE each, e.g. 4G")
+    create.add_argument("--volume-dir", action="append", metavar="DIR",
+                        help="put volumes in DIR; repeat to write volumes on several disks at once")
+    create.add_argument("-v", "--verbose", action="store_true", help="print each file added")
+    create.set_defaults(func=cmd_create)
+
+    add = commands.add_parser("add", help="add files and folders to an archive (append-style save)")
+    add.add_argument("archive")
+    add.add_argument("paths", nargs="+")
+    add.add_argument("-v", "--verbose", action="store_true", help="print each file added")
+    add.set_defaults(func=cmd_add)
+
+    sync = commands.add_parser("sync", help="bring an archive up to date with a folder")
+    sync.add_argument("archive")
+    sync.add_argument("folder")
+    sync.add_argument("--delete", action="store_true", help="remove entries for files deleted from the folder")
+    sync.add_argument("--checksum", action="store_true", help="compare contents by CRC32 instead of mtime")
+    sync.add_argument("-v", "--verbose", action="store_true", help="print each file written")
+    sync.set_defaults(func=cmd_sync)
+
+    list_cmd = commands.add_parser("list", help="list archive contents")
+    list_cmd.add_argument("archive")
+    list_cmd.add_argument("-l", "--long", action="store_true", help="show sizes and compression ratios")
+    list_cmd.set_defaults(func=cmd_list)
+
+    extract = commands.add_parser("extract", help="extract all or some members")
+    extract.add_argument("archive")
+    extract.add_argument("members", nargs="*", help="members, folders or globs to extract (default: all)")
+    extract.add_argument("--include", action="append", metavar="GLOB", help="extract members matching GLOB (repeatable)")
+    extract.add_argument("--exclude", action="append", metavar="GLOB", help="skip members matching GLOB (repeatable)")
+    extract.add_argument("--from", dest="list_file", metavar="FILE",
+                         help="extract the members or globs listed in FILE, one per line (- for stdin)")
+    extract.add_argument("-C", "--directory", default=".", help="extract into this directory")
+    extract.add_argument("--skip-current", action="store_true", help="skip files already up to date on disk")
+    extract.add_argument("-j", "--jobs", type=int, default=None, help="worker threads (default: up to 8)")
+    extract.add_argument("-v", "--verbose", action="store_true", help="print each file extracted")
+    extract.set_defaults(func=cmd_extract)
+
+    import_cmd = commands.add_parser("import", help="convert a ZIP file, reusing its compressed data")
+    import_cmd.add_argument("zip")
+    import_cmd.add_argument("archive", help="archive to write, or - to stream it to stdout")
+    import_cmd.add_argument("-v", "--verbose", action="store_true", help="print each file imported")
+    import_cmd.set_defaults(func=cmd_import)
+
+    export = commands.add_parser("export", help="write members to a zip or tar file without extracting them")
+    export.add_argument("archive")
+    export.add_argument("output", help="zip, tar or tar.gz file to write, or - for stdout (with --format)")
+    export.add_argument("members", nargs="*", help="member names to export (default: all)")
+    export.add_argument("--format", choices=("zip", "tar", "tgz"), help="output format (default: from the output name)")
+    export.add_argument("-v", "--verbose", action="store_true", help="print each file exported")
+    export.set_defaults(func=cmd_export)
+
+    merge = commands.add_parser("merge", help="combine archives into one without recompressing")
+    merge.add_argument("output")
+    merge.add_argument("sources", nargs="+")
+    merge.add_argument("--on-conflict", choices=kc_engine.MERGE_POLICIES, default="error",
+                       help="what to do when a name is in more than one source (default: error)")
+    merge.set_defaults(func=cmd_merge)
+
+    split = commands.add_parser("split", help="split an archive into smaller complete archives")
+    split.add_argument("archive")
+    split.add_argument("--max-size", type=_parse_size, required=True, metavar="SIZE",
+                       help="largest part to write, e.g. 700M or 4G")
+    split.add_argument("-o", "--output", metavar="TEMPLATE",
+                       help="part names as a format string, e.g. 'backup-{:02d}.kc' (default: ARCHIVE.part001.kc, ...)")
+    split.add_argument("-v", "--verbose", action="store_true", help="print each part written")
+    split.set_defaults(func=cmd_split)
+
+    grep = commands.add_parser("grep", help="search member contents without extracting them")
+    grep.add_argument("pattern", help="regular expression matched against each line")
+    grep.add_argument("archive")
+    grep.add_argument("--name", metavar="GLOB", help="only search members whose names match GLOB")
+    grep.add_argument("-F", "--fixed-strings", action="store_true", help="treat the pattern as a literal string")
+    grep.add_argument("-i", "--ignore-case", action="store_true")
+    grep.add_argument("-l", "--files-with-matches", action="store_true", help="print only the names of matching members")
+    grep.add_argument("-j", "--jobs", type=int, default=None, help="worker threads (default: all cores)")
+    grep.set_defaults(func=cmd_grep)
+
+    peek = commands.add_parser("peek", help="print the start of a member, decompressing only that much")
+    peek.add_argument("archive")
+    peek.add_argument("member")
+    peek.add_argument("-n", "--bytes", type=_parse_size, default=kc_engine.PEEK_SIZE, metavar="SIZE",
+                      help="how much to show (default: 64K)")
+    peek.add_argument("--hex", action="store_true", help="always show a hex dump, even for text")
+    peek.set_defaults(func=cmd_peek)
+
+    verify = commands.add_parser("verify", help="check every member against its stored checksum")
+    verify.add_argument("archive")
+    verify.add_argument("-j", "--jobs", type=int, default=None, help="worker threads (default: all cores)")
+    verify.set_defaults(func=cmd_verify)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.memory_limit:
+        kc_engine.MEMORY_BUDGET.limit = args.memory_limit * 1024 * 1024
+    if args.profile or args.trace:
+        kc_engine.PROFILER.start(args.trace, report=args.profile)
+    try:
+        return args.func(args)
+    except BrokenPipeError:
+        # Output piped into something like head that stopped reading; stay quiet on exit too
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except (OSError, ValueError) as e:
+        print(f"kc: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,3953 @@
+"""
+Klondike Archiver engine - .kc container and compression code with no GUI dependencies.
+
+Used by the Tk application (KCrinkle.py) and the command line tool (kc_cli.py).
+"""
+
+import fnmatch
+import gc
+import itertools
+import lzma
+import operator
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+from contextlib import contextmanager
+import threading
+import time
+import zlib
+from array import array
+from collections.abc import ItemsView, MutableMapping, ValuesView
+from pathlib import Path
+
+COMPRESSED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.mp3', '.mp4', '.avi', '.mkv', '.zip', '.rar', '.7z', '.gz', '.exe', '.dll', '.pdf', '.apk', '.webp'}
+
+def should_compress(filename):
+    return Path(filename).suffix.lower() not in COMPRESSED_EXTENSIONS
+
+# Machine code is compressed with lzma after a branch converter (BCJ) for its
+# instruction set, chosen from the PE or ELF header rather than the extension, so
+# extensionless ELF binaries and .so/.pyd files are found as well as .exe and .dll.
+PE_BRANCH_FILTERS = {0x014C: lzma.FILTER_X86, 0x8664: lzma.FILTER_X86,          # i386, x86-64
+                     0x01C0: lzma.FILTER_ARM, 0x01C4: lzma.FILTER_ARMTHUMB}     # ARM, ARMv7 (Thumb-2)
+ELF_BRANCH_FILTERS = {3: lzma.FILTER_X86, 62: lzma.FILTER_X86, 40: lzma.FILTER_ARM}
+if hasattr(lzma, 'FILTER_ARM64'):
+    PE_BRANCH_FILTERS[0xAA64] = ELF_BRANCH_FILTERS[183] = lzma.FILTER_ARM64
+EXECUTABLE_MIN_SIZE = 4096      # smaller files do not repay the xz container overhead
+EXECUTABLE_PRESET = 6
+
+def executable_filters(data):
+    """lzma filter chain for a PE or ELF executable, or None when data is not one.
+
+    Executables for other machines still get LZMA2, just without a branch converter.
+    """
+    if len(data) < EXECUTABLE_MIN_SIZE:
+        return None
+    if data[:4] == b'\x7fELF':
+        machine = int.from_bytes(data[18:20], 'big' if data[5] == 2 else 'little')
+        branch = ELF_BRANCH_FILTERS.get(machine)
+    elif data[:2] == b'MZ':
+        pe_offset = int.from_bytes(data[60:64], 'little')
+        if data[pe_offset:pe_offset + 4] != b'PE\0\0':
+            return None
+        branch = PE_BRANCH_FILTERS.get(int.from_bytes(data[pe_offset + 4:pe_offset + 6], 'little'))
+    else:
+        return None
+    # A dictionary larger than the file only costs memory
+    lzma2 = {'id': lzma.FILTER_LZMA2, 'preset': EXECUTABLE_PRESET,
+             'dict_size': min(8 * 1024 * 1024, max(len(data), 64 * 1024))}
+    return [{'id': branch}, lzma2] if branch else [lzma2]
+
+def format_file_size(size):
+    """Format file size in human readable format"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024.0:
+            return f"{size:.1f} {unit}"
+        size /= 1024.0
+    return f"{size:.1f} TB"
+
+def format_duration(seconds):
+    """Format a duration as M:SS, or H:MM:SS once it reaches an hour"""
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+class ProgressTracker:
+    """Progress counters that a worker thread updates and a display polls.
+
+    Reporting is a few attribute writes under a lock, so a worker can report every
+    file or table entry without flooding the UI thread. The display calls snapshot()
+    at its own frame rate. Progress is weighted by bytes when a byte total is known,
+    otherwise by items. Finished results that the display has to apply (such as new
+    archive members) are queued with post() and collected in batches with take_results().
+    """
+
+    def __init__(self, total_items=0, total_bytes=0):
+        self._lock = threading.Lock()
+        self.total_items = total_items
+        self.total_bytes = total_bytes
+        self.items_done = 0
+        self.bytes_done = 0
+        self.current = None
+        self._current_bytes = 0
+        self.started = time.monotonic()
+        self._sample_time = self.started
+        self._sample_bytes = 0
+        self.rate = 0.0
+        self._results = []
+
+    def add_total(self, items=0, nbytes=0):
+        """Grow the totals when more work is discovered (e.g. while scanning a folder)"""
+        with self._lock:
+            self.total_items += items
+            self.total_bytes += nbytes
+
+    def next_item(self, name, nbytes=0):
+        """Count the previous item as done and start on name, which is nbytes long"""
+        with self._lock:
+            if self.current is not None:
+                self.items_done += 1
+                self.bytes_done += self._current_bytes
+            self.current = name
+            self._current_bytes = nbytes
+
+    def finish(self):
+        """Count the last item started with next_item as done"""
+        self.next_item(None)
+
+    def post(self, result):
+        """Queue a finished item's result for the display to pick up when it next polls"""
+        with self._lock:
+            self._results.append(result)
+
+    def take_results(self, limit=None):
+        """Remove and return up to limit queued results (all of them by default), oldest first"""
+        with self._lock:
+            if limit is None or len(self._results) <= limit:
+                results, self._results = self._results, []
+            else:
+                results = self._results[:limit]
+                del self._results[:limit]
+        return results
+
+    def update(self, items=None, nbytes=None, current=None):
+        """Set the counts directly, for callbacks that report totals so far"""
+        with self._lock:
+            if items is not None:
+                self.items_done = items
+            if nbytes is not None:
+                self.bytes_done = nbytes
+            if current is not None:
+                self.current = current
+
+    def snapshot(self):
+        """Return a dict with fraction, bytes/items done and totals, current item, rate (bytes/s) and eta (seconds or None)"""
+        with self._lock:
+            items_done, bytes_done = self.items_done, self.bytes_done
+            total_items, total_bytes = self.total_items, self.total_bytes
+            current = self.current
+
+        now = time.monotonic()
+        elapsed = now - self._sample_time
+        if elapsed >= 0.5:
+            instant = (bytes_done - self._sample_bytes) / elapsed
+            # Smooth over a few samples so the figure doesn't flicker between files
+            self.rate = instant if self.rate == 0 else 0.7 * self.rate + 0.3 * instant
+            self._sample_time = now
+            self._sample_bytes = bytes_done
+
+        if total_bytes > 0:
+            fraction = bytes_done / total_bytes
+            eta = (total_bytes - bytes_done) / self.rate if self.rate > 0 else None
+        elif total_items > 0:
+            fraction = items_done / total_items
+            item_rate = items_done / (now - self.started) if now > self.started else 0
+            eta = (total_items - items_done) / item_rate if item_rate > 0 else None
+        else:
+            fraction, eta = 0.0, None
+
+        return {
+            'fraction': min(fraction, 1.0),
+            'bytes_done': bytes_done,
+            'total_bytes': total_bytes,
+            'items_done': items_done,
+            'total_items': total_items,
+            'current': current,
+            'rate': self.rate,
+            'eta': eta,
+        }
+
+
+class MemoryBudget:
+    """Cap on how much memory in-flight work may hold at once.
+
+    Work reserves an estimated footprint before it starts and releases it when it
+    is done; reserve() waits while the budget is used up. Files too big to compress
+    in memory are streamed from disk and reserve STREAM_FOOTPRINT instead (see
+    compress_files), so no reservation needs more than the limit. One that does
+    anyway is let through once nothing else holds a reservation, so it can't wait
+    forever. peak is the highest total reserved since the last reset_peak().
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def _fits(self, nbytes):
+        return self.in_use == 0 or self.in_use + nbytes <= self.limit
+
+    def _take(self, nbytes):
+        self.in_use += nbytes
+        self.peak = max(self.peak, self.in_use)
+
+    def try_reserve(self, nbytes):
+        """Reserve nbytes if they fit right now; returns whether they did"""
+        with self._condition:
+            if not self._fits(nbytes):
+                return False
+            self._take(nbytes)
+            return True
+
+    def reserve(self, nbytes, can_wait=None):
+        """Reserve nbytes, waiting for other work to release memory if necessary.
+
+        can_wait, if given, is asked before each wait whether anything the caller does
+        not hold itself is still to be released; once it is not, the bytes are taken
+        anyway rather than waiting on the caller's own reservations.
+        """
+        with self._condition:
+            while not self._fits(nbytes) and (can_wait is None or can_wait()):
+                self._condition.wait()
+            self._take(nbytes)
+
+    def release(self, nbytes):
+        with self._condition:
+            self.in_use -= nbytes
+            self._condition.notify_all()
+
+    @contextmanager
+    def hold(self, nbytes):
+        """Context manager that reserves nbytes for the duration of the block"""
+        self.reserve(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def reset_peak(self):
+        with self._condition:
+            self.peak = self.in_use
+
+
+def _default_memory_limit():
+    try:
+        return int(os.environ.get('KC_MEMORY_LIMIT_MB', '1024')) * 1024 * 1024
+    except ValueError:
+        return 1024 * 1024 * 1024
+
+# Shared by every operation in the process; change MEMORY_BUDGET.limit to configure
+MEMORY_BUDGET = MemoryBudget(_default_memory_limit())
+
+def compression_footprint(size):
+    """Estimated peak memory for compressing a whole file: the data plus its compressed copy"""
+    return 2 * size + 64 * 1024
+
+# Memory held while a file is compressed straight from disk: a read chunk, the zlib
+# state and its output
+STREAM_FOOTPRINT = 4 * 1024 * 1024
+
+def fits_in_memory(size, budget=None):
+    """Whether a file of size bytes can be compressed whole within the budget, or has to be streamed"""
+    return compression_footprint(size) <= (budget or MEMORY_BUDGET).limit
+
+class _NoPhase:
+    """Shared do-nothing context handed out while profiling is off"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_PHASE = _NoPhase()
+
+class _Phase:
+    __slots__ = ('profiler', 'name', 'detail', 'start', 'children')
+
+    def __init__(self, profiler, name, detail):
+        self.profiler = profiler
+        self.name = name
+        self.detail = detail
+
+    def __enter__(self):
+        self.children = 0
+        self.profiler._stack().append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        stack = self.profiler._stack()
+        stack.pop()
+        duration = end - self.start
+        if stack:
+            stack[-1].children += duration
+        self.profiler._record(self.name, self.detail, self.start, duration, duration - self.children)
+        return False
+
+class PhaseProfiler:
+    """Timing for pipeline phases (read, classify, compress, spool, table build, copy, UI commit).
+
+    Code wraps each stage in `with PROFILER.phase(name, item):`. While the profiler is
+    off, phase() returns one shared no-op context and count() returns at once, so
+    the instrumentation costs a method call. When on, every phase gets a count,
+    inclusive and self time (minus nested phases) and a histogram of durations in
+    power-of-two microsecond buckets; with tracing on, each phase is also kept as a
+    Chrome trace_event, viewable in chrome://tracing or Perfetto.
+
+    Turned on with KC_PROFILE=1 (summary to stderr at exit) or KC_TRACE=file.json,
+    or from code with start().
+    """
+    BUCKETS = 40
+    MAX_TRACE_EVENTS = 1_000_000
+
+    def __init__(self):
+        self.enabled = False
+        self.tracing = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._trace_path = None
+        self._report = False
+        self._finish_registered = False
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.phases = {}          # name -> [count, total ns, self ns, max ns, histogram]
+            self.counters = {}
+            self.events = []
+            self.dropped_events = 0
+            self.thread_names = {}
+            self.origin = time.perf_counter_ns()
+
+    def start(self, trace_path=None, report=False):
+        """Turn profiling on; the trace is written and the summary printed when the process exits"""
+        self.enabled = True
+        self.tracing = self.tracing or bool(trace_path)
+        self._trace_path = trace_path or self._trace_path
+        self._report = self._report or report
+        if not self._finish_registered:
+            import atexit
+            atexit.register(self.finish)
+            self._finish_registered = True
+
+    def stop(self):
+        self.enabled = False
+        self.tracing = False
+
+    def finish(self):
+        """Write the trace file and print the summary requested by start(), once"""
+        trace_path, report = self._trace_path, self._report
+        self._trace_path = None
+        self._report = False
+        if trace_path:
+            self.write_trace(trace_path)
+        if report and sys.stderr is not None:
+            print(self.report(), file=sys.stderr)
+
+    def phase(self, name, detail=None):
+        """Context manager timing one occurrence of a phase; detail names the item being worked on"""
+        if not self.enabled:
+            return _NO_PHASE
+        return _Phase(self, name, detail)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            stack = self._local.stack = []
+            return stack
+
+    def _record(self, name, detail, start, duration, self_time):
+        bucket = min((duration // 1000).bit_length(), self.BUCKETS - 1)
+        with self._lock:
+            stats = self.phases.get(name)
+            if stats is None:
+                stats = self.phases[name] = [0, 0, 0, 0, [0] * self.BUCKETS]
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] += self_time
+            stats[3] = max(stats[3], duration)
+            stats[4][bucket] += 1
+            if self.tracing:
+                if len(self.events) < self.MAX_TRACE_EVENTS:
+                    thread = threading.current_thread()
+                    self.thread_names.setdefault(thread.ident, thread.name)
+                    self.events.append((name, detail, start, duration, thread.ident))
+                else:
+                    self.dropped_events += 1
+
+    def _percentile(self, histogram, count, fraction):
+        """Upper bound in seconds of the bucket holding the given fraction of samples"""
+        wanted = max(1, int(count * fraction + 0.5))
+        seen = 0
+        for bucket, samples in enumerate(histogram):
+            seen += samples
+            if seen >= wanted:
+                return (1 << bucket) / 1e6
+        return (1 << (len(histogram) - 1)) / 1e6
+
+    def stats(self):
+        """Per-phase figures in seconds, and the counters"""
+        with self._lock:
+            phases = {name: (stats[0], stats[1], stats[2], stats[3], list(stats[4]))
+                      for name, stats in self.phases.items()}
+            counters = dict(self.counters)
+        result = {}
+        for name, (count, total, self_time, longest, histogram) in phases.items():
+            result[name] = {
+                'count': count,
+                'total': total / 1e9,
+                'self': self_time / 1e9,
+                'mean': total / count / 1e9,
+                'max': longest / 1e9,
+                'p50': self._percentile(histogram, count, 0.50),
+                'p90': self._percentile(histogram, count, 0.90),
+                'p99': self._percentile(histogram, count, 0.99),
+                'histogram': histogram,
+            }
+        return {'phases': result, 'counters': counters}
+
+    def report(self):
+        """Summary table of phases, largest self time first, followed by the counters"""
+        stats = self.stats()
+        lines = [f"{'phase':<17}{'count':>8}{'total':>11}{'self':>11}{'mean':>11}{'p50':>10}{'p90':>10}{'p99':>10}"]
+
+        def duration(seconds):
+            if seconds < 0.001:
+                return f"{seconds * 1e6:.0f}us"
+            return f"{seconds * 1000:.2f}ms" if seconds < 10 else f"{seconds:.2f}s"
+
+        for name, phase in sorted(stats['phases'].items(), key=lambda item: -item[1]['self']):
+            percentiles = ''.join(f"{'<' + duration(phase[key]):>10}" for key in ('p50', 'p90', 'p99'))
+            lines.append(f"{name:<17}{phase['count']:>8}{duration(phase['total']):>11}"
+                         f"{duration(phase['self']):>11}{duration(phase['mean']):>11}{percentiles}")
+        for name, value in sorted(stats['counters'].items()):
+            shown = format_file_size(value) if name.startswith('bytes') else f"{value:,}"
+            lines.append(f"{name:<17}{shown:>19}")
+        return '\n'.join(lines)
+
+    def write_trace(self, path):
+        """Write recorded phases as Chrome trace_event JSON"""
+        import json
+        with self._lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+            dropped = self.dropped_events
+            counters = dict(self.counters)
+            origin = self.origin
+        pid = os.getpid()
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}}
+                 for tid, thread_name in thread_names.items()]
+        for name, detail, start, duration, tid in events:
+            event = {'name': name, 'cat': 'kc', 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': (start - origin) / 1000, 'dur': duration / 1000}
+            if detail is not None:
+                event['args'] = {'item': str(detail)}
+            trace.append(event)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms',
+                       'otherData': {'counters': counters, 'dropped_events': dropped}}, f)
+
+def _profile_from_environment(profiler):
+    trace_path = os.environ.get('KC_TRACE')
+    report = os.environ.get('KC_PROFILE', '') not in ('', '0')
+    if trace_path or report:
+        profiler.start(trace_path, report)
+
+# Shared by the whole process; see PhaseProfiler for how to turn it on
+PROFILER = PhaseProfiler()
+_profile_from_environment(PROFILER)
+
+class OptimizedCompression:
+    """Optimized compression that uses less RAM and handles large files better"""
+    
+    # Reduced chunk sizes for better memory management
+    SMALL_CHUNK = 64 * 1024      # 64KB for compression chunks
+    LARGE_CHUNK = 1024 * 1024    # 1MB for file processing
+    STREAM_THRESHOLD = 10 * 1024 * 1024  # 10MB threshold for streaming
+    
+    @staticmethod
+    def compress_smart(data, progress_callback=None):
+        """Smart compression that adapts to data size and type"""
+        if len(data) < 100:
+            return b'\x00' + data
+        
+        # For very large data, use streaming compression
+        if len(data) > OptimizedCompression.STREAM_THRESHOLD:
+            return OptimizedCompression._compress_streaming(data, progress_callback)
+        
+        # For medium data, use chunked compression with limited techniques
+        if len(data) > OptimizedCompression.LARGE_CHUNK:
+            return OptimizedCompression._compress_chunked_smart(data, progress_callback)
+        
+        # For small data, use fast single-pass compression
+        return OptimizedCompression._compress_fast(data, progress_callback)
+    
+    @staticmethod
+    def compress_with_crc(data, progress_callback=None):
+        """Compress like compress_smart and also return the CRC32 of the original data"""
+        if len(data) > OptimizedCompression.STREAM_THRESHOLD:
+            return OptimizedCompression._compress_streaming(data, progress_callback, with_crc=True)
+        return OptimizedCompression.compress_smart(data, progress_callback), zlib.crc32(data)
+
+    @staticmethod
+    def _compress_streaming(data, progress_callback=None, with_crc=False):
+        """Stream large files through compression to avoid RAM overload"""
+        # Use zlib with streaming for large files
+        compressor = zlib.compressobj(level=6, wbits=15)
+        compressed_chunks = []
+        total_size = len(data)
+        processed = 0
+        crc = 0
+        
+        # Process in small chunks to keep memory usage low
+        chunk_size = OptimizedCompression.SMALL_CHUNK
+        
+        for i in range(0, len(data), chunk_size):
+            chunk = data[i:i+chunk_size]
+            if with_crc:
+                crc = zlib.crc32(chunk, crc)
+            compressed_chunk = compressor.compress(chunk)
+            if compressed_chunk:
+                compressed_chunks.append(compressed_chunk)
+            
+            processed += len(chunk)
+            
+            if progress_callback and i % (chunk_size * 10) == 0:  # Update every 10 chunks
+                progress = (processed / total_size) * 100
+                progress_callback(progress)
+        
+        # Finalize compression
+        final_chunk = compressor.flush()
+        if final_chunk:
+            compressed_chunks.append(final_chunk)
+        
+        if progress_callback:
+            progress_callback(100)
+        
+        if with_crc:
+            return b'\x01' + b''.join(compressed_chunks), crc
+        return b'\x01' + b''.join(compressed_chunks)
+    
+    @staticmethod
+    def _compress_chunked_smart(data, progress_callback=None):
+        """Efficient chunked compression for medium-sized files"""
+        # Use zlib with good compression but not maximum to save time
+        try:
+            if progress_callback:
+                progress_callback(25)
+            
+            compressed = zlib.compress(data, level=7)  # Reduced from 9 for speed
+            
+            if progress_callback:
+                progress_callback(100)
+            
+            return b'\x02' + compressed
+        except:
+            # Fallback to no compression if zlib fails
+            return b'\x00' + data
+    
+    @staticmethod
+    def _compress_fast(data, progress_callback=None):
+        """Fast compression for small files"""
+        try:
+            if progress_callback:
+                progress_callback(50)
+            
+            # Use fast zlib compression
+            compressed = zlib.compress(data, level=3)
+            
+            if progress_callback:
+                progress_callback(100)
+            
+            return b'\x03' + compressed
+        except:
+            return b'\x00' + data
+    
+    @staticmethod
+    def compress_executable(data, filters, progress_callback=None):
+        """Compress machine code as an xz stream with the given filter chain, or store it if that does not help"""
+        compressed = lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_NONE, filters=filters)
+        if progress_callback:
+            progress_callback(100)
+        if len(compressed) >= len(data):
+            return b'\x00' + data
+        return b'\x04' + compressed
+
+    @staticmethod
+    def decompress_smart(data, expected_crc=None):
+        """Smart decompression that handles all compression types.
+
+        Raises ValueError for corrupt data, or when the result does not match expected_crc.
+        """
+        if len(data) == 0:
+            return b''
+        
+        compression_type = data[0]
+        compressed_data = data[1:]
+        
+        if compression_type == 0:  # No compression
+            result = compressed_data
+        elif compression_type in [1, 2, 3]:  # zlib variants
+            try:
+                result = zlib.decompress(compressed_data)
+            except zlib.error as e:
+                raise ValueError(f"Corrupt compressed data: {e}")
+        elif compression_type == 4:  # xz, usually with a branch converter
+            try:
+                result = lzma.decompress(compressed_data, format=lzma.FORMAT_XZ)
+            except lzma.LZMAError as e:
+                raise ValueError(f"Corrupt compressed data: {e}")
+        elif compression_type == 5:  # sparse: runs of data around holes
+            size, extents, rest = _sparse_layout("Payload", iter((data,)))
+            content = OptimizedCompression.decompress_smart(b''.join(rest))
+            result = bytearray(size)
+            position = 0
+            for offset, length in extents:
+                result[offset:offset + length] = content[position:position + length]
+                position += length
+            if position != len(content) or len(result) != size:
+                raise ValueError("Sparse data does not match its layout")
+            result = bytes(result)
+        else:
+            raise ValueError(f"Unknown compression type {compression_type}")
+
+        if expected_crc is not None and zlib.crc32(result) != expected_crc:
+            raise ValueError("CRC32 mismatch - data is corrupt")
+        return result
+
+# Zero runs are cut out of a member in aligned blocks and kept as holes in a sparse
+# payload (type 5): a header, the (offset, length) of every run of data, then the
+# data runs alone as one stored or zlib payload.
+SPARSE_BLOCK = 64 * 1024
+SPARSE_MIN_ZEROS = 1024 * 1024      # fewer zero bytes than this are left to the codec
+SPARSE_HEADER = struct.Struct('<QI')    # full size, extent count
+SPARSE_EXTENT = struct.Struct('<QQ')    # offset, length
+ZERO_BLOCK = bytes(SPARSE_BLOCK)
+ZERO_CHUNK = bytes(1024 * 1024)
+
+class SparseContent:
+    """A file's content as its runs of data; everything between them is zero.
+
+    _read_file returns one for a file with holes on disk, so the holes are never
+    read. len() is the full size of the file.
+    """
+    __slots__ = ('size', 'extents')
+
+    def __init__(self, size, extents):
+        self.size = size
+        self.extents = extents      # [(offset, bytes)] in offset order
+
+    def __len__(self):
+        return self.size
+
+    def stored_size(self):
+        return sum(len(data) for _, data in self.extents)
+
+def _data_runs(data, base, runs):
+    """Append (offset, view) for each stretch of data between whole zero blocks"""
+    view = memoryview(data)
+    length = len(data)
+    start = None
+    for i in range(0, length, SPARSE_BLOCK):
+        end = min(i + SPARSE_BLOCK, length)
+        zero = data[i] == 0 and data[i:end] == (ZERO_BLOCK if end - i == SPARSE_BLOCK else bytes(end - i))
+        if zero and start is not None:
+            runs.append((base + start, view[start:i]))
+            start = None
+        elif not zero and start is None:
+            start = i
+    if start is not None:
+        runs.append((base + start, view[start:]))
+
+def sparse_extents(data):
+    """(offset, view) runs of data around the zero blocks, or None when there are too few zeros to bother"""
+    runs = []
+    if isinstance(data, SparseContent):
+        for offset, extent in data.extents:
+            _data_runs(extent, offset, runs)
+        return runs
+    if len(data) < SPARSE_MIN_ZEROS:
+        return None
+    _data_runs(data, 0, runs)
+    if len(data) - sum(len(view) for _, view in runs) < SPARSE_MIN_ZEROS:
+        return None
+    return runs
+
+_ZERO_OPERATORS = []    # CRC-32 register transforms for 2**i zero bytes
+
+def _gf2_times(matrix, vector):
+    total = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return total
+
+def crc32_zeros(crc, length):
+    """zlib.crc32(bytes(length), crc) in time logarithmic in length, for the holes of a sparse member"""
+    if length <= len(ZERO_CHUNK):
+        return zlib.crc32(memoryview(ZERO_CHUNK)[:length], crc)
+    if not _ZERO_OPERATORS:
+        # One zero bit shifts the register right and folds in the polynomial; square up to a byte
+        operator = [0xEDB88320] + [1 << i for i in range(31)]
+        for _ in range(3):
+            operator = [_gf2_times(operator, row) for row in operator]
+        for _ in range(64):
+            _ZERO_OPERATORS.append(operator)
+            operator = [_gf2_times(operator, row) for row in operator]
+    register = crc ^ 0xFFFFFFFF
+    bit = 0
+    while length:
+        if length & 1:
+            register = _gf2_times(_ZERO_OPERATORS[bit], register)
+        length >>= 1
+        bit += 1
+    return register ^ 0xFFFFFFFF
+
+def _sparse_crc32(size, runs):
+    crc = 0
+    position = 0
+    for offset, view in runs:
+        crc = zlib.crc32(view, crc32_zeros(crc, offset - position))
+        position = offset + len(view)
+    return crc32_zeros(crc, size - position)
+
+def compress_sparse(filename, size, runs, progress_callback=None):
+    """Sparse payload for a member of the given size holding only runs of (offset, data)"""
+    parts = [b'\x05', SPARSE_HEADER.pack(size, len(runs))]
+    parts.extend(SPARSE_EXTENT.pack(offset, len(view)) for offset, view in runs)
+    if should_compress(filename):
+        compressor = zlib.compressobj(level=6, wbits=15)
+        parts.append(b'\x01')
+        for _, view in runs:
+            parts.append(compressor.compress(view))
+        parts.append(compressor.flush())
+    else:
+        parts.append(b'\x00')
+        parts.extend(view for _, view in runs)
+    if progress_callback:
+        progress_callback(100)
+    return b''.join(parts)
+
+def compress_member(filename, data, progress_callback=None):
+    """Compress a file's data for storage, returning the payload and the CRC32 of the data.
+
+    data is bytes, or a SparseContent for a file read around its holes.
+    """
+    if PROFILER.enabled:
+        return _compress_member_profiled(filename, data, progress_callback)
+    runs = sparse_extents(data)
+    if runs is not None:
+        crc = _sparse_crc32(len(data), runs) if isinstance(data, SparseContent) else zlib.crc32(data)
+        return compress_sparse(filename, len(data), runs, progress_callback), crc
+    filters = executable_filters(data)
+    if filters:
+        return OptimizedCompression.compress_executable(data, filters, progress_callback), zlib.crc32(data)
+    if should_compress(filename):
+        return OptimizedCompression.compress_with_crc(data, progress_callback)
+    return b'\x00' + data, zlib.crc32(data)
+
+def _compress_member_profiled(filename, data, progress_callback=None):
+    """compress_member split into the classify and compress phases"""
+    with PROFILER.phase('classify', filename):
+        runs = sparse_extents(data)
+        filters = executable_filters(data) if runs is None else None
+        compress = should_compress(filename)
+    with PROFILER.phase('compress', filename):
+        if runs is not None:
+            crc = _sparse_crc32(len(data), runs) if isinstance(data, SparseContent) else zlib.crc32(data)
+            payload = compress_sparse(filename, len(data), runs, progress_callback)
+        elif filters:
+            payload, crc = OptimizedCompression.compress_executable(data, filters, progress_callback), zlib.crc32(data)
+        elif compress:
+            payload, crc = OptimizedCompression.compress_with_crc(data, progress_callback)
+        else:
+            payload, crc = b'\x00' + data, zlib.crc32(data)
+    PROFILER.count('bytes compressed', len(data))
+    return payload, crc
+
+def allocated_size(file_stat):
+    """Bytes a file really occupies on disk, which is less than st_size when it has holes"""
+    blocks = getattr(file_stat, 'st_blocks', None)
+    if blocks is None:
+        return file_stat.st_size
+    return min(file_stat.st_size, blocks * 512)
+
+def _data_regions(f, size):
+    """(start, end) of each data region of an open file with holes, found without reading it"""
+    fd = f.fileno()
+    regions = []
+    position = 0
+    while position < size:
+        try:
+            start = os.lseek(fd, position, os.SEEK_DATA)
+        except OSError:
+            break       # nothing but a hole is left
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        regions.append((start, end))
+        position = end
+    return regions
+
+def _read_extents(f, size):
+    """SparseContent of an open file with holes, reading only its data regions"""
+    extents = []
+    for start, end in _data_regions(f, size):
+        f.seek(start)
+        extents.append((start, f.read(end - start)))
+    return SparseContent(size, extents)
+
+def _read_file(filename, file_path):
+    """Read a whole source file, as the read phase; a file with holes is read around them"""
+    with PROFILER.phase('read', filename):
+        with open(file_path, 'rb') as f:
+            file_stat = os.fstat(f.fileno())
+            if hasattr(os, 'SEEK_DATA') and file_stat.st_size - allocated_size(file_stat) >= SPARSE_MIN_ZEROS:
+                data = _read_extents(f, file_stat.st_size)
+            else:
+                data = f.read()
+    PROFILER.count('bytes read', data.stored_size() if isinstance(data, SparseContent) else len(data))
+    return data
+
+def _compressed_chunks(filename, f, size, regions, totals):
+    """Yield the payload of size bytes read from f, compressing one chunk at a time.
+
+    regions lists the (start, end) data regions when the rest of the file is holes,
+    which are then stored as a sparse layout; None reads f front to back. Only zlib
+    or no compression is used, as with compress_member for anything but executables.
+    When the payload is complete totals['size'] and totals['crc32'] are set.
+    """
+    if regions is not None:
+        yield b'\x05' + SPARSE_HEADER.pack(size, len(regions)) + b''.join(
+            SPARSE_EXTENT.pack(start, end - start) for start, end in regions)
+    compressor = zlib.compressobj(level=6, wbits=15) if should_compress(filename) else None
+    yield b'\x01' if compressor else b'\x00'
+
+    crc = 0
+    position = 0
+    for start, end in regions if regions is not None else ((0, size),):
+        crc = crc32_zeros(crc, start - position)
+        if regions is not None:
+            f.seek(start)
+        position = start
+        while position < end:
+            chunk = f.read(min(OptimizedCompression.LARGE_CHUNK, end - position))
+            if not chunk:
+                raise ValueError(f"{filename} changed while it was being compressed")
+            crc = zlib.crc32(chunk, crc)
+            position += len(chunk)
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    if regions is None and f.read(1):
+        raise ValueError(f"{filename} changed while it was being compressed")
+    if compressor:
+        yield compressor.flush()
+    PROFILER.count('bytes compressed', size)
+    totals['size'] = size
+    totals['crc32'] = crc32_zeros(crc, size - position)
+
+def compress_file_chunks(filename, file_path, totals):
+    """Yield the payload of a file compressed straight from disk, for files too big to hold.
+
+    Memory use is one LARGE_CHUNK whatever the file size; holes in sparse files are
+    skipped without being read. totals gets the content size and CRC32 once the
+    last chunk is out (see _compressed_chunks).
+    """
+    with open(file_path, 'rb') as f:
+        file_stat = os.fstat(f.fileno())
+        regions = None
+        if hasattr(os, 'SEEK_DATA') and file_stat.st_size - allocated_size(file_stat) >= SPARSE_MIN_ZEROS:
+            regions = _data_regions(f, file_stat.st_size)
+        yield from _compressed_chunks(filename, f, file_stat.st_size, regions, totals)
+
+class SpooledPayload:
+    """A compressed payload kept in a temporary file instead of in memory.
+
+    compress_files hands these out in place of bytes for files whose whole-file
+    compression would not fit the memory budget. len() is the payload size. The
+    file is read back once with chunks(), which removes it when done, or moved
+    into place with save_as(); discard() removes it unread.
+    """
+    __slots__ = ('path', 'size')
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def chunks(self):
+        try:
+            with open(self.path, 'rb') as f:
+                while True:
+                    chunk = f.read(OptimizedCompression.LARGE_CHUNK)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            self.discard()
+
+    def save_as(self, path):
+        shutil.move(self.path, path)
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def spool_payload(chunks, spool_dir=None):
+    """Write payload chunks to a temporary file in spool_dir, returning a SpooledPayload"""
+    fd, path = tempfile.mkstemp(suffix='.kcspool', dir=spool_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+            size = f.tell()
+    except BaseException:
+        os.remove(path)
+        raise
+    return SpooledPayload(path, size)
+
+def payload_chunks(payload):
+    """The chunks of a payload from compress_files, which is bytes or a SpooledPayload"""
+    return payload.chunks() if isinstance(payload, SpooledPayload) else (payload,)
+
+ARCHIVE_SIGNATURE = b'KLONDIKE'
+ULTIMATE_MARKER = b'ULTIMATE'
+CRINKLE2_MARKER = b'CRINKLE2'
+
+# Version 2 archives keep the file table after the member data, so members can be
+# appended to an existing archive without moving anything that is already stored.
+# Header: signature, marker, file count, flags, table offset, table size
+V2_HEADER = struct.Struct('<8s8sIIQQ')
+# Entry: name len, type len, extra len, flags, size, compressed size, data offset, mtime (ns), crc32
+# Optional per-entry fields follow the type in the extra bytes, in flag bit order.
+V2_ENTRY = struct.Struct('<HHHHQQQqI')
+ENTRY_HAS_CRC = 0x0001
+ENTRY_IN_BASE = 0x0002      # extra: u16 index into the base archive list
+ENTRY_CONTINUED = 0x0004    # columnar tables only: the data has pieces in the continuation section
+# Header flag: the table starts with a u16 count and u16-length paths of base archives
+ARCHIVE_HAS_BASES = 0x0001
+BASE_REF = struct.Struct('<H')
+# Header flag: the entries are stored as columns rather than one V2_ENTRY after another.
+# After the base list comes a COLUMN_HEADER, the type strings (u16 length each), one
+# little-endian array per MemberTable.COLUMNS field and the NUL-terminated names. Then,
+# for each entry flagged ENTRY_CONTINUED in turn, a u16 piece count and a CONTINUATION
+# per piece of its data after the first, which sits at the entry's data offset.
+ARCHIVE_COLUMNS = 0x0004
+COLUMN_HEADER = struct.Struct('<HQQ')    # type count, size of the names, size of the continuations
+CONTINUATION = struct.Struct('<HQQ')     # source (as in the source column), offset, size
+
+# Streamed archives are written front to back without seeking, so they can go to a
+# pipe, tape or socket. Each payload is preceded by a local header (LOCAL_SIGNATURE
+# and the member's table entry) and the table is followed by a trailer laid out like
+# the header, with TRAILER_MARKER. The header is written before anything is known,
+# so it has ARCHIVE_STREAMED set and a zero count and table location; readers take
+# those from the trailer instead. A file too big to compress in memory is compressed
+# into the stream as it is written: its local header has ENTRY_HAS_DESCRIPTOR set and
+# no compressed size or CRC, and a DATA_DESCRIPTOR follows its payload.
+ARCHIVE_STREAMED = 0x0002
+TRAILER_MARKER = b'KCINDEX2'
+LOCAL_SIGNATURE = b'KCLH'
+ENTRY_HAS_DESCRIPTOR = 0x0008   # local headers only
+DATA_DESCRIPTOR = struct.Struct('<4sQQI')   # DESCRIPTOR_SIGNATURE, size, compressed size, crc32
+DESCRIPTOR_SIGNATURE = b'KCDD'
+
+class MemberRecord:
+    """Metadata for one archive member.
+
+    Used exactly like the dict it replaces (record['size'], record.get('crc32'),
+    record['temp_file'] = ...), but the fields live in __slots__ and the strings
+    that many members share (type, archive and base paths) are interned. That cuts
+    per-member overhead several times over on archives with millions of entries.
+    is_large is derived from size. continuation is set only for stored data that
+    spans volumes (see write_volumes): the (archive file, offset, size) of each piece
+    after the first, which is the rest of compressed_size at data_offset.
+    """
+    __slots__ = ('original_path', 'size', 'compressed_size', 'type', 'temp_file', 'data_offset',
+                 'archive_file', 'base_archive', 'mtime', 'crc32', 'continuation')
+    FIELDS = frozenset(__slots__ + ('is_large',))
+    _SETTABLE = frozenset(__slots__)
+    _INTERNED = frozenset(('type', 'archive_file', 'base_archive'))
+
+    def __init__(self, original_path='', size=0, compressed_size=0, type='file', temp_file=None,
+                 data_offset=None, archive_file=None, base_archive=None, mtime=None, crc32=None,
+                 continuation=None):
+        self.original_path = original_path
+        self.size = size
+        self.compressed_size = compressed_size
+        self.type = sys.intern(type)
+        self.temp_file = temp_file
+        self.data_offset = data_offset
+        self.archive_file = sys.intern(archive_file) if archive_file else archive_file
+        self.base_archive = sys.intern(base_archive) if base_archive else base_archive
+        self.mtime = mtime
+        self.crc32 = crc32
+        self.continuation = continuation
+
+    @property
+    def is_large(self):
+        return self.size > OptimizedCompression.LARGE_CHUNK
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._SETTABLE:
+            raise KeyError(key)
+        if key in self._INTERNED and isinstance(value, str):
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def keys(self):
+        return MemberRecord.__slots__ + ('is_large',)
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def copy(self):
+        return MemberRecord(**{key: getattr(self, key) for key in MemberRecord.__slots__})
+
+    def __repr__(self):
+        return f"MemberRecord({', '.join(f'{key}={getattr(self, key)!r}' for key in MemberRecord.__slots__)})"
+
+class _RowRecord(MemberRecord):
+    """MemberRecord handed out for a MemberTable row; the first record[key] = value makes it the member's record"""
+    __slots__ = ('_table', '_row')
+
+    def __setitem__(self, key, value):
+        MemberRecord.__setitem__(self, key, value)
+        table = self._table
+        if table is not None:
+            self._table = None
+            table._keep(self._row, self)
+
+class _MemberItems(ItemsView):
+    def __iter__(self):
+        return self._mapping._iter_items()
+
+class _MemberValues(ValuesView):
+    def __iter__(self):
+        return (record for _, record in self._mapping._iter_items())
+
+class MemberTable(MutableMapping):
+    """archive_metadata of an archive read from disk, with the members of its table kept in columns.
+
+    Behaves like the dict of MemberRecords it stands in for, in the same order. The
+    table's rows live in parallel arrays (sizes, offset, mtime, CRC and indexes into
+    shared type and archive path lists) with the names packed back to back as UTF-8,
+    so a row costs about 55 bytes plus its name instead of a dict entry, a record and
+    the objects it holds. The arrays are COLUMNS, which is also how a columnar file
+    table stores them, so reading one is a copy per column. Looking a row up builds
+    a MemberRecord for it; the first change made to that record through
+    record['temp_file'] = ... makes it the member's record, as does assigning one.
+    Members not in the table are kept as records and come after the rows. The index of names is built on the first lookup, so code
+    that only iterates never pays for it.
+    """
+    # Row columns (attribute, array typecode), in the order a columnar table stores them:
+    # size, compressed size, data offset, mtime (0: unknown), crc32, flags (ENTRY_HAS_CRC),
+    # index into the type list and source (0: this archive, n: base archive n - 1)
+    COLUMNS = (('_size', 'Q'), ('_compressed', 'Q'), ('_offset', 'Q'), ('_mtime', 'q'),
+               ('_crc', 'I'), ('_flags', 'B'), ('_type', 'H'), ('_source', 'H'))
+
+    def __init__(self, archive_file=None, bases=()):
+        self._names = bytearray()       # row names, UTF-8, each followed by a NUL
+        self._ends = array('Q')         # where each row's name ends (its NUL) in _names
+        for attribute, typecode in self.COLUMNS:
+            setattr(self, attribute, array(typecode))
+        self._types = []
+        self._type_ids = {}
+        # (archive_file, base_archive) per source: the archive itself, then each base
+        self._sources = [(sys.intern(archive_file) if archive_file else archive_file, None)]
+        self._sources += [(sys.intern(base), sys.intern(base)) for base in bases]
+        self._slots = None              # open-addressing index: name hash -> row + 1
+        self._shared = False            # columns shared with a copy; cloned before relocate_row writes
+        self._removed = set()           # rows deleted since loading
+        self._taken = {}                # row -> record standing in for it
+        self._added = {}                # name -> record of members that are not rows
+        self._continued = {}            # row -> continuation of rows whose data spans volumes
+
+    def append_row(self, name_bytes, size, compressed_size, data_offset, mtime, crc, file_type, source=0):
+        """Add a member read from the file table (only while loading, before any lookup)"""
+        type_id = self._type_ids.get(file_type)
+        if type_id is None:
+            type_id = self._type_ids[file_type] = len(self._types)
+            self._types.append(sys.intern(file_type))
+        if b'\0' in name_bytes:
+            raise ValueError("Archive file table is corrupt - a member name holds a NUL byte")
+        self._names += name_bytes
+        self._ends.append(len(self._names))
+        self._names.append(0)
+        self._size.append(size)
+        self._compressed.append(compressed_size)
+        self._offset.append(data_offset)
+        self._mtime.append(mtime or 0)
+        self._crc.append(crc or 0)
+        self._flags.append(ENTRY_HAS_CRC if crc is not None else 0)
+        self._type.append(type_id)
+        self._source.append(source)
+
+    def load_columns(self, names, columns, types, continued=None):
+        """Take every row at once from a columnar table.
+
+        names holds the NUL-terminated UTF-8 names, columns the arrays named in COLUMNS
+        and types the type list the type column indexes. continued maps the rows whose
+        data spans volumes to their (source, offset, size) pieces after the first.
+        Raises ValueError when they do not fit together or names repeat.
+        """
+        count = len(columns['_size'])
+        parts = names.split(b'\0')
+        if parts.pop() or len(parts) != count:
+            raise ValueError(f"Archive file table is corrupt - it lists {count} files but holds {len(parts)} names")
+        names.decode('utf-8')
+        distinct = len(set(parts))
+        if distinct != count:
+            raise ValueError(f"Archive file table is corrupt - it lists {count} files "
+                             f"but holds {distinct} distinct names")
+        if count and (max(columns['_type']) >= len(types) or max(columns['_source']) >= len(self._sources)):
+            raise ValueError("Archive file table is corrupt - an entry refers to a missing type or base archive")
+        # Each name's NUL sits one past the previous NUL plus the name's length
+        self._ends = array('Q', itertools.islice(itertools.accumulate(
+            map(operator.add, map(len, parts), itertools.repeat(1)), initial=-1), 1, None))
+        self._names = bytearray(names)
+        for attribute, _ in self.COLUMNS:
+            setattr(self, attribute, columns[attribute])
+        self._types = [sys.intern(file_type) for file_type in types]
+        self._type_ids = {file_type: type_id for type_id, file_type in enumerate(self._types)}
+        for row, pieces in (continued or {}).items():
+            if any(source >= len(self._sources) for source, _, _ in pieces):
+                raise ValueError("Archive file table is corrupt - an entry refers to a missing base archive")
+            if sum(size for _, _, size in pieces) > self._compressed[row]:
+                raise ValueError("Archive file table is corrupt - an entry's pieces are larger than it")
+            self._continued[row] = tuple((self._sources[source][0], offset, size) for source, offset, size in pieces)
+
+    def check_rows(self):
+        """Check that the row names are valid UTF-8 and return how many distinct ones there are"""
+        if not self._ends:
+            return 0
+        self._names.decode('utf-8')
+        return len(set(bytes(self._names[:-1]).split(b'\0')))
+
+    def relocate_row(self, row, archive_file, data_offset, compressed_size):
+        """Point an unchanged row at data stored in archive_file, without building a record for it"""
+        if self._shared:
+            self._offset = array('Q', self._offset)
+            self._compressed = array('Q', self._compressed)
+            self._source = array('H', self._source)
+            self._sources = list(self._sources)
+            self._shared = False
+        source = (sys.intern(archive_file), None)
+        try:
+            source_id = self._sources.index(source)
+        except ValueError:
+            source_id = len(self._sources)
+            self._sources.append(source)
+        self._offset[row] = data_offset
+        self._compressed[row] = compressed_size
+        self._source[row] = source_id
+        self._continued.pop(row, None)
+
+    def rebase(self, to_archive):
+        """Set every member's base_archive to its archive_file (to_archive true) or to None"""
+        self._sources = [(archive_file, archive_file if to_archive else None) for archive_file, _ in self._sources]
+        for record in list(self._taken.values()) + list(self._added.values()):
+            record['base_archive'] = record['archive_file'] if to_archive else None
+
+    def memory_size(self):
+        """Bytes held by the row columns and name index (not counting records handed out)"""
+        columns = [self._ends] + [getattr(self, attribute) for attribute, _ in self.COLUMNS]
+        if self._slots is not None:
+            columns.append(self._slots)
+        return len(self._names) + sum(column.itemsize * len(column) for column in columns)
+
+    # --- rows ------------------------------------------------------------
+
+    def _row_names(self):
+        names = self._names.decode('utf-8').split('\0')
+        names.pop()
+        return names
+
+    def _row_record(self, row):
+        archive_file, base_archive = self._sources[self._source[row]]
+        record = _RowRecord('', self._size[row], self._compressed[row], self._types[self._type[row]], None,
+                            self._offset[row], archive_file, base_archive, self._mtime[row] or None,
+                            self._crc[row] if self._flags[row] & ENTRY_HAS_CRC else None,
+                            self._continued.get(row) if self._continued else None)
+        record._row = row
+        record._table = self
+        return record
+
+    def _find(self, name):
+        """Row holding name, or -1"""
+        if self._slots is None:
+            self._build_index()
+        try:
+            key = name.encode('utf-8')
+        except (UnicodeEncodeError, AttributeError):
+            return -1
+        slots = self._slots
+        mask = len(slots) - 1
+        names = self._names
+        ends = self._ends
+        i = hash(name) & mask
+        while True:
+            row = slots[i] - 1
+            if row < 0:
+                return -1
+            if names[ends[row - 1] + 1 if row else 0:ends[row]] == key:
+                return row
+            i = (i + 1) & mask
+
+    def _build_index(self):
+        capacity = 8
+        while capacity < 2 * len(self._ends):
+            capacity *= 2
+        slots = array('I', [0]) * capacity
+        mask = capacity - 1
+        for row, name in enumerate(self._row_names()):
+            i = hash(name) & mask
+            while slots[i]:
+                i = (i + 1) & mask
+            slots[i] = row + 1
+        self._slots = slots
+
+    def _live_row(self, name):
+        row = self._find(name)
+        return -1 if row < 0 or row in self._removed else row
+
+    def _keep(self, row, record):
+        if row not in self._removed and row not in self._taken:
+            self._taken[row] = record
+
+    def _iter_items(self):
+        removed = self._removed
+        taken = self._taken
+        for row, name in enumerate(self._row_names()):
+            if removed and row in removed:
+                continue
+            record = taken.get(row) if taken else None
+            yield name, record if record is not None else self._row_record(row)
+        yield from self._added.items()
+
+    def fields(self):
+        """Every member's name and its size, mtime, crc32, type and source as lists, in order.
+
+        For build_v2_table, so a save does not build a record per row. source is the
+        row's index into _sources; members that are records rather than plain rows,
+        and rows whose data spans volumes, are also returned as {position: record}
+        (with source 0).
+        """
+        names = self._row_names()
+        fields = {
+            'size': self._size.tolist(),
+            'mtime': self._mtime.tolist(),
+            'crc32': [crc if flags & ENTRY_HAS_CRC else None for crc, flags in zip(self._crc, self._flags)],
+            'type': list(map(self._types.__getitem__, self._type)),
+            'source': self._source.tolist(),
+        }
+        records = dict(self._taken)
+        for row in self._continued:
+            if row not in records and row not in self._removed:
+                records[row] = self._row_record(row)
+        if self._removed:
+            keep = [row not in self._removed for row in range(len(names))]
+            positions = list(itertools.accumulate(keep))
+            records = {positions[row] - 1: record for row, record in records.items()}
+            names = list(itertools.compress(names, keep))
+            fields = {key: list(itertools.compress(values, keep)) for key, values in fields.items()}
+        for name, record in self._added.items():
+            records[len(names)] = record
+            names.append(name)
+            for values in fields.values():
+                values.append(None)
+        for position, record in records.items():
+            fields['size'][position] = record.size
+            fields['mtime'][position] = record.mtime
+            fields['crc32'][position] = record.crc32
+            fields['type'][position] = record.type
+            fields['source'][position] = 0
+        return names, fields, records
+
+    def sizes(self):
+        """(name, size, compressed size) of every member, without building records for rows"""
+        removed = self._removed
+        taken = self._taken
+        for row, (name, size, compressed_size) in enumerate(zip(self._row_names(), self._size, self._compressed)):
+            if removed and row in removed:
+                continue
+            record = taken.get(row) if taken else None
+            if record is not None:
+                yield name, record.size, record.compressed_size
+            else:
+                yield name, size, compressed_size
+        for name, record in self._added.items():
+            yield name, record.size, record.compressed_size
+
+    # --- mapping ---------------------------------------------------------
+
+    def __len__(self):
+        return len(self._ends) - len(self._removed) + len(self._added)
+
+    def __iter__(self):
+        removed = self._removed
+        for row, name in enumerate(self._row_names()):
+            if not (removed and row in removed):
+                yield name
+        yield from self._added
+
+    def __contains__(self, name):
+        return name in self._added or self._live_row(name) >= 0
+
+    def __getitem__(self, name):
+        record = self._added.get(name)
+        if record is None:
+            row = self._live_row(name)
+            if row < 0:
+                raise KeyError(name)
+            record = self._taken.get(row)
+            if record is None:
+                record = self._row_record(row)
+        return record
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __setitem__(self, name, record):
+        row = -1 if name in self._added else self._live_row(name)
+        if row >= 0:
+            self._taken[row] = record
+        else:
+            self._added[name] = record
+
+    def __delitem__(self, name):
+        if name in self._added:
+            del self._added[name]
+            return
+        row = self._live_row(name)
+        if row < 0:
+            raise KeyError(name)
+        self._removed.add(row)
+        self._taken.pop(row, None)
+
+    def items(self):
+        return _MemberItems(self)
+
+    def values(self):
+        return _MemberValues(self)
+
+    def copy(self):
+        """Shallow copy, like dict.copy(): the columns are shared, records are not copied"""
+        table = MemberTable.__new__(MemberTable)
+        table.__dict__.update(self.__dict__)
+        self._shared = table._shared = True
+        table._removed = set(self._removed)
+        table._taken = dict(self._taken)
+        table._added = dict(self._added)
+        table._continued = dict(self._continued)
+        return table
+
+    def __repr__(self):
+        return f"<MemberTable of {len(self)} members>"
+
+def set_base_archives(archive_metadata, to_archive):
+    """Make every member read from its base archive (to_archive true) or from its own data (false)"""
+    if isinstance(archive_metadata, MemberTable):
+        archive_metadata.rebase(to_archive)
+        return
+    for metadata in archive_metadata.values():
+        metadata['base_archive'] = metadata['archive_file'] if to_archive else None
+
+def _same_record(metadata, other):
+    """Whether two records stand for the same member state (rows of a table copy are looked up afresh)"""
+    if metadata is other:
+        return True
+    return (type(metadata) is _RowRecord and type(other) is _RowRecord
+            and metadata._table is not None and other._table is not None
+            and metadata._row == other._row and metadata._table._offset is other._table._offset)
+
+def adopt_saved_locations(archive_metadata, saved_metadata, archive_file, locations):
+    """Point members just saved at their data in archive_file and delete their temp files.
+
+    saved_metadata is the copy of archive_metadata that was written; members replaced
+    in archive_metadata while the save was running are left alone.
+    """
+    archive_file = str(archive_file)
+    for filename, (data_offset, compressed_size) in locations.items():
+        metadata = archive_metadata.get(filename)
+        if metadata is None or not _same_record(metadata, saved_metadata.get(filename)):
+            continue
+        if _member_reference(metadata, archive_file):
+            # Saved as a reference - the data stays where it is in the base archive
+            continue
+        if type(metadata) is _RowRecord and metadata._table is archive_metadata:
+            archive_metadata.relocate_row(metadata._row, archive_file, data_offset, compressed_size)
+            continue
+        if metadata.get('temp_file'):
+            try:
+                Path(metadata['temp_file']).unlink()
+            except OSError:
+                pass
+        metadata['temp_file'] = None
+        metadata['data_offset'] = data_offset
+        metadata['compressed_size'] = compressed_size
+        metadata['archive_file'] = archive_file
+        metadata['continuation'] = None
+
+def member_sizes(archive_metadata):
+    """(name, size, compressed size) of every member of an archive_metadata dict or MemberTable"""
+    if isinstance(archive_metadata, MemberTable):
+        return archive_metadata.sizes()
+    return ((name, metadata['size'], metadata['compressed_size']) for name, metadata in archive_metadata.items())
+
+def archive_format_version(file_path):
+    """Return the container version of an archive file (0, 1 or 2), or None if it is not one"""
+    try:
+        with open(file_path, 'rb') as f:
+            header = f.read(16)
+    except OSError:
+        return None
+    if header[:8] != ARCHIVE_SIGNATURE:
+        return None
+    if header[8:16] == CRINKLE2_MARKER:
+        return 2
+    if header[8:16] == ULTIMATE_MARKER:
+        return 1
+    return 0
+
+def _read_trailer(f):
+    """Count, flags and table location from the trailer at the end of a streamed archive"""
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    if end >= 2 * V2_HEADER.size:
+        f.seek(end - V2_HEADER.size)
+        signature, marker, num_files, archive_flags, table_offset, table_size = V2_HEADER.unpack(
+            f.read(V2_HEADER.size))
+        if signature == ARCHIVE_SIGNATURE and marker == TRAILER_MARKER:
+            return num_files, archive_flags, table_offset, table_size
+    raise ValueError("Streamed archive is incomplete - its index is missing")
+
+def read_archive_table(file_path, progress_callback=None):
+    """Read the file table of an archive into metadata entries pointing at the stored data"""
+    archive_metadata = {}
+
+    with open(file_path, 'rb') as f:
+        signature = f.read(8)
+        if signature != ARCHIVE_SIGNATURE:
+            raise ValueError("Not a valid Klondike archive")
+
+        marker = f.read(8)
+        if marker == CRINKLE2_MARKER:
+            f.seek(0)
+            _, _, num_files, archive_flags, table_offset, table_size = V2_HEADER.unpack(f.read(V2_HEADER.size))
+            if archive_flags & ARCHIVE_STREAMED and not table_offset:
+                num_files, archive_flags, table_offset, table_size = _read_trailer(f)
+            f.seek(table_offset)
+            table_data = f.read(table_size)
+            if len(table_data) != table_size:
+                raise ValueError("Archive is truncated - its file table is incomplete")
+
+            pos = 0
+            bases = []
+            if archive_flags & ARCHIVE_HAS_BASES:
+                # Base paths are stored relative to this archive where possible
+                archive_dir = os.path.dirname(os.path.abspath(file_path))
+                base_count = BASE_REF.unpack_from(table_data, pos)[0]
+                pos += BASE_REF.size
+                for _ in range(base_count):
+                    path_len = BASE_REF.unpack_from(table_data, pos)[0]
+                    pos += BASE_REF.size
+                    base_path = os.path.normpath(os.path.join(
+                        archive_dir, table_data[pos:pos + path_len].decode('utf-8')))
+                    pos += path_len
+                    if not os.path.exists(base_path):
+                        raise FileNotFoundError(f"Base archive not found: {base_path}")
+                    bases.append(base_path)
+
+            archive_metadata = MemberTable(str(file_path), bases)
+            with PROFILER.phase('table read', file_path):
+                if archive_flags & ARCHIVE_COLUMNS:
+                    _parse_v2_columns(table_data, pos, num_files, archive_metadata)
+                else:
+                    _parse_v2_entries(table_data, pos, num_files, archive_metadata, progress_callback)
+            return archive_metadata, 2
+
+        is_ultimate = marker == ULTIMATE_MARKER
+        if not is_ultimate:
+            f.seek(8)
+
+        num_files = struct.unpack('<I', f.read(4))[0]
+        table_size = struct.unpack('<I', f.read(4))[0]
+        table_data = f.read(table_size)
+        data_start = f.tell()
+        table_offset = 0
+
+        for i in range(num_files):
+            if progress_callback:
+                progress_callback(i, num_files)
+
+            # Parse table entry with bounds checking
+            if table_offset + 2 > len(table_data):
+                break
+            filename_len = struct.unpack('<H', table_data[table_offset:table_offset+2])[0]
+            table_offset += 2
+
+            if table_offset + filename_len > len(table_data):
+                break
+            filename = table_data[table_offset:table_offset+filename_len].decode('utf-8')
+            table_offset += filename_len
+
+            if table_offset + 12 > len(table_data):
+                break
+            original_size, compressed_size, data_offset = struct.unpack('<III', table_data[table_offset:table_offset+12])
+            table_offset += 12
+
+            file_type = Path(filename).suffix or 'file'
+            if is_ultimate and table_offset + 2 <= len(table_data):
+                type_len = struct.unpack('<H', table_data[table_offset:table_offset+2])[0]
+                table_offset += 2
+                if table_offset + type_len <= len(table_data):
+                    file_type = table_data[table_offset:table_offset+type_len].decode('utf-8')
+                    table_offset += type_len
+
+            archive_metadata[filename] = MemberRecord(
+                size=original_size,
+                compressed_size=compressed_size,
+                type=file_type,
+                data_offset=data_start + data_offset,
+                archive_file=str(file_path)
+            )
+
+    if len(archive_metadata) != num_files:
+        raise ValueError(f"Archive file table is corrupt - it lists {num_files} files "
+                         f"but only {len(archive_metadata)} could be read")
+    return archive_metadata, 1 if is_ultimate else 0
+
+def new_member_metadata(file_path, original_size, compressed_size, temp_file=None, mtime=None, crc32=None):
+    """Build the metadata entry for a file added from disk"""
+    return MemberRecord(
+        original_path=str(file_path),
+        size=original_size,
+        compressed_size=compressed_size,
+        type=Path(file_path).suffix or 'file',
+        temp_file=str(temp_file) if temp_file else None,
+        mtime=mtime,
+        crc32=crc32
+    )
+
+def _stored_pieces(metadata):
+    """(archive file, offset, size) of each piece of a member's data stored in archives, in order.
+
+    One piece unless the data spans volumes; None when the member is not stored in an
+    archive (it is spooled to a temp file or not compressed yet).
+    """
+    temp_file = metadata.get('temp_file')
+    if metadata['is_large'] and temp_file and os.path.exists(temp_file):
+        return None
+    if metadata.get('data_offset') is None or not metadata.get('archive_file'):
+        return None
+    continuation = metadata.get('continuation') or ()
+    first = metadata['compressed_size'] - sum(size for _, _, size in continuation)
+    return [(metadata['archive_file'], metadata['data_offset'], first), *continuation]
+
+def _iter_range_chunks(filename, pieces, start=0, length=None, step=OptimizedCompression.SMALL_CHUNK):
+    """Yield length bytes (all by default) from start on of the data held in the given pieces"""
+    if length is None:
+        length = sum(size for _, _, size in pieces) - start
+    for path, offset, size in pieces:
+        if start >= size:
+            start -= size
+            continue
+        if length <= 0:
+            break
+        with open(path, 'rb') as f:
+            f.seek(offset + start)
+            remaining = min(size - start, length)
+            length -= remaining
+            start = 0
+            while remaining > 0:
+                chunk = f.read(min(step, remaining))
+                if not chunk:
+                    raise ValueError(f"Archive data for {filename} is truncated")
+                yield chunk
+                remaining -= len(chunk)
+    if length > 0:
+        raise ValueError(f"Archive data for {filename} is truncated")
+
+def iter_member_payload(filename, metadata):
+    """Yield the stored (compressed) bytes of an archive member in chunks"""
+    if metadata['is_large'] and metadata.get('temp_file') and Path(metadata['temp_file']).exists():
+        # Compressed data spooled to the temp directory
+        with open(metadata['temp_file'], 'rb') as f:
+            while True:
+                chunk = f.read(OptimizedCompression.SMALL_CHUNK)
+                if not chunk:
+                    break
+                yield chunk
+        return
+
+    pieces = _stored_pieces(metadata)
+    if pieces:
+        # Copy straight out of the archive (or volumes) the member was opened from
+        yield from _iter_range_chunks(filename, pieces)
+        return
+
+    # Not spooled anywhere - compress again from the original file
+    if not metadata.get('original_path') or not Path(metadata['original_path']).exists():
+        raise FileNotFoundError(f"Source for {filename} is no longer available")
+    size = allocated_size(os.stat(metadata['original_path']))
+    if fits_in_memory(size):
+        with MEMORY_BUDGET.hold(compression_footprint(size)):
+            data = _read_file(filename, metadata['original_path'])
+            payload, crc = compress_member(filename, data)
+            size = len(data)
+            del data
+    else:
+        # Too big to hold: compress as it is written out, a chunk at a time
+        totals = {}
+        with MEMORY_BUDGET.hold(min(STREAM_FOOTPRINT, MEMORY_BUDGET.limit)):
+            yield from compress_file_chunks(filename, metadata['original_path'], totals)
+        payload = None
+        size, crc = totals['size'], totals['crc32']
+    if metadata.get('crc32') is None:
+        # First time this file is compressed - record what was stored
+        metadata['crc32'] = crc
+        metadata['size'] = size
+    elif metadata['crc32'] != crc:
+        raise ValueError(f"{filename} changed on disk after it was added")
+    if payload is not None:
+        yield payload
+
+def _decode_payload(filename, chunks, step=OptimizedCompression.LARGE_CHUNK):
+    """Yield the decompressed content of a stored payload (types 0-4) given as chunks.
+
+    Compressed data is inflated at most step bytes at a time and each piece is yielded
+    before the next is made, so highly compressible data cannot balloon in memory and
+    a consumer that stops early stops the decompression too.
+    """
+    decompressor = None
+    compression_type = None
+
+    def inflate(data):
+        try:
+            return decompressor.decompress(data, step)
+        except (zlib.error, lzma.LZMAError, EOFError) as e:
+            raise ValueError(f"{filename}: corrupt compressed data: {e}")
+
+    for chunk in chunks:
+        if compression_type is None:
+            if not chunk:
+                continue
+            compression_type = chunk[0]
+            chunk = chunk[1:]
+            if compression_type in (1, 2, 3):
+                decompressor = zlib.decompressobj()
+            elif compression_type == 4:
+                decompressor = lzma.LZMADecompressor(lzma.FORMAT_XZ)
+            elif compression_type != 0:
+                raise ValueError(f"{filename}: unknown compression type {compression_type}")
+
+        if decompressor is None:
+            if chunk:
+                yield chunk
+            continue
+
+        data = inflate(chunk)
+        while True:
+            if data:
+                yield data
+            if compression_type == 4:
+                # lzma keeps unread input itself and asks for more when it is done
+                if decompressor.eof or decompressor.needs_input:
+                    break
+                data = inflate(b'')
+            else:
+                if not decompressor.unconsumed_tail:
+                    break
+                data = inflate(decompressor.unconsumed_tail)
+
+    if decompressor is not None:
+        try:
+            data = decompressor.flush() if compression_type != 4 else b''
+        except zlib.error as e:
+            raise ValueError(f"{filename}: corrupt compressed data: {e}")
+        if data:
+            yield data
+        if not decompressor.eof:
+            raise ValueError(f"{filename}: compressed data is truncated")
+
+def _sparse_layout(filename, chunks):
+    """Read a sparse payload's header from chunks; returns (size, extents, the remaining chunks)"""
+    buffer = b''
+    needed = 1 + SPARSE_HEADER.size
+    size = extents = None
+    for chunk in chunks:
+        buffer += chunk
+        if size is None and len(buffer) >= needed:
+            size, count = SPARSE_HEADER.unpack_from(buffer, 1)
+            needed += count * SPARSE_EXTENT.size
+        if size is not None and len(buffer) >= needed:
+            extents = list(SPARSE_EXTENT.iter_unpack(buffer[1 + SPARSE_HEADER.size:needed]))
+            break
+    if extents is None:
+        raise ValueError(f"{filename}: sparse layout is truncated")
+    return size, extents, itertools.chain((buffer[needed:],), chunks)
+
+def iter_member_extents(filename, metadata, payload=None, step=OptimizedCompression.LARGE_CHUNK):
+    """Yield (offset, data) for the content of a member, leaving out the holes of a sparse one.
+
+    Offsets only increase and everything not yielded is zero. The stored size and
+    CRC32 (when present) are checked once the member has been read completely; a
+    mismatch or corrupt stream raises ValueError. Holes cost nothing to check.
+    payload is the stored bytes when the caller already has them; step caps how much
+    is decompressed at a time.
+    """
+    chunks = iter_member_payload(filename, metadata) if payload is None else iter((payload,))
+    first = next(chunks, b'')
+    chunks = itertools.chain((first,), chunks)
+    crc = 0
+    position = 0
+
+    if first[:1] == b'\x05':
+        size, extents, chunks = _sparse_layout(filename, chunks)
+        if size != metadata['size']:
+            raise ValueError(f"{filename}: expected {metadata['size']} bytes, got {size}")
+        extents = iter(extents)
+        offset, remaining = 0, 0
+        for data in _decode_payload(filename, chunks, step):
+            while data:
+                if not remaining:
+                    offset, remaining = next(extents, (None, 0))
+                    if offset is None or offset < position or offset + remaining > size:
+                        raise ValueError(f"{filename}: sparse data does not match its layout")
+                    crc = crc32_zeros(crc, offset - position)
+                piece = data[:remaining]
+                data = data[len(piece):]
+                crc = zlib.crc32(piece, crc)
+                yield offset, piece
+                offset += len(piece)
+                remaining -= len(piece)
+                position = offset
+        if remaining or next(extents, None) is not None:
+            raise ValueError(f"{filename}: compressed data is truncated")
+        crc = crc32_zeros(crc, size - position)
+        position = size
+    else:
+        for data in _decode_payload(filename, chunks, step):
+            crc = zlib.crc32(data, crc)
+            yield position, data
+            position += len(data)
+
+    if position != metadata['size']:
+        raise ValueError(f"{filename}: expected {metadata['size']} bytes, got {position}")
+    if metadata.get('crc32') is not None and crc != metadata['crc32']:
+        raise ValueError(f"{filename}: CRC32 mismatch - data is corrupt")
+
+PEEK_SIZE = 64 * 1024
+
+def peek_member(filename, metadata, length=PEEK_SIZE):
+    """The first length bytes of a member's content, decompressing little more than that.
+
+    Decompression is asked for at most length bytes at a time and stops once they are
+    out, so the start of a huge member comes back at once and only a chunk of it is
+    ever held. The CRC32 is not checked, since the rest is never read.
+    """
+    length = min(length, metadata['size'])
+    temp_file = metadata.get('temp_file')
+    if (_stored_pieces(metadata) is None and
+            not (metadata['is_large'] and temp_file and os.path.exists(temp_file))):
+        # Not compressed anywhere yet - the file on disk is the content
+        original_path = metadata.get('original_path')
+        if not original_path or not os.path.exists(original_path):
+            raise FileNotFoundError(f"Source for {filename} is no longer available")
+        with open(original_path, 'rb') as f:
+            return f.read(length)
+
+    content = bytearray()
+    extents = iter_member_extents(filename, metadata, step=max(1, min(length, OptimizedCompression.LARGE_CHUNK)))
+    try:
+        for offset, data in extents:
+            if offset >= length:
+                break
+            content += bytes(offset - len(content))
+            content += data[:length - offset]
+            if len(content) >= length:
+                break
+    finally:
+        extents.close()
+    # Anything short of length is a hole
+    content += bytes(length - len(content))
+    return bytes(content)
+
+def looks_like_text(data):
+    """Whether a member's first bytes read as UTF-8 text (a character cut off at the end is allowed)"""
+    if b'\0' in data:
+        return False
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        return e.reason == 'unexpected end of data'
+    return True
+
+def hex_dump(data, offset=0, width=16):
+    """Classic hex dump lines: offset, hex bytes and the printable ASCII"""
+    lines = []
+    for i in range(0, len(data), width):
+        row = data[i:i + width]
+        ascii_text = ''.join(chr(b) if 32 <= b < 127 else '.' for b in row)
+        lines.append(f"{offset + i:08x}  {row.hex(' '):<{width * 3 - 1}}  |{ascii_text}|")
+    return '\n'.join(lines)
+
+def iter_member_data(filename, metadata):
+    """Yield the decompressed content of a member in bounded chunks, holes filled with zeros.
+
+    Checked like iter_member_extents().
+    """
+    position = 0
+    for offset, data in iter_member_extents(filename, metadata):
+        if offset > position:
+            yield from _zeros(offset - position)
+        yield data
+        position = offset + len(data)
+    if metadata['size'] > position:
+        yield from _zeros(metadata['size'] - position)
+
+def _zeros(length):
+    while length > 0:
+        step = min(length, len(ZERO_CHUNK))
+        yield ZERO_CHUNK if step == len(ZERO_CHUNK) else bytes(step)
+        length -= step
+
+def verify_member(filename, metadata):
+    """Decompress a member without keeping it and check its size and CRC32; returns its size"""
+    for _ in iter_member_extents(filename, metadata):
+        pass
+    return metadata['size']
+
+def _reading_order(items):
+    """(name, metadata) items in offset order within each archive file, alternating between files"""
+    by_file = {}
+    for item in items:
+        by_file.setdefault(item[1].get('archive_file') or '', []).append(item)
+    runs = [sorted(run, key=lambda item: item[1].get('data_offset') or 0)
+            for _, run in sorted(by_file.items())]
+    if len(runs) == 1:
+        return runs[0]
+    return [item for batch in itertools.zip_longest(*runs) for item in batch if item is not None]
+
+def verify_archive(archive_metadata, max_workers=None, progress_callback=None):
+    """Check every member of an archive on a thread pool.
+
+    Members are handed out in archive offset order so reads stay close to sequential,
+    taking turns between volumes so every disk of a multi-volume archive is read at
+    once, with a bounded number in flight. zlib and crc32 release the GIL, so the pool
+    uses all cores. Returns a summary with the failures and the throughput.
+    """
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+    max_workers = max_workers or os.cpu_count() or 1
+    order = _reading_order(archive_metadata.items())
+    result = {
+        'members': len(order),
+        'verified': 0,
+        'unchecked': sum(1 for _, metadata in order if metadata.get('crc32') is None),
+        'failures': [],
+        'bytes': 0,
+        'seconds': 0.0,
+        'throughput': 0.0
+    }
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {}
+        members = iter(order)
+        done_count = 0
+
+        while True:
+            while len(pending) < max_workers * 4:
+                item = next(members, None)
+                if item is None:
+                    break
+                pending[pool.submit(verify_member, *item)] = item[0]
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                filename = pending.pop(future)
+                try:
+                    result['bytes'] += future.result()
+                    result['verified'] += 1
+                except Exception as e:
+                    result['failures'].append((filename, str(e)))
+                done_count += 1
+            if progress_callback:
+                progress_callback(done_count, len(order), result['bytes'])
+
+    result['seconds'] = time.perf_counter() - start
+    if result['seconds'] > 0:
+        result['throughput'] = result['bytes'] / result['seconds']
+    return result
+
+GREP_MAX_LINE = 1024 * 1024     # longer runs without a newline are searched in pieces this size
+GREP_SHOWN = 1024               # most bytes of a matching line returned around the match
+
+def _grep_block(block, base, search, hits, max_hits):
+    """Add (offset, line) for each line of block (complete lines, starting at offset base) that matches"""
+    position = 0
+    length = len(block)
+    while position < length and (not max_hits or len(hits) < max_hits):
+        match = search(block, position)
+        if not match:
+            break
+        start = block.rfind(b'\n', 0, match.start()) + 1
+        end = block.find(b'\n', match.start())
+        if end < 0:
+            end = length
+        shown_start = max(start, match.start() - GREP_SHOWN // 4)
+        line = block[shown_start:min(end, shown_start + GREP_SHOWN)]
+        hits.append((base + match.start(), line.decode('utf-8', 'replace').rstrip('\r')))
+        position = max(end + 1, match.end())
+
+def grep_member(filename, metadata, regex, max_hits=None):
+    """Search a member's content line by line for a compiled bytes regex; returns [(offset, line)].
+
+    Content is decompressed in bounded chunks and a line split between chunks is
+    searched once it is complete, so matches are found across chunk boundaries.
+    offset is where the match starts in the member. The holes of a sparse member
+    are not searched. Stops after max_hits matching lines when given.
+    """
+    hits = []
+    search = regex.search
+    carry = b''
+    carry_offset = 0
+    for offset, data in iter_member_extents(filename, metadata):
+        if offset != carry_offset + len(carry):
+            # A hole ends the line before it
+            _grep_block(carry, carry_offset, search, hits, max_hits)
+            carry = b''
+            carry_offset = offset
+        buffer = carry + data if carry else data
+        end = buffer.rfind(b'\n') + 1
+        if not end and len(buffer) >= GREP_MAX_LINE:
+            end = len(buffer)
+        if end:
+            _grep_block(buffer[:end] if end < len(buffer) else buffer, carry_offset, search, hits, max_hits)
+            carry = buffer[end:]
+            carry_offset += end
+        else:
+            carry = buffer
+        if max_hits and len(hits) >= max_hits:
+            return hits
+    _grep_block(carry, carry_offset, search, hits, max_hits)
+    return hits
+
+def grep_archive(archive_metadata, pattern, name_glob=None, fixed=False, ignore_case=False, max_hits=None,
+                 max_workers=None, on_error=None):
+    """Search the content of archive members without extracting them.
+
+    Yields (member, offset, line) for every matching line; pattern is a regular
+    expression (or a literal string with fixed) matched against the content's bytes
+    as UTF-8, with ^ and $ anchoring at line ends as in grep. name_glob limits the search to matching member names.
+    Members are decompressed on a thread pool in the order verify_archive() reads
+    them, with a bounded number in flight, and their hits come out in that order.
+    Nothing is written to disk. A member that cannot be read is passed to
+    on_error(name, error) when given; otherwise its ValueError is raised.
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    if isinstance(pattern, str):
+        pattern = pattern.encode('utf-8')
+    try:
+        regex = re.compile(re.escape(pattern) if fixed else pattern, re.MULTILINE | (re.IGNORECASE if ignore_case else 0))
+    except re.error as e:
+        raise ValueError(f"Bad search pattern: {e}")
+    max_workers = max_workers or os.cpu_count() or 1
+    members = iter(_reading_order((filename, metadata) for filename, metadata in archive_metadata.items()
+                                  if name_glob is None or fnmatch.fnmatchcase(filename, name_glob)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = deque()
+        try:
+            while True:
+                while len(in_flight) < max_workers * 4:
+                    item = next(members, None)
+                    if item is None:
+                        break
+                    in_flight.append((item[0], pool.submit(grep_member, *item, regex, max_hits)))
+                if not in_flight:
+                    break
+                filename, future = in_flight.popleft()
+                try:
+                    hits = future.result()
+                except (OSError, ValueError) as e:
+                    if on_error is None:
+                        raise
+                    on_error(filename, e)
+                    continue
+                for offset, line in hits:
+                    yield filename, offset, line
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+TABLE_PROGRESS_STEP = 4096     # table entries between progress callbacks
+
+@contextmanager
+def _gc_paused():
+    """Hold off cyclic garbage collection while building many objects that are all kept.
+
+    Every few hundred allocations the collector would otherwise rescan the growing
+    table, which costs more than decoding it on archives with millions of members.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+def _parse_v2_entries(table_data, pos, num_files, archive_metadata, progress_callback=None):
+    """Decode num_files version 2 table entries starting at pos into the archive_metadata MemberTable.
+
+    This is the hot loop when opening big archives, so it binds everything it uses
+    to locals, decodes each distinct type string once, runs with garbage collection
+    paused and only reports progress every TABLE_PROGRESS_STEP entries. An entry
+    running past the end of the table raises ValueError rather than being dropped.
+    """
+    table_len = len(table_data)
+    entry_size = V2_ENTRY.size
+    unpack_entry = V2_ENTRY.unpack_from
+    unpack_ref = BASE_REF.unpack_from
+    has_crc = ENTRY_HAS_CRC
+    in_base = ENTRY_IN_BASE
+    base_count = len(archive_metadata._sources) - 1
+    types = {}
+    append_row = archive_metadata.append_row
+
+    with _gc_paused():
+        for i in range(num_files):
+            if progress_callback and not i % TABLE_PROGRESS_STEP:
+                progress_callback(i, num_files)
+            if pos + entry_size > table_len:
+                raise _corrupt_table(i, num_files)
+            (name_len, type_len, extra_len, flags, original_size, compressed_size,
+             data_offset, mtime, crc) = unpack_entry(table_data, pos)
+            pos += entry_size
+            if pos + name_len + type_len + extra_len > table_len:
+                raise _corrupt_table(i, num_files)
+            name_bytes = table_data[pos:pos + name_len]
+            pos += name_len
+            type_bytes = table_data[pos:pos + type_len]
+            pos += type_len
+            file_type = types.get(type_bytes)
+            if file_type is None:
+                file_type = types[type_bytes] = type_bytes.decode('utf-8') or 'file'
+
+            source = 0
+            if flags & in_base:
+                # Members kept in a base archive are read straight from it
+                if extra_len < BASE_REF.size or unpack_ref(table_data, pos)[0] >= base_count:
+                    raise ValueError(f"Archive file table is corrupt - {name_bytes.decode('utf-8', 'replace')} "
+                                     f"refers to a missing base archive")
+                source = unpack_ref(table_data, pos)[0] + 1
+            append_row(name_bytes, original_size, compressed_size, data_offset, mtime,
+                       crc if flags & has_crc else None, file_type, source)
+            pos += extra_len
+
+    distinct = archive_metadata.check_rows()
+    if distinct != num_files:
+        raise ValueError(f"Archive file table is corrupt - it lists {num_files} files "
+                         f"but holds {distinct} distinct names")
+    if progress_callback and num_files:
+        progress_callback(num_files - 1, num_files)
+    return pos
+
+def _parse_v2_columns(table_data, pos, num_files, archive_metadata):
+    """Load a columnar version 2 table starting at pos into the archive_metadata MemberTable.
+
+    Each column is one copy out of the table, so this costs about the same as
+    checking the names (which must be valid UTF-8 and distinct).
+    """
+    view = memoryview(table_data)
+    if pos + COLUMN_HEADER.size > len(view):
+        raise ValueError("Archive file table is corrupt - its column header is missing")
+    type_count, names_size, continued_size = COLUMN_HEADER.unpack_from(view, pos)
+    pos += COLUMN_HEADER.size
+
+    types = []
+    for _ in range(type_count):
+        if pos + BASE_REF.size > len(view):
+            raise ValueError("Archive file table is corrupt - its type list runs past its end")
+        type_len = BASE_REF.unpack_from(view, pos)[0]
+        pos += BASE_REF.size
+        types.append(bytes(view[pos:pos + type_len]).decode('utf-8') or 'file')
+        pos += type_len
+
+    columns = {}
+    for attribute, typecode in MemberTable.COLUMNS:
+        column = array(typecode)
+        size = column.itemsize * num_files
+        if pos + size > len(view):
+            raise ValueError(f"Archive file table is corrupt - it is too short for {num_files} entries")
+        column.frombytes(view[pos:pos + size])
+        if sys.byteorder != 'little':
+            column.byteswap()
+        columns[attribute] = column
+        pos += size
+
+    if pos + names_size + continued_size != len(view):
+        raise ValueError("Archive file table is corrupt - its names do not fill the rest of it")
+    names = bytes(view[pos:pos + names_size])
+    pos += names_size
+
+    continued = {}
+    if continued_size:
+        flagged = map(operator.and_, columns['_flags'], itertools.repeat(ENTRY_CONTINUED))
+        for row in itertools.compress(range(num_files), flagged):
+            if pos + BASE_REF.size > len(view):
+                raise ValueError("Archive file table is corrupt - its continuations run past its end")
+            count = BASE_REF.unpack_from(view, pos)[0]
+            pos += BASE_REF.size
+            if pos + count * CONTINUATION.size > len(view):
+                raise ValueError("Archive file table is corrupt - its continuations run past its end")
+            continued[row] = list(CONTINUATION.iter_unpack(view[pos:pos + count * CONTINUATION.size]))
+            pos += count * CONTINUATION.size
+    if pos != len(view):
+        raise ValueError("Archive file table is corrupt - its continuations do not fill the rest of it")
+    archive_metadata.load_columns(names, columns, types, continued)
+    return len(view)
+
+def _corrupt_table(index, num_files):
+    return ValueError(f"Archive file table is corrupt - entry {index + 1} of {num_files} runs past its end")
+
+def build_v2_table(file_path, archive_metadata, locations):
+    """Serialize the version 2 file table for members stored at the given (offset, size) locations.
+
+    Returns the table bytes and the header flags describing it. The table is written
+    as columns: each field is gathered for every member into one array and the names
+    are joined into one buffer, so the cost is a few passes over the members rather
+    than a struct.pack and several appends each. Members are taken in archive_metadata
+    order when locations covers all of them, which saves a lookup per member, and a
+    MemberTable then hands over its rows' fields from its columns. References to data
+    that spans volumes keep their continuation; other members are stored whole.
+    """
+    bases = {}
+    continued = []      # (position, continuation) of references to data spanning volumes
+    absolute = {}
+    archive_path = os.path.abspath(file_path)
+
+    def absolute_path(path):
+        result = absolute.get(path)
+        if result is None:
+            result = absolute[path] = os.path.abspath(path)
+        return result
+
+    def source(metadata):
+        # Same test as _member_reference, with the path lookups cached
+        base_archive = metadata.base_archive
+        if (base_archive and metadata.data_offset is not None and
+                not (metadata.temp_file and metadata.is_large) and metadata.archive_file is not None and
+                absolute_path(metadata.archive_file) == absolute_path(base_archive) != archive_path):
+            return bases.setdefault(absolute_path(base_archive), len(bases)) + 1
+        return 0
+
+    if isinstance(archive_metadata, MemberTable) and len(locations) == len(archive_metadata):
+        # Rows come straight from the columns; only their sources need the test
+        names, fields, records = archive_metadata.fields()
+        row_sources = [source(MemberRecord(data_offset=0, archive_file=archive_file, base_archive=base_archive))
+                       for archive_file, base_archive in archive_metadata._sources]
+        sources = array('H', map(row_sources.__getitem__, fields['source']))
+        for position, metadata in records.items():
+            sources[position] = source(metadata)
+            if sources[position] and metadata.continuation:
+                continued.append((position, metadata.continuation))
+    else:
+        if len(locations) == len(archive_metadata):
+            names = list(archive_metadata)
+            records = list(archive_metadata.values())
+        else:
+            names = list(locations)
+            records = list(map(archive_metadata.__getitem__, names))
+        fields = {'size': [metadata.size for metadata in records],
+                  'mtime': [metadata.mtime for metadata in records],
+                  'crc32': [metadata.crc32 for metadata in records],
+                  'type': [metadata.type for metadata in records]}
+        sources = array('H', bytes(2 * len(names)))
+        for position in itertools.compress(range(len(names)), map(operator.attrgetter('base_archive'), records)):
+            metadata = records[position]
+            sources[position] = source(metadata)
+            if sources[position] and metadata.continuation:
+                continued.append((position, metadata.continuation))
+    placed = list(locations.values()) if list(locations) == names else list(map(locations.__getitem__, names))
+    count = len(names)
+
+    names_data = ('\0'.join(names) + '\0').encode('utf-8') if names else b''
+    if names_data.count(b'\0') != count:
+        raise ValueError("Member names cannot hold NUL characters")
+
+    # Unknown mtimes and CRCs are None; most tables have none, so try without them first
+    try:
+        mtimes = array('q', fields['mtime'])
+    except TypeError:
+        mtimes = array('q', [mtime or 0 for mtime in fields['mtime']])
+    try:
+        crcs = array('I', fields['crc32'])
+        flags = array('B', [ENTRY_HAS_CRC]) * count
+    except TypeError:
+        crcs = array('I', [crc or 0 for crc in fields['crc32']])
+        flags = array('B', [ENTRY_HAS_CRC if crc is not None else 0 for crc in fields['crc32']])
+    file_types = fields['type']
+    type_ids = {file_type: type_id for type_id, file_type in enumerate(dict.fromkeys(file_types))}
+    if len(type_ids) > 0xFFFF:
+        raise ValueError("Too many distinct member types for one archive")
+    columns = {
+        '_size': array('Q', fields['size']),
+        '_compressed': array('Q', map(operator.itemgetter(1), placed)),
+        '_offset': array('Q', map(operator.itemgetter(0), placed)),
+        '_mtime': mtimes,
+        '_crc': crcs,
+        '_flags': flags,
+        '_type': array('H', map(type_ids.__getitem__, file_types)),
+        '_source': sources,
+    }
+
+    continuations = []
+    for position, pieces in sorted(continued):
+        if len(pieces) > 0xFFFF:
+            raise ValueError(f"{names[position]} spans too many volumes")
+        flags[position] |= ENTRY_CONTINUED
+        continuations.append(BASE_REF.pack(len(pieces)))
+        for path, offset, size in pieces:
+            continuations.append(CONTINUATION.pack(bases.setdefault(absolute_path(path), len(bases)) + 1,
+                                                   offset, size))
+    continuations = b''.join(continuations)
+
+    table = []
+    if bases:
+        table.append(BASE_REF.pack(len(bases)))
+        archive_dir = os.path.dirname(os.path.abspath(file_path))
+        for base_path in bases:
+            try:
+                stored_path = os.path.relpath(base_path, archive_dir)
+            except ValueError:
+                # Different drive on Windows
+                stored_path = base_path
+            stored_bytes = stored_path.encode('utf-8')
+            table.append(BASE_REF.pack(len(stored_bytes)))
+            table.append(stored_bytes)
+
+    table.append(COLUMN_HEADER.pack(len(type_ids), len(names_data), len(continuations)))
+    for file_type in type_ids:
+        type_bytes = file_type.encode('utf-8')
+        table.append(BASE_REF.pack(len(type_bytes)))
+        table.append(type_bytes)
+    for attribute, _ in MemberTable.COLUMNS:
+        column = columns[attribute]
+        if sys.byteorder != 'little':
+            column.byteswap()
+        table.append(column.tobytes())
+    table.append(names_data)
+    table.append(continuations)
+    return b''.join(table), ARCHIVE_COLUMNS | (ARCHIVE_HAS_BASES if bases else 0)
+
+COPY_BUFFER = 1024 * 1024
+OPEN_SOURCES = 64           # source archives kept open at once while copying members
+
+class _PayloadCopier:
+    """Copies stored member payloads between archives, keeping the source files open.
+
+    Members saved in table order come from each source archive in order too, so the
+    copy is sequential reads of each source and one sequential write.
+    """
+
+    def __init__(self):
+        self.sources = {}
+
+    @staticmethod
+    def stored_range(metadata):
+        """(archive file, offset, size) when iter_member_payload would copy the member out of one archive"""
+        pieces = _stored_pieces(metadata)
+        if pieces is None or len(pieces) > 1:
+            return None
+        return pieces[0]
+
+    def copy(self, filename, source_path, offset, size, out):
+        source = self.sources.get(source_path)
+        if source is None:
+            if len(self.sources) >= OPEN_SOURCES:
+                self.close()
+            source = self.sources[source_path] = open(source_path, 'rb')
+        source.seek(offset)
+        while size > 0:
+            chunk = source.read(min(COPY_BUFFER, size))
+            if not chunk:
+                raise ValueError(f"Archive data for {filename} is truncated")
+            out.write(chunk)
+            size -= len(chunk)
+
+    def close(self):
+        for source in self.sources.values():
+            source.close()
+        self.sources.clear()
+
+def write_archive(file_path, archive_metadata, progress_callback=None):
+    """Write a complete version 2 archive and return the (offset, size) of every member written into it.
+
+    Members that reference a base archive stay references and are not returned.
+    """
+    file_path = str(file_path)
+    # Members may still be read from the archive being replaced, so write beside it first
+    partial_path = file_path + '.partial'
+    locations = {}
+    written = {}
+    total = len(archive_metadata)
+
+    copier = _PayloadCopier()
+    try:
+        with open(partial_path, 'wb') as f:
+            f.write(V2_HEADER.pack(ARCHIVE_SIGNATURE, CRINKLE2_MARKER, 0, 0, 0, 0))
+
+            for i, (filename, metadata) in enumerate(archive_metadata.items()):
+                if progress_callback:
+                    progress_callback((i / total) * 100, filename)
+                if _member_reference(metadata, file_path):
+                    locations[filename] = (metadata['data_offset'], metadata['compressed_size'])
+                    continue
+                offset = f.tell()
+                stored = copier.stored_range(metadata)
+                with PROFILER.phase('copy', filename):
+                    if stored:
+                        copier.copy(filename, *stored, f)
+                    else:
+                        for chunk in iter_member_payload(filename, metadata):
+                            f.write(chunk)
+                locations[filename] = written[filename] = (offset, f.tell() - offset)
+                PROFILER.count('bytes written', f.tell() - offset)
+
+            table_offset = f.tell()
+            with PROFILER.phase('table build'):
+                table_data, archive_flags = build_v2_table(file_path, archive_metadata, locations)
+            f.write(table_data)
+            f.seek(0)
+            f.write(V2_HEADER.pack(ARCHIVE_SIGNATURE, CRINKLE2_MARKER, len(locations), archive_flags,
+                                   table_offset, len(table_data)))
+        copier.close()
+        os.replace(partial_path, file_path)
+    except BaseException:
+        copier.close()
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+        raise
+
+    return written
+
+def _is_stored_in(metadata, file_path):
+    """Check whether a member's current data already lives in the given archive file"""
+    if metadata['is_large'] and metadata.get('temp_file'):
+        return False
+    archive_file = metadata.get('archive_file')
+    return (metadata.get('data_offset') is not None and archive_file is not None and
+            os.path.abspath(archive_file) == os.path.abspath(file_path))
+
+def _member_reference(metadata, file_path):
+    """Base archive a member should be referenced from instead of copied into file_path, if any"""
+    base_archive = metadata.get('base_archive')
+    if (base_archive and _is_stored_in(metadata, base_archive) and
+            os.path.abspath(base_archive) != os.path.abspath(file_path)):
+        return base_archive
+    return None
+
+def append_to_archive(file_path, archive_metadata, progress_callback=None):
+    """Save into an existing version 2 archive by appending only members it does not hold yet.
+
+    Unchanged members stay where they are and a new file table is written after the
+    appended data. The header is patched last, so an interrupted append leaves the
+    previous table in effect. Space held by removed or replaced members is only
+    reclaimed by a full save.
+    """
+    file_path = str(file_path)
+    locations = {}
+    pending = []
+    for filename, metadata in archive_metadata.items():
+        if ((_is_stored_in(metadata, file_path) and not metadata.get('continuation')) or
+                _member_reference(metadata, file_path)):
+            locations[filename] = (metadata['data_offset'], metadata['compressed_size'])
+        else:
+            pending.append(filename)
+
+    with open(file_path, 'r+b') as f:
+        header = f.read(V2_HEADER.size)
+        if len(header) < V2_HEADER.size or header[:16] != ARCHIVE_SIGNATURE + CRINKLE2_MARKER:
+            raise ValueError("Only version 2 archives can be appended to")
+
+        f.seek(0, os.SEEK_END)
+        for i, filename in enumerate(pending):
+            if progress_callback:
+                progress_callback((i / len(pending)) * 100, filename)
+            offset = f.tell()
+            with PROFILER.phase('copy', filename):
+                for chunk in iter_member_payload(filename, archive_metadata[filename]):
+                    f.write(chunk)
+            locations[filename] = (offset, f.tell() - offset)
+            PROFILER.count('bytes written', f.tell() - offset)
+
+        # Keep the table in the same order as the metadata
+        locations = {filename: locations[filename] for filename in archive_metadata}
+        table_offset = f.tell()
+        with PROFILER.phase('table build'):
+            table_data, archive_flags = build_v2_table(file_path, archive_metadata, locations)
+        f.write(table_data)
+        f.flush()
+        os.fsync(f.fileno())
+
+        f.seek(0)
+        f.write(V2_HEADER.pack(ARCHIVE_SIGNATURE, CRINKLE2_MARKER, len(locations), archive_flags,
+                               table_offset, len(table_data)))
+
+    return {filename: locations[filename] for filename in pending}
+
+def save_archive_changes(file_path, archive_metadata, progress_callback=None):
+    """Save with an append when the archive on disk is version 2, otherwise write it in full.
+
+    Returns the (offset, size) of every member written, as write_archive does.
+    """
+    if archive_format_version(file_path) == 2:
+        return append_to_archive(file_path, archive_metadata, progress_callback)
+    return write_archive(file_path, archive_metadata, progress_callback)
+
+TABLE_ROW_SIZE = sum(array(typecode).itemsize for _, typecode in MemberTable.COLUMNS)
+
+def _table_entry_size(filename, metadata):
+    """Bytes a member's entry can take in a version 2 table that holds its data itself.
+
+    Counts the member's type string too, although a table stores each type once.
+    """
+    return (TABLE_ROW_SIZE + len(filename.encode('utf-8')) + 1 +
+            BASE_REF.size + len(metadata['type'].encode('utf-8')))
+
+MERGE_POLICIES = ('error', 'skip', 'replace', 'newer', 'rename')
+
+def _renamed(filename, taken):
+    """filename with " (2)", " (3)", ... before its extension, whichever is free first"""
+    folder, base = DirectoryIndex.split(filename)
+    stem, dot, extension = base.rpartition('.') if '.' in base.lstrip('.') else (base, '', '')
+    number = 2
+    while True:
+        candidate = f"{folder}{stem} ({number}){dot}{extension}"
+        if candidate not in taken:
+            return candidate
+        number += 1
+
+def _standalone_table(file_path):
+    """Read an archive table with every member pointing at its data, never at a base archive"""
+    archive_metadata, _ = read_archive_table(file_path)
+    set_base_archives(archive_metadata, False)
+    return archive_metadata
+
+def merge_archives(sources, file_path, on_conflict='error', progress_callback=None):
+    """Combine archives into a new one by copying their stored member data; nothing is decompressed.
+
+    Members keep their order, source by source, so each source is read sequentially.
+    A name already taken by an earlier source is handled by on_conflict: 'error'
+    raises ValueError, 'skip' keeps the earlier member, 'replace' keeps the later one,
+    'newer' keeps whichever has the later mtime and 'rename' stores the later one as
+    "name (2).ext". The result is self-contained even if a source referenced a base
+    archive. Returns counts of members, skipped, replaced and renamed.
+    """
+    if on_conflict not in MERGE_POLICIES:
+        raise ValueError(f"Unknown conflict policy {on_conflict!r}")
+    merged = {}
+    counts = {'members': 0, 'skipped': 0, 'replaced': 0, 'renamed': 0}
+    for source in sources:
+        for filename, metadata in _standalone_table(source).items():
+            existing = merged.get(filename)
+            if existing is not None:
+                if on_conflict == 'error':
+                    raise ValueError(f"{filename} is in more than one archive (last in {source})")
+                if on_conflict == 'rename':
+                    filename = _renamed(filename, merged)
+                    counts['renamed'] += 1
+                elif on_conflict == 'skip' or (on_conflict == 'newer' and
+                                               (metadata['mtime'] or 0) <= (existing['mtime'] or 0)):
+                    counts['skipped'] += 1
+                    continue
+                else:
+                    # Move it to the end, so data is still read in source order
+                    del merged[filename]
+                    counts['replaced'] += 1
+            merged[filename] = metadata
+
+    write_archive(file_path, merged, progress_callback)
+    counts['members'] = len(merged)
+    return counts
+
+def split_archive(file_path, max_size, output_template=None, progress_callback=None):
+    """Split an archive into complete archives of at most max_size bytes, copying stored data.
+
+    Members keep their order and are never divided; one bigger than max_size gets a
+    part to itself. Parts are written next to the archive as name.part001.kc,
+    name.part002.kc, ... unless output_template (formatted with the part number) says
+    otherwise. Returns the paths of the parts.
+    """
+    archive_metadata = _standalone_table(file_path)
+    if output_template is None:
+        stem, _ = os.path.splitext(str(file_path))
+        output_template = stem + '.part{:03d}.kc'
+
+    parts = [{}]
+    part_size = V2_HEADER.size
+    for filename, metadata in archive_metadata.items():
+        member_size = metadata['compressed_size'] + _table_entry_size(filename, metadata)
+        if parts[-1] and part_size + member_size > max_size:
+            parts.append({})
+            part_size = V2_HEADER.size
+        parts[-1][filename] = metadata
+        part_size += member_size
+
+    paths = []
+    for number, part in enumerate(parts, 1):
+        path = output_template.format(number)
+        if os.path.abspath(path) == os.path.abspath(file_path):
+            raise ValueError("Split parts would overwrite the archive being split")
+        if progress_callback:
+            progress_callback(number, len(parts), path)
+        write_archive(path, part)
+        paths.append(path)
+    return paths
+
+VOLUME_QUEUE = 8            # payloads waiting for each volume writer
+
+def volume_path(file_path, number, folder=None):
+    """Path of volume number (1-based) of a multi-volume archive: name.kc.001, name.kc.002, ...
+
+    Volumes sit beside the index unless another folder is given.
+    """
+    file_path = str(file_path)
+    return os.path.join(os.path.dirname(file_path) if folder is None else folder,
+                        f"{os.path.basename(file_path)}.{number:03d}")
+
+def volume_capacity(volume_size):
+    """Bytes of a volume left for member data and table entries once its header and table header are in"""
+    return volume_size - V2_HEADER.size - COLUMN_HEADER.size
+
+class _VolumeWriter:
+    """Fills one volume on a thread of its own, so volumes on different disks are written at once.
+
+    The producer reserves room with fits()/put(); the thread writes payloads as they
+    arrive and, on close(), the volume's own file table, so every volume is a complete
+    archive that can be opened without the others. Pieces of members that span
+    volumes (put_piece()) are written too but left out of the table. Payloads queued
+    in memory are charged to MEMORY_BUDGET until they are written; queued is their total.
+    """
+
+    def __init__(self, path, volume_size):
+        import queue
+
+        self.path = path
+        self.partial_path = path + '.partial'
+        self.room = volume_capacity(volume_size)
+        self.members = {}
+        self.locations = {}
+        self.pieces = {}
+        self.queued = 0
+        self.error = None
+        self.lock = threading.Lock()
+        self.queue = queue.Queue(maxsize=VOLUME_QUEUE)
+        self.thread = threading.Thread(target=self._run, name=f"volume {os.path.basename(path)}", daemon=True)
+        self.thread.start()
+
+    def fits(self, size):
+        return size <= self.room
+
+    def put(self, filename, metadata, payload=None, can_wait=None):
+        """Queue a member; payload is its stored bytes, or None to copy them from where metadata says.
+
+        can_wait is passed on to MEMORY_BUDGET.reserve() while charging a payload in memory.
+        """
+        self.room -= metadata['compressed_size'] + _table_entry_size(filename, metadata)
+        self.members[filename] = metadata
+        charge = 0 if payload is None or isinstance(payload, SpooledPayload) else len(payload)
+        chunks = None if payload is None else payload_chunks(payload)
+        self._queue(filename, metadata, chunks, metadata['compressed_size'], charge, can_wait)
+
+    def put_piece(self, filename, chunks, size, charge=0, can_wait=None):
+        """Queue size bytes of a member whose data spans volumes, charge of them held in memory"""
+        self.room -= size
+        self._queue(filename, None, chunks, size, charge, can_wait)
+
+    def _queue(self, filename, metadata, chunks, size, charge, can_wait):
+        if self.error:
+            raise self.error
+        if charge:
+            MEMORY_BUDGET.reserve(charge, can_wait)
+            with self.lock:
+                self.queued += charge
+        self.queue.put((filename, metadata, chunks, size, charge))
+
+    def _release(self, charge):
+        if charge:
+            with self.lock:
+                self.queued -= charge
+            MEMORY_BUDGET.release(charge)
+
+    def close(self):
+        """Finish the volume and wait for it; raises whatever stopped the writer"""
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+    def _run(self):
+        copier = _PayloadCopier()
+        draining = True
+        try:
+            with open(self.partial_path, 'wb') as f:
+                f.write(V2_HEADER.pack(ARCHIVE_SIGNATURE, CRINKLE2_MARKER, 0, 0, 0, 0))
+                while True:
+                    item = self.queue.get()
+                    if item is None:
+                        draining = False
+                        break
+                    filename, metadata, chunks, size, charge = item
+                    offset = f.tell()
+                    try:
+                        with PROFILER.phase('copy', filename):
+                            if chunks is not None:
+                                for chunk in chunks:
+                                    f.write(chunk)
+                            else:
+                                stored = copier.stored_range(metadata)
+                                if stored:
+                                    copier.copy(filename, *stored, f)
+                                else:
+                                    for chunk in iter_member_payload(filename, metadata):
+                                        f.write(chunk)
+                    finally:
+                        # Let go of a payload in memory along with its charge
+                        item = chunks = None
+                        self._release(charge)
+                    if f.tell() - offset != size:
+                        raise ValueError(f"{filename}: stored size changed while it was written")
+                    if metadata is None:
+                        self.pieces[filename] = (offset, size)
+                    else:
+                        self.locations[filename] = (offset, size)
+                    PROFILER.count('bytes written', size)
+
+                table_offset = f.tell()
+                table_data, archive_flags = build_v2_table(self.path, self.members, self.locations)
+                f.write(table_data)
+                f.seek(0)
+                f.write(V2_HEADER.pack(ARCHIVE_SIGNATURE, CRINKLE2_MARKER, len(self.locations), archive_flags,
+                                       table_offset, len(table_data)))
+        except BaseException as e:
+            self.error = e
+            # Keep taking work so the producer is never left blocked on a full queue
+            while draining:
+                item = self.queue.get()
+                if item is None:
+                    break
+                self._release(item[4])
+        finally:
+            copier.close()
+
+def write_volumes(file_path, archive_metadata, volume_size, volume_dirs=None, max_workers=None,
+                  progress_callback=None):
+    """Write a multi-volume archive: member data in volumes of at most volume_size bytes, plus an index.
+
+    Volumes are named by volume_path(). One volume per folder in volume_dirs (or one
+    beside the index, without them) is filled at a time on its own thread; a member goes to the
+    open volume with the most room and, when it fits none, the fullest is finished and
+    the next volume opened on that disk. Each volume is a complete archive. The index
+    at file_path holds no data, only the file table with every member referencing the
+    volume it lives in, so it opens, extracts and verifies like any archive.
+
+    A member whose stored data is larger than a volume is divided instead: its pieces
+    fill the open volumes and as many new ones as it takes, outside their own tables,
+    and the index lists each piece after the first as a continuation. Files not
+    compressed yet are compressed on a thread pool first, as compress_files() does.
+    Payloads waiting for a volume writer are charged to MEMORY_BUDGET. Returns the
+    volume paths.
+    """
+    file_path = str(file_path)
+    folders = list(volume_dirs) if volume_dirs else [None]
+    capacity = volume_capacity(volume_size)
+    if capacity <= 0:
+        raise ValueError("Volume size is too small")
+
+    volumes = []
+    writers = [None] * len(folders)
+    spans = {}          # filename -> (record, volumes holding its pieces in order)
+    spools = []         # spooled payloads read piece by piece, removed at the end
+    total = len(archive_metadata)
+    done = 0
+
+    def queued():
+        # Whether a volume writer still has payloads to write and release
+        return any(writer.queued for writer in volumes)
+
+    def open_volume(slot):
+        number = len(volumes) + 1
+        path = volume_path(file_path, number, folders[slot])
+        if folders[slot] is not None:
+            os.makedirs(folders[slot], exist_ok=True)
+        writers[slot] = _VolumeWriter(path, volume_size)
+        volumes.append(writers[slot])
+
+    def roomiest(needed):
+        """Slot of the open volume with the most room, finishing the fullest volume first if needed fits none"""
+        slot = max(range(len(writers)), key=lambda i: capacity if writers[i] is None else writers[i].room)
+        if writers[slot] is None:
+            open_volume(slot)
+        elif not writers[slot].fits(needed):
+            # Fits nowhere: finish the fullest volume and start the next one on its disk
+            slot = min(range(len(writers)), key=lambda i: writers[i].room)
+            writers[slot].close()
+            open_volume(slot)
+        return slot
+
+    def span(filename, record, payload):
+        if payload is None:
+            pieces = _stored_pieces(record) or [(record['temp_file'], 0, record['compressed_size'])]
+        elif isinstance(payload, SpooledPayload):
+            spools.append(payload)
+            pieces = [(payload.path, 0, len(payload))]
+        else:
+            pieces = None
+        holders = []
+        start = 0
+        while start < record['compressed_size']:
+            writer = writers[roomiest(1)]
+            length = min(record['compressed_size'] - start, writer.room)
+            if pieces is None:
+                writer.put_piece(filename, (memoryview(payload)[start:start + length],), length, length, queued)
+            else:
+                writer.put_piece(filename, _iter_range_chunks(filename, pieces, start, length), length)
+            holders.append(writer)
+            start += length
+        spans[filename] = (record, holders)
+
+    def place(filename, record, payload=None):
+        nonlocal done
+        needed = record['compressed_size'] + _table_entry_size(filename, record)
+        if needed <= capacity:
+            writers[roomiest(needed)].put(filename, record, payload, queued)
+        elif record['compressed_size']:
+            span(filename, record, payload)
+        else:
+            raise ValueError(f"Volume size is too small for the file table entry of {filename}")
+        done += 1
+        if progress_callback:
+            progress_callback((done / total) * 100, filename)
+
+    try:
+        fresh = []
+        for filename, metadata in archive_metadata.items():
+            temp_file = metadata.get('temp_file')
+            if (_stored_pieces(metadata) or
+                    (metadata['is_large'] and temp_file and os.path.exists(temp_file))):
+                record = metadata.copy()
+                # Copied into a volume whole, whatever archive it references now
+                record.base_archive = None
+                place(filename, record)
+            else:
+                fresh.append(filename)
+
+        def fresh_files():
+            for filename in fresh:
+                original_path = archive_metadata[filename].get('original_path')
+                if not original_path or not os.path.exists(original_path):
+                    raise FileNotFoundError(f"Source for {filename} is no longer available")
+                yield filename, original_path, os.stat(original_path)
+
+        for filename, _, _, future in compress_files(fresh_files(), max_workers):
+            original_size, payload, crc = future.result()
+            record = archive_metadata[filename].copy()
+            if record.crc32 is not None and record.crc32 != crc:
+                raise ValueError(f"{filename} changed on disk after it was added")
+            record.size = original_size
+            record.crc32 = crc
+            record.compressed_size = len(payload)
+            place(filename, record, payload)
+
+        for writer in writers:
+            if writer is not None:
+                writer.close()
+        for writer in volumes:
+            os.replace(writer.partial_path, writer.path)
+    except BaseException:
+        for writer in volumes:
+            if writer.thread.is_alive():
+                writer.queue.put(None)
+                writer.thread.join()
+            try:
+                os.remove(writer.partial_path)
+            except OSError:
+                pass
+        raise
+    finally:
+        for payload in spools:
+            payload.discard()
+
+    # The index references every member in its volume, in the original member order
+    index = {}
+    for writer in volumes:
+        for filename, (offset, size) in writer.locations.items():
+            index[filename] = writer.members[filename].copy()
+            index[filename].archive_file = writer.path
+            index[filename].data_offset = offset
+            index[filename].continuation = None
+    for filename, (record, holders) in spans.items():
+        index[filename] = record.copy()
+        index[filename].archive_file = holders[0].path
+        index[filename].data_offset = holders[0].pieces[filename][0]
+        index[filename].continuation = tuple((writer.path, *writer.pieces[filename]) for writer in holders[1:])
+    for record in index.values():
+        record.original_path = ''
+        record.temp_file = None
+        record.base_archive = record.archive_file
+    write_archive(file_path, {filename: index[filename] for filename in archive_metadata})
+    return [writer.path for writer in volumes]
+
+class _StreamWriter:
+    """Writes a streamed version 2 archive to a binary file object, one member at a time"""
+
+    def __init__(self, out):
+        self.out = out
+        self.position = 0
+        self.archive_metadata = {}
+        self.locations = {}
+        self._emit(V2_HEADER.pack(ARCHIVE_SIGNATURE, CRINKLE2_MARKER, 0, ARCHIVE_STREAMED, 0, 0))
+
+    def _emit(self, data):
+        self.out.write(data)
+        self.position += len(data)
+
+    def add(self, filename, metadata, chunks, totals=None):
+        """Write a member whose payload (metadata.compressed_size bytes) is yielded by chunks.
+
+        With totals, chunks come from compress_file_chunks() and the payload's size is
+        only known once they are out: the local header goes without it, a
+        DATA_DESCRIPTOR follows the payload and metadata is updated from totals.
+        """
+        filename_bytes = filename.encode('utf-8')
+        file_type_bytes = metadata.type.encode('utf-8')
+        data_offset = (self.position + len(LOCAL_SIGNATURE) + V2_ENTRY.size +
+                       len(filename_bytes) + len(file_type_bytes))
+        crc = metadata.crc32
+        if totals is not None:
+            flags = ENTRY_HAS_DESCRIPTOR
+        else:
+            flags = ENTRY_HAS_CRC if crc is not None else 0
+        with PROFILER.phase('copy', filename):
+            self._emit(LOCAL_SIGNATURE + V2_ENTRY.pack(
+                len(filename_bytes), len(file_type_bytes), 0, flags,
+                metadata.size, metadata.compressed_size, data_offset, metadata.mtime or 0, crc or 0))
+            self._emit(filename_bytes + file_type_bytes)
+            for chunk in chunks:
+                self._emit(chunk)
+        written = self.position - data_offset
+        if totals is not None:
+            metadata.size = totals['size']
+            metadata.compressed_size = written
+            metadata.crc32 = totals['crc32']
+            self._emit(DATA_DESCRIPTOR.pack(DESCRIPTOR_SIGNATURE, metadata.size, written, metadata.crc32))
+        elif written != metadata.compressed_size:
+            raise ValueError(f"{filename}: wrote {written} bytes, expected {metadata.compressed_size}")
+        PROFILER.count('bytes written', written)
+        self.archive_metadata[filename] = metadata
+        self.locations[filename] = (data_offset, written)
+
+    def finish(self):
+        """Write the index and trailer; returns the metadata of every member written"""
+        table_offset = self.position
+        with PROFILER.phase('table build'):
+            table_data, archive_flags = build_v2_table('', self.archive_metadata, self.locations)
+        self._emit(table_data)
+        self._emit(V2_HEADER.pack(ARCHIVE_SIGNATURE, TRAILER_MARKER, len(self.locations), archive_flags,
+                                  table_offset, len(table_data)))
+        self.out.flush()
+        return self.archive_metadata
+
+def write_archive_stream(out, files, progress_callback=None, on_error=None):
+    """Write a streamed version 2 archive of (name, path, stat) items to a binary file object.
+
+    Only out.write() is used, so out can be a pipe, socket or sys.stdout.buffer.
+    Files go through compress_files and each payload is written right after its
+    local header; files too big to compress in memory are compressed straight into
+    the stream, a chunk at a time. So nothing is spooled and files may be a lazy
+    generator. Returns the metadata of the members written.
+
+    progress_callback(name, original_size) is called after each member. A file that
+    cannot be read is passed to on_error(name, error) and left out; without on_error
+    the error is raised and the stream is left without its index.
+    """
+    writer = _StreamWriter(out)
+    for filename, file_path, file_stat, job in compress_files(files, spool=False):
+        try:
+            original_size, payload, crc = job.result()
+        except (OSError, ValueError) as e:
+            if on_error is None:
+                raise
+            on_error(filename, e)
+            continue
+
+        if payload is None:
+            # Too big to hold: compressed into the stream, its sizes in a descriptor after it
+            metadata = new_member_metadata(file_path, original_size, 0, mtime=file_stat.st_mtime_ns)
+            totals = {}
+            try:
+                writer.add(filename, metadata, compress_file_chunks(filename, file_path, totals), totals)
+            except (OSError, ValueError) as e:
+                # What was written of it stays in the stream, but the index leaves it out
+                if on_error is None:
+                    raise
+                on_error(filename, e)
+                continue
+            original_size = metadata.size
+        else:
+            metadata = new_member_metadata(file_path, original_size, len(payload),
+                                           mtime=file_stat.st_mtime_ns, crc32=crc)
+            writer.add(filename, metadata, payload_chunks(payload))
+            del payload
+        if progress_callback:
+            progress_callback(filename, original_size)
+    return writer.finish()
+
+ZIP_LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+# zlib stream header for deflate with a 32K window; the level bits are informational
+ZLIB_HEADER = b'\x78\x9c'
+
+def portable_member_name(name):
+    """name as a relative '/'-separated path that stays inside whatever folder it is unpacked to.
+
+    Backslashes become '/', a leading drive letter ('C:') is dropped, and so are
+    empty, '.' and '..' parts - which also strips leading slashes. Used for names
+    coming in from ZIP files and going out to ZIP and tar files; returns '' when
+    nothing usable is left.
+    """
+    parts = name.replace('\\', '/').split('/')
+    if re.match(r'[A-Za-z]:', parts[0]):
+        parts[0] = parts[0][2:]
+    return '/'.join(part for part in parts if part not in ('', '.', '..'))
+
+def _exported_names(archive_metadata, names):
+    """(member name, name to write) for export_zip and export_tar.
+
+    Names are made portable, so a hostile or Windows-style name cannot point outside
+    the folder the export is unpacked into. A name with nothing left, or two members
+    that end up with the same name, raise ValueError before anything is written.
+    """
+    exported = []
+    taken = {}
+    for filename in names if names is not None else list(archive_metadata):
+        name = portable_member_name(filename)
+        if not name:
+            raise ValueError(f"{filename}: member name has no usable path to export")
+        if name in taken:
+            raise ValueError(f"{filename}: exports as {name}, the same name as {taken[name]}")
+        taken[name] = filename
+        exported.append((filename, name))
+    return exported
+
+def _zip_mtime(info):
+    """Modification time of a ZIP entry in ns, from its UTC extended timestamp or else its DOS time"""
+    extra = info.extra
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, length = struct.unpack_from('<HH', extra, pos)
+        if tag == 0x5455 and length >= 5 and pos + 9 <= len(extra) and extra[pos + 4] & 1:
+            return struct.unpack_from('<i', extra, pos + 5)[0] * 1_000_000_000
+        pos += 4 + length
+    try:
+        return int(time.mktime(info.date_time + (0, 0, -1))) * 1_000_000_000
+    except (OverflowError, ValueError):
+        return None
+
+def _zip_raw_chunks(f, info, name):
+    """Yield the stored bytes of a ZIP entry straight from the ZIP file"""
+    f.seek(info.header_offset)
+    header = f.read(ZIP_LOCAL_HEADER.size)
+    if len(header) < ZIP_LOCAL_HEADER.size or header[:4] != b'PK\x03\x04':
+        raise ValueError(f"{name}: bad local header in ZIP file")
+    name_length, extra_length = ZIP_LOCAL_HEADER.unpack(header)[-2:]
+    f.seek(info.header_offset + ZIP_LOCAL_HEADER.size + name_length + extra_length)
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = f.read(min(OptimizedCompression.LARGE_CHUNK, remaining))
+        if not chunk:
+            raise ValueError(f"{name}: ZIP data is truncated")
+        remaining -= len(chunk)
+        yield chunk
+
+def _zip_passthrough(f, info, name):
+    """Yield a kc payload made from a stored or deflated ZIP entry without recompressing it.
+
+    Deflate data is inflated once alongside the copy, to compute the Adler-32 that
+    ends a zlib stream and to check the entry against the CRC32 in the ZIP.
+    """
+    crc = 0
+    size = 0
+    if info.compress_type == ZIP_STORED:
+        yield b'\x00'
+        for chunk in _zip_raw_chunks(f, info, name):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            yield chunk
+    else:
+        yield b'\x02' + ZLIB_HEADER
+        inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        adler = 1
+        try:
+            for chunk in _zip_raw_chunks(f, info, name):
+                # Cap each step so highly compressible data cannot balloon in memory
+                data = inflater.decompress(chunk, OptimizedCompression.LARGE_CHUNK)
+                while True:
+                    adler = zlib.adler32(data, adler)
+                    crc = zlib.crc32(data, crc)
+                    size += len(data)
+                    if not inflater.unconsumed_tail:
+                        break
+                    data = inflater.decompress(inflater.unconsumed_tail, OptimizedCompression.LARGE_CHUNK)
+                yield chunk
+            data = inflater.flush()
+        except zlib.error as e:
+            raise ValueError(f"{name}: corrupt deflate data in ZIP file: {e}")
+        adler = zlib.adler32(data, adler)
+        crc = zlib.crc32(data, crc)
+        size += len(data)
+        if not inflater.eof:
+            raise ValueError(f"{name}: deflate data in ZIP file is truncated")
+        yield struct.pack('>I', adler)
+
+    if size != info.file_size or crc != info.CRC:
+        raise ValueError(f"{name}: CRC32 mismatch in ZIP file - data is corrupt")
+
+def import_zip(zip_path, out, progress_callback=None, on_error=None):
+    """Convert a ZIP file into a streamed archive written to out, reusing its compressed data.
+
+    Deflated entries are raw deflate streams, so they become kc zlib payloads by
+    adding a zlib header and the Adler-32 of the content; stored entries are copied
+    as they are. The data is inflated once to compute the Adler-32 and check the ZIP's
+    CRC32, but never compressed again. Entries using other methods are extracted and
+    compressed as usual, and folders are skipped.
+
+    progress_callback(name, original_size, passthrough) is called after each member.
+    Encrypted or unreadable entries are passed to on_error(name, error) and left out;
+    without on_error the error is raised. Corrupt data found while copying always
+    raises, since part of the member has already been written. Returns the metadata
+    of the members written.
+    """
+    import zipfile
+
+    writer = _StreamWriter(out)
+    with zipfile.ZipFile(zip_path) as zf, open(zip_path, 'rb') as f:
+        for info in zf.infolist():
+            name = portable_member_name(info.filename)
+            if info.is_dir() or not name:
+                continue
+            metadata = MemberRecord(size=info.file_size, type=Path(name).suffix or 'file',
+                                    mtime=_zip_mtime(info), crc32=info.CRC)
+            passthrough = info.compress_type in (ZIP_STORED, ZIP_DEFLATED) and not info.flag_bits & 0x1
+            try:
+                if passthrough:
+                    wrapped = 1 if info.compress_type == ZIP_STORED else 1 + len(ZLIB_HEADER) + 4
+                    metadata.compressed_size = info.compress_size + wrapped
+                    writer.add(name, metadata, _zip_passthrough(f, info, name))
+                elif fits_in_memory(info.file_size):
+                    with MEMORY_BUDGET.hold(compression_footprint(info.file_size)):
+                        with PROFILER.phase('read', name):
+                            data = zf.read(info)
+                        payload, metadata.crc32 = compress_member(name, data)
+                        del data
+                        metadata.compressed_size = len(payload)
+                        writer.add(name, metadata, (payload,))
+                        del payload
+                else:
+                    # Too big to hold: compress from the ZIP a chunk at a time into a spool file
+                    totals = {}
+                    with MEMORY_BUDGET.hold(min(STREAM_FOOTPRINT, MEMORY_BUDGET.limit)):
+                        with zf.open(info) as source:
+                            payload = spool_payload(_compressed_chunks(name, source, info.file_size, None, totals))
+                    metadata.crc32 = totals['crc32']
+                    metadata.compressed_size = len(payload)
+                    writer.add(name, metadata, payload.chunks())
+                    del payload
+            except (RuntimeError, NotImplementedError, zipfile.BadZipFile) as e:
+                # Encrypted entries and unsupported methods, found before anything is written
+                if on_error is None:
+                    raise ValueError(f"{name}: {e}")
+                on_error(name, e)
+                continue
+            if progress_callback:
+                progress_callback(name, info.file_size, passthrough)
+    return writer.finish()
+
+ZIP_CENTRAL_HEADER = struct.Struct('<4s6H3I5H2I')
+ZIP_END_RECORD = struct.Struct('<4s4H2IH')
+ZIP64_END_RECORD = struct.Struct('<4sQ2H2I4Q')
+ZIP64_END_LOCATOR = struct.Struct('<4sIQI')
+ZIP_UTF8_NAMES = 0x0800
+ZIP_DATA_DESCRIPTOR = 0x0008
+ZIP32_LIMIT = 0xFFFFFFFF
+
+def _dos_datetime(mtime_ns):
+    """DOS (time, date) words for a member mtime, clamped to the 1980-2107 range they can hold"""
+    if mtime_ns is None:
+        mtime_ns = time.time_ns()
+    year, month, day, hour, minute, second = time.localtime(mtime_ns / 1e9)[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    year = min(year, 2107)
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+def _zlib_payload_body(chunks, compressed_size):
+    """Raw deflate data from a zlib payload's chunks, or None if the stream can't be reused as is.
+
+    Drops the type byte and 2-byte zlib header in front and the Adler-32 behind; the
+    first chunk is read here to check the header. Returns (deflate size, chunks).
+    """
+    chunks = iter(chunks)
+    head = b''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 3:
+            break
+    # Method 8 (deflate) and no preset dictionary, as zlib.compress always writes
+    if len(head) < 3 or head[1] & 0x0F != 8 or head[2] & 0x20 or compressed_size < 7:
+        return None
+
+    def body():
+        pending = head[3:]
+        for chunk in chunks:
+            pending += chunk
+            if len(pending) > 4:
+                yield pending[:-4]
+                pending = pending[-4:]
+        if len(pending) > 4:
+            yield pending[:-4]
+    return compressed_size - 7, body()
+
+class _ZipWriter:
+    """Writes a ZIP file to a binary file object front to back, using ZIP64 where sizes need it"""
+
+    def __init__(self, out):
+        self.out = out
+        self.position = 0
+        self.entries = []
+
+    def _emit(self, data):
+        self.out.write(data)
+        self.position += len(data)
+
+    def add(self, name, mtime_ns, method, crc, compressed_size, size, chunks):
+        """Write one entry. When crc or the sizes are None they follow the data in a data descriptor"""
+        name_bytes = name.encode('utf-8')
+        dos_time, dos_date = _dos_datetime(mtime_ns)
+        flags = ZIP_UTF8_NAMES
+        descriptor = crc is None
+        if descriptor:
+            flags |= ZIP_DATA_DESCRIPTOR
+        timestamp = b''
+        if mtime_ns is not None and 0 <= mtime_ns // 1_000_000_000 < 2 ** 31:
+            timestamp = struct.pack('<HHBi', 0x5455, 5, 1, mtime_ns // 1_000_000_000)
+
+        # Sizes of a descriptor entry are unknown, so give it ZIP64 fields up front
+        zip64 = descriptor or size >= ZIP32_LIMIT or compressed_size >= ZIP32_LIMIT
+        extra = timestamp
+        if zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, size or 0, compressed_size or 0) + timestamp
+        offset = self.position
+        self._emit(ZIP_LOCAL_HEADER.pack(
+            b'PK\x03\x04', 45 if zip64 else 20, flags, method, dos_time, dos_date,
+            0 if descriptor else crc, ZIP32_LIMIT if zip64 else compressed_size,
+            ZIP32_LIMIT if zip64 else size, len(name_bytes), len(extra)))
+        self._emit(name_bytes + extra)
+
+        start = self.position
+        if descriptor:
+            # chunks fills in its result dict once exhausted
+            result = {}
+            for chunk in chunks(result):
+                self._emit(chunk)
+            crc, size = result['crc'], result['size']
+            compressed_size = self.position - start
+            self._emit(struct.pack('<4sIQQ', b'PK\x07\x08', crc, compressed_size, size))
+        else:
+            for chunk in chunks:
+                self._emit(chunk)
+            if self.position - start != compressed_size:
+                raise ValueError(f"{name}: wrote {self.position - start} bytes, expected {compressed_size}")
+        self.entries.append((name_bytes, flags, method, dos_time, dos_date, crc, compressed_size, size,
+                             offset, timestamp, zip64))
+
+    def finish(self):
+        """Write the central directory and end records"""
+        directory_offset = self.position
+        for (name_bytes, flags, method, dos_time, dos_date, crc, compressed_size, size,
+             offset, timestamp, zip64) in self.entries:
+            # Values that overflow 32 bits move to a ZIP64 extra field, in this order
+            wide = [value for value in (size, compressed_size, offset) if value >= ZIP32_LIMIT]
+            extra = timestamp
+            if wide:
+                extra = struct.pack(f'<HH{len(wide)}Q', 0x0001, 8 * len(wide), *wide) + timestamp
+            self._emit(ZIP_CENTRAL_HEADER.pack(
+                b'PK\x01\x02', (3 << 8) | 45, 45 if zip64 or wide else 20, flags, method, dos_time, dos_date,
+                crc, min(compressed_size, ZIP32_LIMIT), min(size, ZIP32_LIMIT),
+                len(name_bytes), len(extra), 0, 0, 0, 0o100644 << 16, min(offset, ZIP32_LIMIT)))
+            self._emit(name_bytes + extra)
+
+        count = len(self.entries)
+        directory_size = self.position - directory_offset
+        if count >= 0xFFFF or directory_offset >= ZIP32_LIMIT or directory_size >= ZIP32_LIMIT:
+            end64_offset = self.position
+            self._emit(ZIP64_END_RECORD.pack(b'PK\x06\x06', ZIP64_END_RECORD.size - 12, 45, 45, 0, 0,
+                                             count, count, directory_size, directory_offset))
+            self._emit(ZIP64_END_LOCATOR.pack(b'PK\x06\x07', 0, end64_offset, 1))
+        self._emit(ZIP_END_RECORD.pack(b'PK\x05\x06', 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                                       min(directory_size, ZIP32_LIMIT), min(directory_offset, ZIP32_LIMIT), 0))
+        self.out.flush()
+
+def _member_crc32(filename, metadata):
+    """The CRC32 of a member's content, computed by reading it when the table has none"""
+    if metadata.get('crc32') is not None:
+        return metadata['crc32']
+    crc = 0
+    for data in iter_member_data(filename, metadata):
+        crc = zlib.crc32(data, crc)
+    return crc
+
+def _deflated_member(filename, metadata):
+    """Chunks function for _ZipWriter that deflates a member whose codec ZIP can't carry"""
+    def chunks(result):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        crc = 0
+        size = 0
+        for data in iter_member_data(filename, metadata):
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            with PROFILER.phase('compress', filename):
+                compressed = compressor.compress(data)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+        result['crc'] = crc
+        result['size'] = size
+    return chunks
+
+def export_zip(archive_metadata, out, names=None, progress_callback=None):
+    """Stream members into a ZIP file written to out, which only needs write().
+
+    zlib members become deflate entries by dropping the zlib wrapper, and stored
+    members become stored entries, so neither is inflated or compressed again; the
+    CRC32 comes from the table. Members in any other form are decompressed and
+    deflated. names limits and orders the members (default: all). Entry names are
+    made portable with portable_member_name.
+    progress_callback(name, original_size) is called after each member.
+    """
+    exported = _exported_names(archive_metadata, names)
+    writer = _ZipWriter(out)
+    for filename, name in exported:
+        metadata = archive_metadata[filename]
+        crc = _member_crc32(filename, metadata)
+        chunks = iter_member_payload(filename, metadata)
+        first = next(chunks, b'')
+        compression_type = first[0] if first else 0
+        reuse = None
+        if compression_type == 0:
+            reuse = ZIP_STORED, metadata['compressed_size'] - 1, itertools.chain((first[1:],), chunks)
+        elif compression_type in (1, 2, 3):
+            stripped = _zlib_payload_body(itertools.chain((first,), chunks), metadata['compressed_size'])
+            if stripped:
+                reuse = (ZIP_DEFLATED,) + stripped
+
+        if reuse:
+            method, compressed_size, body = reuse
+            writer.add(name, metadata.get('mtime'), method, crc, compressed_size, metadata['size'], body)
+        else:
+            writer.add(name, metadata.get('mtime'), ZIP_DEFLATED, None, None, None,
+                       _deflated_member(filename, metadata))
+        if progress_callback:
+            progress_callback(filename, metadata['size'])
+    writer.finish()
+
+class _MemberReader:
+    """Read-only file object over a member's content, for tarfile.addfile"""
+
+    def __init__(self, filename, metadata):
+        self._chunks = iter_member_data(filename, metadata)
+        self._chunk = b''
+        self._offset = 0        # how much of _chunk has been read
+
+    def read(self, size=-1):
+        # Slices of the current chunk, so each byte is copied once however small the reads
+        parts = []
+        while size:
+            if self._offset >= len(self._chunk):
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    break
+                self._chunk, self._offset = chunk, 0
+                continue
+            start = self._offset
+            end = len(self._chunk) if size < 0 else min(len(self._chunk), start + size)
+            parts.append(self._chunk if start == 0 and end == len(self._chunk) else self._chunk[start:end])
+            self._offset = end
+            if size > 0:
+                size -= end - start
+        return parts[0] if len(parts) == 1 else b''.join(parts)
+
+    def close(self):
+        """Finish the member so its size and CRC32 checks run"""
+        for _ in self._chunks:
+            pass
+
+def export_tar(archive_metadata, out, gzip_level=None, names=None, progress_callback=None):
+    """Stream members into a tar file written to out, gzip-compressed when gzip_level is given.
+
+    out only needs write(). Members are decompressed on the way through and each is
+    checked against its stored size and CRC32. names, entry names and
+    progress_callback work as for export_zip.
+    """
+    import gzip
+    import tarfile
+
+    exported = _exported_names(archive_metadata, names)
+    compressed = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=gzip_level, mtime=0) if gzip_level else None
+    tar = tarfile.open(fileobj=compressed or out, mode='w|', format=tarfile.PAX_FORMAT)
+    try:
+        for filename, name in exported:
+            metadata = archive_metadata[filename]
+            info = tarfile.TarInfo(name)
+            info.size = metadata['size']
+            info.mtime = (metadata.get('mtime') or time.time_ns()) / 1e9
+            info.mode = 0o644
+            reader = _MemberReader(filename, metadata)
+            tar.addfile(info, reader)
+            reader.close()
+            if progress_callback:
+                progress_callback(filename, metadata['size'])
+    finally:
+        tar.close()
+        if compressed:
+            compressed.close()
+    out.flush()
+
+def file_crc32(file_path):
+    """CRC32 of a file's contents, read in chunks"""
+    crc = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(OptimizedCompression.LARGE_CHUNK)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def member_is_current(output_file, metadata):
+    """Check whether a file on disk already holds an archive member's content.
+
+    The size has to match, and so does the stored CRC32 when the archive has one.
+    """
+    try:
+        if os.path.getsize(output_file) != metadata['size']:
+            return False
+        if metadata.get('crc32') is not None:
+            return file_crc32(output_file) == metadata['crc32']
+    except OSError:
+        return False
+    return True
+
+WALK_BATCH = 256     # files handed from a scanning thread to the consumer at a time
+
+def folder_member_prefix(folder):
+    """Start of the member names walk_files gives files below folder: its own name and a separator"""
+    return os.path.join(os.path.basename(os.path.abspath(folder)), '')
+
+def walk_files(folder, max_workers=8, tracker=None):
+    """Yield (member name, path, stat) for every file below folder as it is found.
+
+    Directories are listed with os.scandir on a small thread pool, several at a
+    time, which matters on network mounts where each listing is a round trip.
+    Scanning runs ahead of the consumer; files arrive in discovery order, not sorted.
+    Names are relative to the folder's parent, the way the archiver names files
+    from an added folder. Symlinked directories are not followed and unreadable
+    directories are skipped. If tracker (a ProgressTracker) is given, discovered
+    files are added to its totals as the scan finds them.
+    """
+    import queue
+    from concurrent.futures import ThreadPoolExecutor
+
+    root = os.path.abspath(folder)
+    prefix = len(os.path.join(os.path.dirname(root), ''))
+    found = queue.Queue()
+    lock = threading.Lock()
+    pending = 0
+    stopped = False
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(directory):
+        nonlocal pending
+        with lock:
+            pending += 1
+        try:
+            executor.submit(scan, directory)
+        except RuntimeError:
+            # The consumer stopped early and the pool is shutting down
+            finished()
+
+    def finished():
+        nonlocal pending
+        with lock:
+            pending -= 1
+            if pending == 0:
+                found.put(None)
+
+    def hand_over(batch):
+        if tracker is not None:
+            tracker.add_total(len(batch), sum(file_stat.st_size for _, _, file_stat in batch))
+        found.put(batch)
+
+    def scan(directory):
+        batch = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if stopped:
+                        break
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            submit(entry.path)
+                        elif entry.is_file():
+                            batch.append((entry.path[prefix:], Path(entry.path), entry.stat()))
+                    except OSError:
+                        continue
+                    if len(batch) >= WALK_BATCH:
+                        hand_over(batch)
+                        batch = []
+        except OSError:
+            pass
+        finally:
+            if batch:
+                hand_over(batch)
+            finished()
+
+    submit(root)
+    try:
+        while True:
+            batch = found.get()
+            if batch is None:
+                return
+            yield from batch
+    finally:
+        stopped = True
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _read_and_compress(filename, file_path):
+    data = _read_file(filename, file_path)
+    payload, crc = compress_member(filename, data)
+    return len(data), payload, crc
+
+def _stream_and_spool(spool_dir, filename, file_path):
+    totals = {}
+    with PROFILER.phase('compress', filename):
+        payload = spool_payload(compress_file_chunks(filename, file_path, totals), spool_dir)
+    return totals['size'], payload, totals['crc32']
+
+def compress_files(files, max_workers=None, read_ahead=None, budget=MEMORY_BUDGET, spool_dir=None, spool=True):
+    """Read and compress (name, path, stat) items on a thread pool.
+
+    Yields (name, path, stat, future) in input order; future.result() returns
+    (original size, payload, crc) or raises the error for that file. Up to
+    read_ahead files (default: twice the worker count) are read and compressed
+    ahead of the consumer, so disk reads overlap compression. files may be a
+    generator such as walk_files(), and it is consumed lazily.
+
+    Each file reserves compression_footprint(size) from budget before it is
+    submitted and keeps it until the consumer asks for the next result. When the
+    budget is full, results already in flight are handed out first to free it.
+    A file whose footprint is more than the whole budget is compressed from disk a
+    chunk at a time into a temporary file in spool_dir, reserving only
+    STREAM_FOOTPRINT, and its payload is a SpooledPayload rather than bytes. With
+    spool false such a file is left for the consumer to compress a chunk at a time
+    (with compress_file_chunks()) while it holds the reservation, and the result is
+    (file size, None, None).
+    """
+    from collections import deque
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+    max_workers = max_workers or min(8, os.cpu_count() or 1)
+    read_ahead = read_ahead or max_workers * 2
+    in_flight = deque()
+
+    def hand_out():
+        item = in_flight.popleft()
+        try:
+            yield item[:4]
+        finally:
+            budget.release(item[4])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for filename, file_path, file_stat in files:
+                footprint = compression_footprint(allocated_size(file_stat))
+                task = (_read_and_compress,)
+                if footprint > budget.limit:
+                    footprint = min(STREAM_FOOTPRINT, budget.limit)
+                    task = (_stream_and_spool, spool_dir) if spool else None
+                while in_flight and not budget.try_reserve(footprint):
+                    yield from hand_out()
+                if not in_flight:
+                    budget.reserve(footprint)
+                if task is None:
+                    future = Future()
+                    future.set_result((file_stat.st_size, None, None))
+                else:
+                    future = executor.submit(*task, filename, file_path)
+                in_flight.append((filename, file_path, file_stat, future, footprint))
+                if len(in_flight) >= read_ahead:
+                    yield from hand_out()
+            while in_flight:
+                yield from hand_out()
+        finally:
+            for item in in_flight:
+                item[3].cancel()
+            # Wait for anything still running before giving its memory back
+            executor.shutdown(wait=True)
+            for item in in_flight:
+                budget.release(item[4])
+                if not item[3].cancelled() and item[3].exception() is None:
+                    payload = item[3].result()[1]
+                    if isinstance(payload, SpooledPayload):
+                        payload.discard()
+
+def plan_folder_sync(archive_metadata, folder, compare_hash=False, remove_deleted=False):
+    """Compare a folder against the archive index and sort its files into sync buckets.
+
+    Member names follow add_folder_to_archive (relative to the folder's parent). A file
+    is unchanged when its size and mtime match the index; with compare_hash the stored
+    CRC32 is compared instead of the mtime whenever the index has one.
+    """
+    folder = Path(folder)
+    plan = {'unchanged': [], 'updated': [], 'added': [], 'removed': []}
+    seen = set()
+
+    for relative_name, file_path, file_stat in walk_files(folder):
+        seen.add(relative_name)
+        metadata = archive_metadata.get(relative_name)
+
+        if metadata is None:
+            plan['added'].append((relative_name, file_path, file_stat))
+            continue
+
+        if metadata['size'] != file_stat.st_size:
+            changed = True
+        elif compare_hash and metadata.get('crc32') is not None:
+            changed = file_crc32(file_path) != metadata['crc32']
+        else:
+            changed = metadata.get('mtime') != file_stat.st_mtime_ns
+
+        if changed:
+            plan['updated'].append((relative_name, file_path, file_stat))
+        else:
+            plan['unchanged'].append(relative_name)
+
+    if remove_deleted:
+        prefix = folder_member_prefix(folder)
+        plan['removed'] = [name for name in archive_metadata
+                           if name.startswith(prefix) and name not in seen]
+
+    return plan
+
+def create_incremental_archive(file_path, base_path, folder, compare_hash=False, progress_callback=None):
+    """Write a child archive of a folder that only stores files differing from a base archive.
+
+    Files that are unchanged since the base are written as references to their data in the
+    base (or further up its chain, so reading never takes more than one hop). Files deleted
+    from the folder are left out. Returns the sync plan that was applied.
+    """
+    base_metadata, _ = read_archive_table(base_path)
+    plan = plan_folder_sync(base_metadata, folder, compare_hash, remove_deleted=True)
+
+    archive_metadata = base_metadata
+    set_base_archives(archive_metadata, True)
+    for filename in plan['removed']:
+        del archive_metadata[filename]
+    for relative_name, file_path_on_disk, file_stat in plan['updated'] + plan['added']:
+        archive_metadata[relative_name] = new_member_metadata(file_path_on_disk, file_stat.st_size, 0,
+                                                              mtime=file_stat.st_mtime_ns)
+
+    write_archive(file_path, archive_metadata, progress_callback)
+    return plan
+
+def scan_directory(path):
+    """List a directory in one os.scandir pass for the file browser.
+
+    Returns (name, is_dir, size) tuples, folders first, each group sorted
+    case-insensitively; size is None for folders. Entries that vanish or
+    can't be stat'ed while listing are skipped.
+    """
+    folders = []
+    files = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    folders.append((entry.name, True, None))
+                elif entry.is_file():
+                    files.append((entry.name, False, entry.stat().st_size))
+            except OSError:
+                continue
+    folders.sort(key=lambda item: item[0].lower())
+    files.sort(key=lambda item: item[0].lower())
+    return folders + files
+
+def collect_input_files(paths):
+    """Expand files and folders into (member name, path, stat) tuples.
+
+    Files are named after themselves and folder contents relative to the folder's
+    parent, the same way the archiver names files it adds.
+    """
+    collected = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            collected.extend(walk_files(path))
+        else:
+            collected.append((path.name, path, path.stat()))
+    return collected
+
+def extract_member(filename, metadata, extract_path, skip_current=False, payload=None):
+    """Stream one member to disk under extract_path.
+
+    Returns the number of bytes written, or None when skip_current is set and the file
+    on disk is already up to date. A member that fails its checks is not left behind.
+    payload is the member's stored bytes, when they have been read already.
+    """
+    extract_path = Path(extract_path)
+    output_file = extract_path / filename
+    # Refuse names that would land outside the extraction directory
+    if not os.path.abspath(output_file).startswith(os.path.join(os.path.abspath(extract_path), '')):
+        raise ValueError(f"{filename}: refusing to extract outside {extract_path}")
+
+    if skip_current and member_is_current(output_file, metadata):
+        return None
+
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        with open(output_file, 'wb') as f:
+            # Seeking over the holes of a sparse member leaves them as holes in the new file
+            for offset, data in iter_member_extents(filename, metadata, payload):
+                if offset != f.tell():
+                    f.seek(offset)
+                f.write(data)
+            f.truncate(metadata['size'])
+    except BaseException:
+        try:
+            output_file.unlink()
+        except OSError:
+            pass
+        raise
+    return metadata['size']
+
+
+def stored_member_name(archive_metadata, name):
+    """The name a member is stored under in archive_metadata, or None.
+
+    name is tried as given and then with either separator, since archives created on
+    Windows store names with '\\' and names typed or listed elsewhere use '/'.
+    """
+    for candidate in (name, name.replace('\\', '/'), name.replace('/', '\\')):
+        if candidate in archive_metadata:
+            return candidate
+    return None
+
+def _glob_matcher(patterns):
+    """Match function for a list of globs: literal names and folders in sets, wildcards in one regex.
+
+    Patterns and member names are compared with '/' for either separator.
+    """
+    literal = set()
+    folders = []
+    wildcards = []
+    for pattern in patterns:
+        pattern = pattern.replace('\\', '/')
+        if any(c in pattern for c in '*?['):
+            wildcards.append(fnmatch.translate(pattern))
+        else:
+            literal.add(pattern)
+            folders.append(pattern.rstrip('/') + '/')
+    regex = re.compile('|'.join(wildcards)).match if wildcards else None
+    folders = tuple(folders)
+
+    def matches(name):
+        name = name.replace('\\', '/')
+        return name in literal or name.startswith(folders) or (regex is not None and regex(name) is not None)
+    return matches
+
+def select_members(archive_metadata, include=None, exclude=None):
+    """Members matching any include glob and no exclude glob; returns (names, unmatched include patterns).
+
+    Globs follow fnmatch, so * also matches '/', and a pattern without wildcards
+    selects that member or everything in that folder. Patterns that are member names
+    are looked up directly, so a list of names costs nothing per archive member; any
+    other pattern takes one pass over the index. Either separator matches either in
+    patterns and names. Without include, every member is selected. Listed names come
+    first, then other matches in archive order.
+    """
+    include = [pattern.replace('\\', '/') for pattern in include or ()]
+    unmatched = []
+    if not include:
+        names = list(archive_metadata)
+    else:
+        listed = [stored_member_name(archive_metadata, pattern) for pattern in include]
+        names = [name for name in listed if name is not None]
+        rest = [pattern for pattern, name in zip(include, listed) if name is None]
+        if rest:
+            matches = _glob_matcher(rest)
+            found = [name for name in archive_metadata if matches(name)]
+            for pattern in rest:
+                matches = _glob_matcher([pattern])
+                if not any(matches(name) for name in found):
+                    unmatched.append(pattern)
+            names += found
+        names = list(dict.fromkeys(names))
+    if exclude:
+        excluded = _glob_matcher(exclude)
+        names = [name for name in names if not excluded(name)]
+    return names, unmatched
+
+COALESCE_GAP = 64 * 1024            # members this close in an archive are fetched by one read
+COALESCE_SPAN = 4 * 1024 * 1024     # largest read shared by several members
+
+def _coalesced_batches(items):
+    """Group (name, metadata) items into lists that one read of their archive can fetch.
+
+    Members are sorted by data_offset within each archive file, neighbours closer than
+    COALESCE_GAP share a read of at most COALESCE_SPAN, and batches take turns between
+    archive files like _reading_order(). Members not stored in an archive (or too big
+    to share a read) get a batch to themselves and are streamed.
+    """
+    by_file = {}
+    for item in items:
+        stored = _PayloadCopier.stored_range(item[1])
+        key = stored[0] if stored and stored[2] <= COALESCE_SPAN else None
+        by_file.setdefault(key, []).append(item)
+
+    runs = [[[item] for item in by_file.pop(None, [])]]
+    for _, members in sorted(by_file.items()):
+        members.sort(key=lambda item: item[1]['data_offset'])
+        batches = []
+        batch_start = batch_end = None
+        for item in members:
+            offset = item[1]['data_offset']
+            end = offset + item[1]['compressed_size']
+            if batches and offset - batch_end <= COALESCE_GAP and end - batch_start <= COALESCE_SPAN:
+                batches[-1].append(item)
+                batch_end = max(batch_end, end)
+            else:
+                batches.append([item])
+                batch_start, batch_end = offset, end
+        runs.append(batches)
+    return [batch for group in itertools.zip_longest(*runs) for batch in group if batch is not None]
+
+def _extract_batch(batch, extract_path, skip_current):
+    """Extract a batch from _coalesced_batches(); returns (name, written, error) for each member"""
+    if len(batch) == 1:
+        filename, metadata = batch[0]
+        try:
+            return [(filename, extract_member(filename, metadata, extract_path, skip_current), None)]
+        except (OSError, ValueError) as e:
+            return [(filename, None, e)]
+
+    archive_file = batch[0][1]['archive_file']
+    start = batch[0][1]['data_offset']
+    end = max(metadata['data_offset'] + metadata['compressed_size'] for _, metadata in batch)
+    try:
+        with PROFILER.phase('read', archive_file):
+            with open(archive_file, 'rb') as f:
+                f.seek(start)
+                span = f.read(end - start)
+    except OSError as e:
+        return [(filename, None, e) for filename, _ in batch]
+
+    results = []
+    for filename, metadata in batch:
+        offset = metadata['data_offset'] - start
+        payload = span[offset:offset + metadata['compressed_size']]
+        try:
+            if len(payload) != metadata['compressed_size']:
+                raise ValueError(f"Archive data for {filename} is truncated")
+            results.append((filename, extract_member(filename, metadata, extract_path, skip_current, payload), None))
+        except (OSError, ValueError) as e:
+            results.append((filename, None, e))
+    return results
+
+def extract_members(archive_metadata, names, extract_path, skip_current=False, max_workers=None,
+                    progress_callback=None):
+    """Extract members with extract_member() on a thread pool, reading only their byte ranges.
+
+    The members are sorted by data_offset and neighbours are fetched together by one
+    read (see _coalesced_batches), so pulling a few files out of a huge archive costs
+    their own I/O and little more; the volumes of a multi-volume archive are read side
+    by side. progress_callback(filename, written, error) is called on the calling
+    thread as each member finishes, with written None for a skipped member and error
+    set (written None) when it failed. Returns the number of failures.
+    """
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+    max_workers = max_workers or min(8, os.cpu_count() or 1)
+    batches = iter(_coalesced_batches((filename, archive_metadata[filename]) for filename in names))
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = set()
+        while True:
+            while len(pending) < max_workers * 2:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                pending.add(pool.submit(_extract_batch, batch, extract_path, skip_current))
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                for filename, written, error in future.result():
+                    if error is not None:
+                        failures += 1
+                    if progress_callback:
+                        progress_callback(filename, written, error)
+    return failures
+
+class DirectoryNode:
+    """One folder in a DirectoryIndex, with totals for everything below it"""
+    __slots__ = ('path', 'parent', 'folders', 'files', 'count', 'size', 'compressed_size')
+
+    def __init__(self, path, parent):
+        self.path = path            # 'photos/2020/' ('' for the root)
+        self.parent = parent
+        self.folders = {}           # component -> DirectoryNode
+        self.files = {}             # member name -> (size, compressed_size) for direct children
+        self.count = 0
+        self.size = 0
+        self.compressed_size = 0
+
+
+class DirectoryIndex:
+    """Folder tree (path trie) over archive member names.
+
+    Member names may use either separator; folder paths are normalized to '/'
+    and end with '/'. Adding, replacing and removing a member only walks its own
+    folder chain, so the per-folder totals stay current without rescanning.
+    """
+
+    def __init__(self):
+        self.root = DirectoryNode('', None)
+        self.folders = {'': self.root}     # folder path -> node
+
+    @staticmethod
+    def split(name):
+        """Return (folder path, base name) for a member name"""
+        folder, _, base = name.replace('\\', '/').rpartition('/')
+        return (folder + '/' if folder else ''), base
+
+    def add(self, name, size, compressed_size):
+        """Add a member, or replace the sizes of one already indexed"""
+        folder_path, _ = self.split(name)
+        node = self.folders.get(folder_path)
+        if node is None:
+            node = self.root
+            for component in folder_path.split('/')[:-1]:
+                child = node.folders.get(component)
+                if child is None:
+                    child = node.folders[component] = DirectoryNode(node.path + component + '/', node)
+                    self.folders[child.path] = child
+                node = child
+
+        previous = node.files.get(name)
+        node.files[name] = (size, compressed_size)
+        count = 1
+        if previous is not None:
+            count = 0
+            size -= previous[0]
+            compressed_size -= previous[1]
+        while node is not None:
+            node.count += count
+            node.size += size
+            node.compressed_size += compressed_size
+            node = node.parent
+
+    def remove(self, name):
+        """Remove a member, dropping folders that become empty"""
+        folder_path, _ = self.split(name)
+        node = self.folders.get(folder_path)
+        if node is None or name not in node.files:
+            return
+        size, compressed_size = node.files.pop(name)
+        while node is not None:
+            node.count -= 1
+            node.size -= size
+            node.compressed_size -= compressed_size
+            parent = node.parent
+            if parent is not None and node.count == 0:
+                del parent.folders[node.path[len(parent.path):-1]]
+                del self.folders[node.path]
+            node = parent
+
+    def members_under(self, folder_path):
+        """Yield every member name below a folder, visiting only that subtree"""
+        node = self.folders.get(folder_path)
+        if node is None:
+            return
+        pending = [node]
+        while pending:
+            node = pending.pop()
+            yield from node.files
+            pending.extend(node.folders.values())